@@ -7,7 +7,7 @@ if [[ ! -d $DIR ]]; then
   exit -1
 fi
 
-python publisher/build_paper.py $DIR
+python publisher/build_paper.py $DIR "${@:2}"
 if [ "$?" -ne "0" ]; then
     echo "Error building paper $DIR. Aborting."
     exit 1
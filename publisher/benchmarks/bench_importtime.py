@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""
+Check the start-up time of the publisher tools against a budget.
+
+Every entry point is imported in a fresh interpreter under
+``python -X importtime``, and the cumulative import time of its module
+is compared with the budget below; the modules taking longest to import
+are listed, to find what to load lazily.  The script exits with a
+non-zero status if an entry point goes over its budget.
+
+Only the tools themselves are imported, not run, so the timings leave
+out the interpreter start-up (``site``) but include every module pulled
+in at import time.  The mail scripts do their work at module level;
+only their top-level ``import`` statements are timed.  Run from the ``publisher`` directory::
+
+    python benchmarks/bench_importtime.py --repeat 5
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import ast
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+publisher_dir = os.path.normpath(os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..'))
+
+# Entry points: module, directory it runs from, and budget in milliseconds.
+# Importing docutils, lxml or pypdf alone takes 40-130 ms; the budgets
+# only leave room for the standard library and the publisher modules.
+entry_points = [
+    ('build_paper', '.', 50),
+    ('build_papers', '.', 80),
+    ('build_html', '.', 80),
+    ('build_template', '.', 70),
+    ('build_proceedings', '.', 80),
+    ('_mailer', 'mail', 80),
+    ('mail_authors', 'mail', 80),
+    ('mail_dois', 'mail', 80),
+    ('mail_reviewers', 'mail', 80),
+]
+
+# Entry points that run when imported
+scripts = {'mail_authors', 'mail_dois', 'mail_reviewers'}
+
+
+def startup_imports(module, cwd):
+    """Return the source of the top-level imports of script `module`."""
+    filename = os.path.join(publisher_dir, cwd, module + '.py')
+    with io.open(filename, encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    tree = ast.parse('\n'.join(lines), filename)
+    return '\n'.join('\n'.join(lines[node.lineno - 1:node.end_lineno])
+                     for node in tree.body
+                     if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+
+def import_times(module, cwd):
+    """Return the cumulative import time, in microseconds, of every module
+    imported by ``import <module>``, by module name.
+
+    A script is replaced by a module of the same name holding only its
+    imports, found first on ``sys.path``.
+    """
+    code = 'import ' + module
+    stub_dir = None
+    if module in scripts:
+        stub_dir = tempfile.mkdtemp()
+        with io.open(os.path.join(stub_dir, module + '.py'), mode='w',
+                     encoding='utf-8') as f:
+            f.write(startup_imports(module, cwd) + '\n')
+        code = 'import sys; sys.path.insert(0, %r); %s' % (stub_dir, code)
+    try:
+        proc = subprocess.Popen([sys.executable, '-X', 'importtime', '-c',
+                                 code],
+                                cwd=os.path.join(publisher_dir, cwd),
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+    finally:
+        if stub_dir is not None:
+            shutil.rmtree(stub_dir)
+    if proc.returncode:
+        raise RuntimeError("Cannot import %s:\n%s"
+                           % (module, err.decode('utf-8', 'replace')))
+
+    times = {}
+    for line in err.decode('utf-8', 'replace').splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            cumulative = int(fields[1])
+        except ValueError:
+            # The header line
+            continue
+        name = fields[2].strip()
+        times[name] = max(cumulative, times.get(name, 0))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="imports per entry point, the fastest counts")
+    parser.add_argument('--top', type=int, default=3,
+                        help="slowest imports listed per entry point")
+    args = parser.parse_args()
+
+    print("%-20s %10s %10s  %s" % ('entry point', 'time (ms)', 'budget',
+                                   'slowest imports (ms)'))
+    over = []
+    for module, cwd, budget in entry_points:
+        runs = [import_times(module, cwd) for i in range(args.repeat)]
+        best = min(runs, key=lambda times: times[module])
+        total = best[module] / 1000.
+
+        slowest = sorted((name for name in best if name != module),
+                         key=best.get, reverse=True)[:args.top]
+        print("%-20s %10.1f %10d  %s"
+              % (module, total, budget,
+                 ', '.join('%s %.1f' % (name, best[name] / 1000.)
+                           for name in slowest)))
+        if total > budget:
+            over.append(module)
+
+    if over:
+        print("Over budget:", ', '.join(over))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""
+Measure the throughput of sending mail the way the mail tools do, with
+``_outbox.deliver`` over an ``_mailer.SMTPPool``.
+
+Messages are sent to a local stand-in SMTP server which accepts
+everything, waiting ``--latency`` seconds before each reply to mimic
+the round trips to a remote server.  One connection per message, as
+the mail tools used to do, is compared with the pool at several sizes;
+deliveries are recorded in a scratch outbox, as they are in production.
+Any other server can be used instead with ``--host`` and ``--port``,
+e.g. aiosmtpd (``python -m aiosmtpd -n -l localhost:8025``).
+
+Run from the ``publisher`` directory::
+
+    python benchmarks/bench_mail.py --messages 200 --jobs 1 2 4 8
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import os
+import smtplib
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'mail'))
+
+import _mailer
+import _outbox
+
+
+class StandInHandler(socketserver.StreamRequestHandler):
+    """Speaks just enough SMTP to accept any message."""
+    latency = 0.
+
+    def reply(self, line):
+        time.sleep(self.latency)
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self.reply('220 localhost stand-in')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b'QUIT':
+                self.reply('221 Bye')
+                return
+            elif command == b'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                self.reply('250 OK')
+            else:
+                self.reply('250 OK')
+
+
+class StandInServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def one_connection_per_message(host, port, messages):
+    for sender, recipients, message in messages:
+        session = smtplib.SMTP(host, port)
+        session.ehlo()
+        session.sendmail(sender, recipients, _mailer.encode_message(message))
+        session.quit()
+
+
+def pooled(host, port, messages, jobs):
+    with tempfile.TemporaryDirectory() as td:
+        outbox = _outbox.Outbox(os.path.join(td, 'outbox.jsonl'))
+        for sender, recipients, message in messages:
+            outbox.add(recipients[0], (host, port),
+                       {'name': sender, 'login': None}, recipients, message)
+        with _mailer.SMTPPool(host, port, size=jobs, starttls=False) as pool:
+            _outbox.deliver(outbox, outbox.pending(), pool, jobs,
+                            _mailer.encode_message)
+        failed = len(outbox.pending())
+    if failed:
+        print("%d messages failed" % failed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--messages', type=int, default=100)
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help="pool sizes to measure")
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help="seconds the stand-in server waits before "
+                             "each reply (default: %(default)s)")
+    parser.add_argument('--host', default=None)
+    parser.add_argument('--port', type=int, default=8025)
+    args = parser.parse_args()
+
+    host, port = args.host, args.port
+    if host is None:
+        StandInHandler.latency = args.latency
+        server = StandInServer(('127.0.0.1', 0), StandInHandler)
+        threading.Thread(target=server.serve_forever).start()
+        host, port = server.server_address
+
+    message = ('From: editor@example.org\nTo: author@example.org\n'
+               'Subject: Your paper\n\n' + 'Dear author,\n' * 40)
+    messages = [('editor@example.org', ['author%d@example.org' % i], message)
+                for i in range(args.messages)]
+
+    print("%-28s %10s %12s" % ('sending', 'time (s)', 'messages/s'))
+    runs = [('one connection per message',
+             lambda: one_connection_per_message(host, port, messages))]
+    runs += [('pool of %d' % jobs,
+              lambda jobs=jobs: pooled(host, port, messages, jobs))
+             for jobs in args.jobs]
+    try:
+        for name, run in runs:
+            start = time.time()
+            run()
+            elapsed = time.time() - start
+            print("%-28s %10.2f %12.1f" % (name, elapsed,
+                                           len(messages) / elapsed))
+    finally:
+        if args.host is None:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    main()
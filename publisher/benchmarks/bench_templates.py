@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""
+Time lexing, parsing and rendering of the publisher templates.
+
+Besides the templates in ``_templates`` and ``mail/templates``, large
+templates are generated by unrolling the TOC loop of
+``proceedings.tex.tmpl`` once per paper, so that the scaling of the
+lexer with template size can be checked: doubling the number of entries
+should roughly double the time taken.
+
+Run from the ``publisher`` directory::
+
+    python benchmarks/bench_templates.py --entries 125 250 500 1000
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import io
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import tempita
+from build_template import TeXTemplate
+from conf import template_dir, work_dir
+
+mail_template_dir = os.path.join(work_dir, 'mail', 'templates')
+
+toc_entry = """
+  %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+  \\textsf{\\hyperlink{../pdfs/{{toc[%(i)d]['paper_id']}}.pdf.1}{%%
+{{toc[%(i)d]['title']}}}%%
+  \\hfill%%
+  \\textbf{ {{toc[%(i)d]['page']['start']}} }%%
+  \\\\%%
+\\small\\textit{%%
+\\parbox{0.9\\textwidth}{
+{{toc[%(i)d]['authors']}} }%%
+}%%
+}%%
+  \\\\
+"""
+
+
+def make_toc(entries):
+    return [{'paper_id': 'paper_%d' % i,
+             'title': 'A paper on topic number %d' % i,
+             'authors': 'Jane Doe, John Roe',
+             'page': {'start': 1 + 8 * i, 'stop': 8 + 8 * i}}
+            for i in range(entries)]
+
+
+def make_config(entries):
+    return {'toc': make_toc(entries),
+            'slides': [], 'posters': [], 'lightning': [], 'tools': []}
+
+
+def make_mail_config():
+    config = dict((key, key) for key in
+                  ('author_email', 'author', 'built_proceedings_url', 'cced',
+                   'committee', 'conference', 'doi', 'download', 'due',
+                   'editors', 'email', 'review_form', 'reviews_url',
+                   'submit_email', 'title', 'year'))
+    config['papers'] = ['paper_%d' % i for i in range(3)]
+    config['sender'] = {'name': 'Sender'}
+    config['proceedings'] = {'editor_email': 'editor@example.org',
+                             'title': {'acronym': 'SciPy',
+                                       'conference': 'Conference',
+                                       'ordinal': '1st'},
+                             'xref': {'depositor_email': 'xref@example.org',
+                                      'depositor_name': 'Depositor'},
+                             'year': '2026'}
+    return config
+
+
+def unrolled_template(entries):
+    """Return a TeX template with one literal TOC entry per paper."""
+    head = '\\begin{document}\n{{if slides}}slides{{endif}}\n'
+    body = ''.join(toc_entry % {'i': i} for i in range(entries))
+    return head + body + '\\end{document}\n'
+
+
+def read(path):
+    with io.open(path, mode='r', encoding='utf-8') as f:
+        return f.read()
+
+
+def best(stmt, repeat, number=1):
+    return min(timeit.repeat(stmt, repeat=repeat, number=number)) / number
+
+
+def bench(name, content, config, template_class, repeat):
+    lex = best(lambda: tempita.lex(content, name=name), repeat)
+    parse = best(lambda: tempita.parse(content, name=name), repeat)
+    template = template_class(content, name=name)
+    render = best(lambda: template.substitute(config), repeat)
+    print("%-32s %9d %10.4f %10.4f %10.4f" % (name, len(content),
+                                              lex, parse, render))
+    return lex
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--entries', type=int, nargs='+',
+                        default=[125, 250, 500, 1000],
+                        help="TOC lengths of the generated templates")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print("%-32s %9s %10s %10s %10s" % ('template', 'chars',
+                                        'lex (s)', 'parse (s)', 'render (s)'))
+
+    bench('proceedings.tex.tmpl (500)',
+          read(os.path.join(template_dir, 'proceedings.tex.tmpl')),
+          make_config(500), TeXTemplate, args.repeat)
+    for fn in sorted(os.listdir(mail_template_dir)):
+        content = read(os.path.join(mail_template_dir, fn))
+        bench(fn, content, make_mail_config(), tempita.HTMLTemplate, args.repeat)
+
+    print()
+    previous = None
+    for entries in args.entries:
+        lex = bench('unrolled toc (%d)' % entries, unrolled_template(entries),
+                    make_config(entries), TeXTemplate, args.repeat)
+        if previous is not None:
+            print("%-32s lex time x%.2f for x%.2f entries"
+                  % ('', lex / previous[1], entries / float(previous[0])))
+        previous = (entries, lex)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""
+Time the generation of the CrossRef DOI metadata of the whole archive.
+
+The proceedings configuration and TOC of every year in ``metadata/``
+that has both are loaded, and the DOI batches of each year generated
+with ``xreftools.XrefMeta``, first with an empty name cache, then again
+with the names already split.  ``--copies`` repeats the archive, to
+mimic a larger back catalogue.
+
+The papers of all years are then written as a single batch, as for a
+redeposit of the back catalogue, once by building the tree in memory
+and once streamed; each runs in a child process, to compare the growth
+of their peak memory use, and the time the first bytes are written.
+
+Run from the ``publisher`` directory::
+
+    python benchmarks/bench_xref.py --copies 10
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import glob
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import options
+import xreftools
+from conf import work_dir
+
+
+def load_archive():
+    """Return the proceedings configuration and TOC of every year."""
+    years = []
+    for proc_conf in sorted(glob.glob(os.path.join(work_dir, 'metadata', '*',
+                                                   'scipy_proc.json'))):
+        toc_conf = os.path.join(os.path.dirname(proc_conf), 'toc.json')
+        if os.path.exists(toc_conf):
+            years.append((options.cfg2dict(proc_conf),
+                          options.cfg2dict(toc_conf)['toc']))
+    return years
+
+
+def generate(years):
+    for scipy_entry, toc in years:
+        xref = xreftools.XrefMeta(scipy_entry, toc, {})
+        xref.make_metadata()
+
+
+class Output(object):
+    """Discards what is written, recording when the first bytes were."""
+    first_write = None
+
+    def write(self, data):
+        if self.first_write is None:
+            self.first_write = time.time()
+
+
+def write_batch(years, mode):
+    """Write the papers of all `years` as one batch, and print the time
+    taken, the time to the first bytes written and the growth of the
+    peak memory use.
+    """
+    toc = [entry for scipy_entry, entries in years for entry in entries]
+    xref = xreftools.XrefMeta(years[0][0], toc, {})
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    out = Output()
+    start = time.time()
+    if mode == 'tree':
+        xref.make_metadata()
+        xreftools.xml.ElementTree(xref.papers_batch).write(out)
+    else:
+        xref.names = xreftools.split_names(xref.contributor_names())
+        xref.stream_papers_batch(out)
+    end = time.time()
+    growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+    # ru_maxrss is in kilobytes on Linux
+    print("%-32s %10.4f s %10.4f s %8.1f MB"
+          % ('write one batch, ' + mode, end - start,
+             out.first_write - start, growth / 1024.))
+
+
+def best(func, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--copies', type=int, default=1,
+                        help="times the archive is repeated")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--write', choices=['tree', 'stream'],
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    years = load_archive() * args.copies
+    if args.write:
+        write_batch(years, args.write)
+        return
+    papers = sum(len(toc) for scipy_entry, toc in years)
+    names = sum(len(entry.get('author', []))
+                for scipy_entry, toc in years for entry in toc)
+    print("%d years, %d papers, %d author names" % (len(years), papers, names))
+
+    def cold():
+        xreftools.parse_name.cache_clear()
+        generate(years)
+
+    print("%-32s %10.4f s" % ('make_metadata, empty name cache',
+                              best(cold, args.repeat)))
+    print("%-32s %10.4f s" % ('make_metadata, names cached',
+                              best(lambda: generate(years), args.repeat)))
+
+    print()
+    print("%-32s %12s %12s %11s" % ('', 'total', 'first bytes',
+                                    'peak memory'))
+    sys.stdout.flush()
+    for mode in ('tree', 'stream'):
+        subprocess.check_call([sys.executable, __file__, '--copies',
+                               str(args.copies), '--write', mode])
+
+
+if __name__ == '__main__':
+    main()
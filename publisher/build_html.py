@@ -1,42 +1,131 @@
 #!/usr/bin/env python
 
 import os
+import io
 import glob
-import shutil
-from copy import deepcopy
+import argparse
 
-from conf import bib_dir, template_dir, html_dir, static_dir, pdf_dir
+import buildprofile
+import synctools
+from conf import (bib_dir, template_dir, html_dir, static_dir, pdf_dir,
+                  profile_conf)
 from options import get_config, mkdir_p
-from build_template import bib_from_tmpl, html_from_tmpl, from_template
+from build_template import (bib_from_tmpl, html_from_tmpl, from_template,
+                            render_template, render_html, bib_path,
+                            html_path)
 
-config = get_config()
-mkdir_p(bib_dir)
-for file in glob.glob(os.path.join(static_dir,'*.css')):
-    shutil.copy(file, html_dir)
-html_pdfs = os.path.join(html_dir, 'pdfs')
-mkdir_p(html_pdfs)
-for file in glob.glob(os.path.join(pdf_dir,'*.pdf')):
-    shutil.copy(file, html_pdfs)
+# Proceedings configuration shared, read-only, by all articles of a worker
+config = None
 
-citation_key = config['proceedings']['citation_key'] # e.g. proc-scipy-2010
 
-bib_from_tmpl('proceedings', config, citation_key)
+def _init_worker(proc_config):
+    global config
+    config = proc_config
 
-proc_dict = deepcopy(config)
-proc_dict.update({
-    'pdf': 'pdfs/proceedings.pdf',
-    'bibtex': 'bib/' + citation_key + '.bib'
-    })
 
-for dest_fn in ['index', 'organization', 'slides', 'students']:
-    html_from_tmpl(dest_fn+'.html', proc_dict, dest_fn)
+def article_config(article):
+    """Return the template namespace of an article.
 
-for article in config['toc']:
-    art_dict = deepcopy(config)
+    Rendering only adds top-level keys to its namespace, so a shallow
+    copy is enough to keep the shared configuration untouched.
+    """
+    art_dict = dict(config)
     art_dict.update({
         'article': article,
         'pdf': 'pdfs/'+article['paper_id']+'.pdf',
         'bibtex': 'bib/'+article['paper_id']+'.bib',
         })
-    bib_from_tmpl('article', art_dict, article['paper_id'])
-    html_from_tmpl('article.html',art_dict, article['paper_id'])
+    return art_dict
+
+
+def render_article(article):
+    """Render the .bib and .html pages of an article.
+
+    Returns a list of ``(path, content)`` pairs, and the profile records
+    of the rendering.
+    """
+    paper_id = article['paper_id']
+    with buildprofile.paper(paper_id), buildprofile.stage('render_article'):
+        bib_file = bib_path(paper_id)
+        outputs = [
+            (bib_file, render_template('article.bib', article_config(article),
+                                       bib_file)),
+            (html_path(paper_id), render_html('article.html',
+                                              article_config(article))),
+            ]
+    return outputs, buildprofile.drain()
+
+
+def write_files(outputs):
+    for path, content in outputs:
+        with io.open(path, mode='w', encoding='utf-8') as f:
+            f.write(content)
+
+
+def render_articles(toc, jobs):
+    """Render the pages of all articles in `toc` on `jobs` processes, and
+    write them out once all are done.
+    """
+    outputs = []
+    if jobs > 1:
+        import multiprocessing
+
+        pool = multiprocessing.Pool(jobs, initializer=_init_worker,
+                                    initargs=(config,))
+        try:
+            results = pool.map(render_article, toc, chunksize=8)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [render_article(article) for article in toc]
+
+    for article_outputs, recs in results:
+        outputs.extend(article_outputs)
+        buildprofile.records.extend(recs)
+
+    with buildprofile.stage('write_articles'):
+        write_files(outputs)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build the proceedings "
+                                     "website.")
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help="number of processes rendering articles "
+                             "(default: 1, i.e. one after the other)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+
+    config = get_config()
+    mkdir_p(bib_dir)
+    with buildprofile.stage('copy_static') as record:
+        synctools.record(record, *synctools.sync_files(
+            glob.glob(os.path.join(static_dir,'*.css')), html_dir))
+        html_pdfs = os.path.join(html_dir, 'pdfs')
+        mkdir_p(html_pdfs)
+        synctools.record(record, *synctools.sync_files(
+            glob.glob(os.path.join(pdf_dir,'*.pdf')), html_pdfs))
+
+    citation_key = config['proceedings']['citation_key'] # e.g. proc-scipy-2010
+
+    bib_from_tmpl('proceedings', config, citation_key)
+
+    proc_dict = dict(config)
+    proc_dict.update({
+        'pdf': 'pdfs/proceedings.pdf',
+        'bibtex': 'bib/' + citation_key + '.bib'
+        })
+
+    with buildprofile.stage('render_index'):
+        for dest_fn in ['index', 'organization', 'slides', 'students']:
+            html_from_tmpl(dest_fn+'.html', proc_dict, dest_fn)
+
+    render_articles(config['toc'], args.jobs)
+
+    buildprofile.write_report(profile_conf, 'build_html')
+    buildprofile.print_summary()
@@ -1,22 +1,23 @@
 #!/usr/bin/env python
 from __future__ import print_function, unicode_literals
 
-import docutils.core as dc
 import os
 import os.path
 import sys
 import re
 import tempfile
 import glob
-import shutil
 import io
+import hashlib
 
-from distutils import dir_util
-
-from writer import writer
 from conf import papers_dir, output_dir, status_file, static_dir
 
+import buildcache
+import figures
+import buildprofile
+import conf
 import options
+import synctools
 
 header = r'''
 .. role:: ref
@@ -43,15 +44,77 @@ header = r'''
 
 '''
 
-def rst2tex(in_path, out_path):
+pdflatex_command = ['pdflatex', '-halt-on-error']
+
+# pdflatex gives up on a paper whose auxiliary files have not converged
+# after this many passes.
+max_latex_passes = 5
+
+# Files pdflatex writes during a pass and reads back on the next one.
+rerun_files = ('paper.aux', 'paper.bbl', 'paper.toc', 'paper.out')
+
+# Lines of the .aux file that bibtex reads.
+bibtex_aux_commands = (b'\\citation{', b'\\bibdata{', b'\\bibstyle{')
+
+# Path of a precompiled format holding the preamble shared by all
+# papers, see `preload_format`.  When None, every pdflatex pass reads
+# the whole preamble again.
+tex_format = None
+
+# Start of the part of the docutils LaTeX header that follows the
+# custom preamble, and therefore differs from paper to paper.
+_preamble_end = '%%% User specified packages and stylesheets'
+
+# Appended to the shared preamble before dumping it.  The document class
+# is already part of the format, so the \documentclass line at the top
+# of every paper.tex must be skipped.
+_format_trailer = r'''
+\makeatletter
+\def\documentclass{\@ifnextchar[{\scipy@skipclass}{\scipy@skipclass[]}}
+\def\scipy@skipclass[#1]#2{}
+\makeatother
+\dump
+'''
+
 
-    dir_util.copy_tree(in_path, out_path)
+def copy_sources(in_path, out_path):
+    """Copy the paper sources and the LaTeX styles into `out_path`.
 
+    The figures downsampled by the previous build are left out, for
+    `figures.prepare` to bring up to date.
+    """
+    with buildprofile.stage('copy_tree') as record:
+        synctools.record(record, *synctools.sync_tree(
+            in_path, out_path, exclude=figures.prepared_figures(out_path)))
+        synctools.record(record, *copy_styles(out_path))
+
+
+def copy_styles(out_path):
+    """Copy ``scipy.sty`` and the status style into `out_path`.
+
+    Returns the number of bytes copied and skipped, see `synctools`.
+    """
     base_dir = os.path.dirname(__file__)
-    out_file = shutil.copy(status_file, out_path)
-    os.rename(out_file, os.path.join(out_path, 'status.sty'))
     scipy_style = os.path.join(base_dir, '_static/scipy.sty')
-    shutil.copy(scipy_style, out_path)
+    copied, skipped = synctools.sync_file(
+        status_file, os.path.join(out_path, 'status.sty'))
+    c, s = synctools.sync_file(scipy_style,
+                               os.path.join(out_path, 'scipy.sty'))
+    return copied + c, skipped + s
+
+
+_latex_settings = None
+
+def latex_settings():
+    """Return the docutils settings shared by all papers.
+    """
+    global _latex_settings
+    if _latex_settings is None:
+        _latex_settings = _make_latex_settings()
+    return dict(_latex_settings)
+
+
+def _make_latex_settings():
     preamble = u'''\\usepackage{scipy}'''
 
     # Add the LaTeX commands required by Pygments to do syntax highlighting
@@ -78,6 +141,26 @@ def rst2tex(in_path, out_path):
                 'documentoptions': 'letterpaper,compsoc,twoside',
                 'halt_level': 3,  # 2: warn; 3: error; 4: severe
                 }
+    return settings
+
+
+def rst2tex(in_path, out_path):
+
+    copy_sources(in_path, out_path)
+    write_tex(in_path, out_path)
+    with buildprofile.stage('figures'):
+        figures.prepare(in_path, out_path)
+
+
+def write_tex(in_path, out_path):
+    """Convert the .rst of the paper in `in_path` to ``paper.tex`` and
+    ``paper_stats.json`` in `out_path`.
+    """
+    # Imported here: docutils takes long to load, and is not needed when
+    # the paper comes from the build cache.
+    from writer import publish_tex
+
+    settings = latex_settings()
 
     try:
         rst, = glob.glob(os.path.join(in_path, '*.rst'))
@@ -88,15 +171,18 @@ def rst2tex(in_path, out_path):
     with io.open(rst, mode='r', encoding='utf-8') as f:
         content = header + f.read()
     
-    tex = dc.publish_string(source=content, writer=writer,
-                            settings_overrides=settings)
+    with buildprofile.stage('docutils'):
+        tex, stats = publish_tex(content, settings)
+
+    if stats is not None:
+        # Kept apart, so that they do not end up in the TOC
+        figures.write_figures(stats.pop('figures'), out_path)
 
     stats_file = os.path.join(out_path, 'paper_stats.json')
-    d = options.cfg2dict(stats_file)
-    try:
-        d.update(writer.document.stats)
-        options.dict2cfg(d, stats_file)
-    except AttributeError:
+    if stats is not None:
+        with options.update_cfg(stats_file) as d:
+            d.update(stats)
+    else:
         print("Error: no paper configuration found")
 
     tex_file = os.path.join(out_path, 'paper.tex')
@@ -109,42 +195,160 @@ def rst2tex(in_path, out_path):
 
 
 def tex2pdf(out_path):
+    """Run pdflatex, and bibtex when needed, until the paper converges.
+
+    After every pass the files pdflatex reads back on the next one
+    (``.aux``, ``.bbl``, ``.toc`` and ``.out``) are hashed; as soon as a
+    pass leaves them unchanged, the output is final.  BiBTeX only runs
+    when the citations, style or database named in the ``.aux`` file, or
+    the ``.bib`` file itself, differ from its previous run.
 
-    # Sometimes Latex want us to rebuild because labels have changed.
-    # We will try at most 5 times.
-    for i in range(5):
-        out, retry = tex2pdf_singlepass(out_path)
-        if not retry:
-            # Building succeeded or failed outright
+    The number of pdflatex passes is stored as ``latex_passes`` in
+    ``paper_stats.json``.
+
+    Returns
+    -------
+    out : str
+        Output of the last pdflatex (or failed bibtex) run.
+    """
+    stats_file = os.path.join(out_path, 'paper_stats.json')
+    d = options.cfg2dict(stats_file)
+    bib_file = os.path.join(out_path, d.get('bibliography', '') + '.bib')
+    use_bibtex = bool(d.get('bibliography')) and os.path.exists(bib_file)
+
+    state = aux_state(out_path)
+    bibtex_inputs = _bibtex_inputs.get(out_path)
+
+    for passes in range(1, max_latex_passes + 1):
+        out, success = pdflatex(out_path)
+        if not success:
+            # Errors, exit early
             break
+
+        if use_bibtex:
+            inputs = citation_state(out_path, bib_file)
+            bbl_file = os.path.join(out_path, 'paper.bbl')
+            if inputs != bibtex_inputs or not os.path.exists(bbl_file):
+                out_bib, success = bibtex(out_path)
+                if not success:
+                    return out_bib
+                bibtex_inputs = _bibtex_inputs[out_path] = inputs
+
+        new_state = aux_state(out_path)
+        if new_state == state:
+            break
+        state = new_state
+
+    print("PDFLaTeX passes:", passes)
+    with options.update_cfg(stats_file) as d:
+        d.update({'latex_passes': passes})
+
     return out
 
 
-def tex2pdf_singlepass(out_path):
+# What the last bibtex run in each output directory depended on, see
+# `citation_state`.  Lets a long-running process (build_paper.py --watch)
+# skip bibtex when neither the citations nor the .bib file changed.
+_bibtex_inputs = {}
+
+
+def _file_digest(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def aux_state(out_path):
+    """Return digests of the files pdflatex reads back on its next pass.
     """
+    return tuple(_file_digest(os.path.join(out_path, fn))
+                 for fn in rerun_files)
+
+
+def citation_state(out_path, bib_file):
+    """Return what a bibtex run depends on: the citation, style and
+    database lines of ``paper.aux`` and the digest of `bib_file`.
+    """
+    aux_file = os.path.join(out_path, 'paper.aux')
+    lines = []
+    if os.path.exists(aux_file):
+        with io.open(aux_file, mode='rb') as f:
+            lines = [line for line in f.read().splitlines()
+                     if line.startswith(bibtex_aux_commands)]
+    return lines, _file_digest(bib_file)
+
+
+def bibtex(out_path):
+    """Run bibtex on ``paper.aux`` in `out_path`.
+
     Returns
     -------
     out : str
-        LaTeX output.
-    retry : bool
-        Whether another round of building is needed.
+        BiBTeX output.
+    success : bool
+        Whether bibtex finished without errors.
     """
+    import subprocess
+
+    # -- see `pdflatex` for why stdin is a dummy tempfile
+    dummy = tempfile.TemporaryFile()
+
+    with buildprofile.stage('bibtex'):
+        run = subprocess.Popen(['bibtex', 'paper'],
+                stdin=dummy,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                cwd=out_path,
+                )
+        out_bib, err = run.communicate()
+    if err or b'Error' in out_bib:
+        print("Error compiling BiBTeX")
+        print("bibtex error output:")
+        print("=" * 80)
+        print(out_bib)
+        print("=" * 80)
+        return out_bib, False
 
+    return out_bib, True
+
+
+def pdflatex(out_path):
+    """Run a single pdflatex pass over ``paper.tex`` in `out_path`.
+
+    Returns
+    -------
+    out : str
+        LaTeX output.
+    success : bool
+        Whether pdflatex finished without errors.
+    """
     import subprocess
-    command_line = 'pdflatex -halt-on-error paper.tex'
+
+    command_line = list(pdflatex_command)
+    env = None
+    if tex_format:
+        fmt_dir, fmt_name = os.path.split(os.path.splitext(tex_format)[0])
+        command_line.append('-fmt=' + fmt_name)
+        env = dict(os.environ)
+        # The trailing separator keeps the default search path
+        env['TEXFORMATS'] = fmt_dir + os.pathsep + env.get('TEXFORMATS', '')
+    command_line.append('paper.tex')
 
     # -- dummy tempfile is a hacky way to prevent pdflatex
     #    from asking for any missing files via stdin prompts,
     #    which mess up our build process.
     dummy = tempfile.TemporaryFile()
 
-    run = subprocess.Popen(command_line, shell=True,
-            stdin=dummy,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            cwd=out_path,
-            )
-    out, err = run.communicate()
+    with buildprofile.stage('pdflatex'):
+        run = subprocess.Popen(command_line,
+                stdin=dummy,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                cwd=out_path,
+                env=env,
+                )
+        out, err = run.communicate()
 
     if b"Fatal" in out or run.returncode:
         print("PDFLaTeX error output:")
@@ -154,36 +358,66 @@ def tex2pdf_singlepass(out_path):
         if err:
             print(err.decode('utf-8'))
             print("=" * 80)
-
-        # Errors, exit early
         return out, False
 
-    # Compile BiBTeX if available
-    stats_file = os.path.join(out_path, 'paper_stats.json')
-    d = options.cfg2dict(stats_file)
-    bib_file = os.path.join(out_path, d["bibliography"] + '.bib')
+    return out, True
+
+
+def preload_format(fmt_dir):
+    """Dump the preamble shared by all papers into a pdflatex format.
+
+    The preamble is the start of what `rst2tex` produces for any paper:
+    the IEEEtran document class, the packages docutils always loads,
+    ``scipy.sty`` and the Pygments style definitions.  Once dumped, every
+    pdflatex pass of every paper loads the format instead of reading
+    these packages again.
+
+    On success `tex_format` is set to the path of the format and
+    returned.  If the format cannot be built, a warning is printed and
+    papers are built the usual way.
+    """
+    global tex_format
+    import subprocess
+    import docutils.core as dc
 
-    if os.path.exists(bib_file):
-        bibtex_cmd = 'bibtex paper && ' + command_line
-        run = subprocess.Popen(bibtex_cmd, shell=True,
+    options.mkdir_p(fmt_dir)
+    copy_styles(fmt_dir)
+
+    head = dc.publish_string(source='', writer_name='latex',
+                             settings_overrides=latex_settings())
+    head = head.decode('utf-8')
+    head = head[:head.index(_preamble_end)] + _format_trailer
+
+    name = 'scipy-preamble'
+    with io.open(os.path.join(fmt_dir, name + '.tex'), mode='w',
+                 encoding='utf-8') as f:
+        f.write(head)
+
+    dummy = tempfile.TemporaryFile()
+    try:
+        run = subprocess.Popen(['pdflatex', '-ini', '-halt-on-error',
+                                '-jobname=' + name, '&pdflatex', name + '.tex'],
                 stdin=dummy,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
-                cwd=out_path,
+                cwd=fmt_dir,
                 )
-        out_bib, err = run.communicate()
-        if err or b'Error' in out_bib:
-            print("Error compiling BiBTeX")
-            print("bibtex error output:")
-            print("=" * 80)
-            print(out_bib)
-            print("=" * 80)
-            return out_bib, False
-
-    if b"Label(s) may have changed." in out:
-        return out, True
+        out, err = run.communicate()
+        returncode = run.returncode
+    except OSError as e:
+        out, returncode = str(e).encode('utf-8'), -1
+
+    fmt_file = os.path.join(fmt_dir, name + '.fmt')
+    if returncode or not os.path.exists(fmt_file):
+        print("*** WARNING: could not dump the shared preamble to a format, "
+              "building papers without it.")
+        print("=" * 80)
+        print(out.decode('utf-8'))
+        print("=" * 80)
+        return None
 
-    return out, False
+    tex_format = os.path.abspath(fmt_file)
+    return tex_format
 
 
 def page_count(pdflatex_stdout, paper_dir):
@@ -197,41 +431,236 @@ def page_count(pdflatex_stdout, paper_dir):
     regexp = re.compile(b'Output written on paper.pdf \((\d+) pages')
     cfgname = os.path.join(paper_dir, 'paper_stats.json')
 
-    d = options.cfg2dict(cfgname)
+    with options.update_cfg(cfgname) as d:
+        for line in pdflatex_stdout.splitlines():
+            m = regexp.match(line)
+            if m:
+                pages = m.groups()[0]
+                d.update({'pages': int(pages)})
+                break
 
-    for line in pdflatex_stdout.splitlines():
-        m = regexp.match(line)
-        if m:
-            pages = m.groups()[0]
-            d.update({'pages': int(pages)})
-            break
-    options.dict2cfg(d, cfgname)
+
+def write_page_numbers(out_path, start):
+    """Write the ``page_numbers.tex`` that sets the first page of a paper.
+    """
+    page_number_file = os.path.join(out_path, 'page_numbers.tex')
+    with io.open(page_number_file, 'w', encoding='utf-8') as f:
+        f.write('\\setcounter{page}{%s}' % start)
 
 
 def build_paper(paper_id, start=1):
+    with buildprofile.paper(paper_id), buildprofile.stage('build_paper'):
+        _build_paper(paper_id, start)
+
+
+def _build_paper(paper_id, start):
     out_path = os.path.join(output_dir, paper_id)
     in_path = os.path.join(papers_dir, paper_id)
     print("Building:", paper_id)
     
     
     options.mkdir_p(out_path)
-    page_number_file = os.path.join(out_path, 'page_numbers.tex')
-    with io.open(page_number_file, 'w', encoding='utf-8') as f:
-        f.write('\setcounter{page}{%s}' % start)
+    write_page_numbers(out_path, start)
+
+    if conf.use_build_cache:
+        key = buildcache.paper_key(in_path, start)
+        if buildcache.restore(paper_id, key, out_path):
+            print("Unchanged, reusing cached build:", paper_id)
+            return
+
+    pdflatex_stdout = rebuild_paper(in_path, out_path)
+
+    if conf.use_build_cache and pdflatex_succeeded(pdflatex_stdout):
+        buildcache.store(paper_id, key, out_path)
+
+
+def stamp_page_numbers(paper_id, start):
+    """Renumber an already built paper so that it starts on page `start`.
+
+    Only the final pdflatex pass is rerun: the page count of a paper does
+    not depend on its first page, so the ``.aux`` and ``.bbl`` files left
+    behind by `build_paper` can be reused as they are.  Raises a
+    RuntimeError if pdflatex fails.
+    """
+    with buildprofile.paper(paper_id), \
+            buildprofile.stage('stamp_page_numbers'):
+        _stamp_page_numbers(paper_id, start)
+
+
+def _stamp_page_numbers(paper_id, start):
+    out_path = os.path.join(output_dir, paper_id)
+    in_path = os.path.join(papers_dir, paper_id)
+    print("Numbering:", paper_id, "from p.", start)
+
+    write_page_numbers(out_path, start)
+
+    if conf.use_build_cache:
+        key = buildcache.paper_key(in_path, start)
+        if buildcache.restore(paper_id, key, out_path):
+            return
+        # The first build may itself have come from the cache, in which
+        # case only its artifacts, not the sources, are in place.
+        copy_sources(in_path, out_path)
+        with buildprofile.stage('figures'):
+            figures.prepare(in_path, out_path)
+
+    out, success = pdflatex(out_path)
+    if not success:
+        # paper.pdf still starts on the placeholder page
+        raise RuntimeError("pdflatex failed to renumber %s from p. %s"
+                           % (paper_id, start))
+
+    if conf.use_build_cache:
+        buildcache.store(paper_id, key, out_path)
+
+
+def pdflatex_succeeded(pdflatex_stdout):
+    """Whether pdflatex output reports a written ``paper.pdf``.
+    """
+    return bool(pdflatex_stdout) and \
+        b'Output written on paper.pdf' in pdflatex_stdout
+
+def _snapshot(in_path):
+    """Return the size and modification time of every file in `in_path`.
+    """
+    files = {}
+    for root, dirs, filenames in os.walk(in_path):
+        for fn in filenames:
+            path = os.path.join(root, fn)
+            try:
+                st = os.stat(path)
+            except OSError:
+                # Removed while walking, e.g. an editor's swap file
+                continue
+            files[os.path.relpath(path, in_path)] = (st.st_mtime, st.st_size)
+    return files
+
+
+def rebuild_paper(in_path, out_path):
+    """Build the paper in `in_path` from scratch, bypassing the cache.
+
+    Returns the output of the last pdflatex run.
+    """
+    # paper_stats.json and figures.json are written once, at the end
+    with options.batched_writes():
+        rst2tex(in_path, out_path)
+        pdflatex_stdout = tex2pdf(out_path)
+        page_count(pdflatex_stdout, out_path)
+    return pdflatex_stdout
+
+
+def update_paper(in_path, out_path, changed, removed):
+    """Bring the build in `out_path` up to date after the files `changed`
+    and `removed` (paths relative to `in_path`) were edited.
+
+    Only the stages these files feed are rerun: a changed .rst is
+    converted again, other files (figures, .bib) are copied over, and
+    downsampled in the case of figures, and
+    pdflatex then runs until the paper converges, calling bibtex only
+    if the citations or the .bib file changed.
+    """
+    for fn in removed:
+        path = os.path.join(out_path, fn)
+        if os.path.exists(path):
+            os.remove(path)
+    prepared = figures.prepared_figures(out_path)
+    for fn in changed:
+        if fn.endswith('.rst') or os.path.normpath(fn) in prepared:
+            continue
+        dest = os.path.join(out_path, fn)
+        options.mkdir_p(os.path.dirname(dest))
+        synctools.sync_file(os.path.join(in_path, fn), dest)
+
+    only = changed
+    with options.batched_writes():
+        if any(fn.endswith('.rst') for fn in changed):
+            write_tex(in_path, out_path)
+            # The sizes the figures are printed at may have changed
+            only = None
+        with buildprofile.stage('figures'):
+            figures.prepare(in_path, out_path, only=only)
+        pdflatex_stdout = tex2pdf(out_path)
+        page_count(pdflatex_stdout, out_path)
+
+
+def watch_paper(in_path, interval=0.5):
+    """Build the paper in `in_path`, then rebuild it every time one of
+    its files changes, until interrupted.
+
+    The process stays alive between builds, so docutils, Pygments and
+    the docutils settings are only loaded once.  The directory is polled
+    every `interval` seconds.
+    """
+    import time
+    import traceback
+
+    paper_id = os.path.basename(in_path)
+    out_path = os.path.join(output_dir, paper_id)
+    options.mkdir_p(out_path)
+    write_page_numbers(out_path, 1)
+
+    def run(stage, func, *args):
+        start = time.time()
+        try:
+            with buildprofile.paper(paper_id), buildprofile.stage(stage):
+                func(*args)
+        except Exception:
+            # Keep watching: the author will most likely fix the error
+            traceback.print_exc()
+        # Nothing reports these records, do not let them pile up
+        buildprofile.drain()
+        print("Done in %.1fs, watching %s for changes (Ctrl-C to stop)"
+              % (time.time() - start, in_path))
+
+    files = _snapshot(in_path)
+    run('build_paper', rebuild_paper, in_path, out_path)
+    try:
+        while True:
+            time.sleep(interval)
+            current = _snapshot(in_path)
+            if current == files:
+                continue
+            changed = sorted(fn for fn in current
+                             if files.get(fn) != current[fn])
+            removed = sorted(fn for fn in files if fn not in current)
+            files = current
+            print("Changed:", ', '.join(changed + removed))
+            run('update_paper', update_paper, in_path, out_path, changed,
+                removed)
+    except KeyboardInterrupt:
+        pass
+
+
+def parse_args():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build a single paper.")
+    parser.add_argument('paper_directory')
+    parser.add_argument('--watch', action='store_true',
+                        help="keep running, and rebuild the paper whenever "
+                             "one of its files changes")
+    parser.add_argument('--interval', type=float, default=0.5,
+                        help="seconds between checks for changes in "
+                             "--watch mode (default: %(default)s)")
+    parser.add_argument('--preload-format', action='store_true',
+                        help="dump the shared preamble into a pdflatex "
+                             "format first (see build_papers.py)")
+    return parser.parse_args()
 
-    rst2tex(in_path, out_path)
-    pdflatex_stdout = tex2pdf(out_path)
-    page_count(pdflatex_stdout, out_path)
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: build_paper.py paper_directory")
-        sys.exit(-1)
+    args = parse_args()
 
-    in_path = os.path.normpath(sys.argv[1])
+    in_path = os.path.normpath(args.paper_directory)
     if not os.path.isdir(in_path):
         print("Cannot open directory: %s" % in_path)
         sys.exit(-1)
 
+    if args.preload_format:
+        preload_format(conf.fmt_dir)
+
     paper_id = os.path.basename(in_path)
-    build_paper(paper_id)
+    if args.watch:
+        watch_paper(in_path, args.interval)
+    else:
+        build_paper(paper_id)
@@ -3,14 +3,17 @@ from __future__ import unicode_literals
 
 import os
 import sys
-import shutil
 import subprocess
 import io
+import argparse
+import multiprocessing
 
+import build_paper as paper_builder
+import buildprofile
 import conf
 import options
-from build_paper import build_paper
-from xreftools import XrefMeta
+import synctools
+from build_paper import build_paper, stamp_page_numbers, preload_format
 from doitools import make_doi, make_series_doi
 
 output_dir = conf.output_dir
@@ -19,13 +22,18 @@ bib_dir    = conf.bib_dir
 pdf_dir    = conf.pdf_dir
 toc_conf   = conf.toc_conf
 proc_conf  = conf.proc_conf
-dirs       = conf.dirs
-other_dirs = conf.other_dirs
 xref_conf = conf.xref_conf
 papers_dir = conf.papers_dir
 other_conf = conf.other_conf
+fmt_dir = conf.fmt_dir
+profile_conf = conf.profile_conf
 is_final = conf.status_file_base == 'ready'
 
+basedir = os.path.join(os.path.dirname(__file__), '..')
+
+# Papers built in parallel all start on this page until their real
+# position in the proceedings is known.
+placeholder_start = 1
 
 
 def paper_stats(paper_id, start, doi_prefix=None):
@@ -66,32 +74,123 @@ def other_stats(track_dir, _id, doi_prefix=None):
     return stats
 
 
-if __name__ == "__main__":
+def _init_worker(use_build_cache, tex_format):
+    # Set in this process by the command line options; workers that are
+    # not forked (spawn, forkserver) would start from the defaults.
+    conf.use_build_cache = use_build_cache
+    paper_builder.tex_format = tex_format
+
+
+def _build_placeholder(paper_id):
+    with options.temp_cd(basedir):
+        build_paper(paper_id, start=placeholder_start)
+    return buildprofile.drain()
+
+
+def _stamp(paper_id, start):
+    with options.temp_cd(basedir):
+        stamp_page_numbers(paper_id, start)
+    return buildprofile.drain()
+
 
+def build_serial(paper_ids, doi_prefix):
+    """Build papers one after the other, each starting on the page after
+    the previous one ends.
+    """
     start = 1
     toc_entries = []
+    for paper_id in paper_ids:
+        with options.temp_cd(basedir):
+            build_paper(paper_id, start=start)
+
+        stats = paper_stats(paper_id, start, doi_prefix)
+        start = stats.get('page',{}).get('stop', start) + 1
+        toc_entries.append(stats)
+    return toc_entries
+
+
+def build_parallel(paper_ids, doi_prefix, jobs):
+    """Build all papers at once on a pool of `jobs` processes.
+
+    Every paper is first built starting on `placeholder_start`.  The page
+    ranges are then assigned from the page counts in each
+    ``paper_stats.json``, and only papers that do not start on the
+    placeholder page get a final pdflatex pass to fix their numbering.
+    """
+    pool = multiprocessing.Pool(jobs, initializer=_init_worker,
+                                initargs=(conf.use_build_cache,
+                                          paper_builder.tex_format))
+    try:
+        for recs in pool.map(_build_placeholder, paper_ids, chunksize=1):
+            buildprofile.records.extend(recs)
+
+        start = 1
+        toc_entries = []
+        for paper_id in paper_ids:
+            stats = paper_stats(paper_id, start, doi_prefix)
+            start = stats.get('page',{}).get('stop', start) + 1
+            toc_entries.append(stats)
+
+        renumber = [(stats['paper_id'], stats['page']['start'])
+                    for stats in toc_entries
+                    if stats['page']['start'] != placeholder_start]
+        for recs in pool.starmap(_stamp, renumber, chunksize=1):
+            buildprofile.records.extend(recs)
+    finally:
+        pool.close()
+        pool.join()
+    return toc_entries
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build all papers and "
+                                     "the proceedings metadata.")
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help="number of papers to build in parallel "
+                             "(default: 1, i.e. one after the other)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="rebuild every paper, even if its sources "
+                             "have not changed since the last build")
+    parser.add_argument('--preload-format', action='store_true',
+                        help="dump the preamble shared by all papers into "
+                             "a pdflatex format once, and load it in "
+                             "every pdflatex pass")
+    parser.add_argument('--slowest', type=int, default=10, metavar='N',
+                        help="list the N papers that took longest to build "
+                             "(default: 10)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+    if args.no_cache:
+        conf.use_build_cache = False
+
     other_entries = {}
 
     options.mkdir_p(pdf_dir)
-    basedir = os.path.join(os.path.dirname(__file__), '..')
     # load metadata
     scipy_entry = options.cfg2dict(proc_conf)
     doi_prefix = scipy_entry["proceedings"]["xref"]["prefix"]
     issn = scipy_entry['series']['xref']['issn']
 
-    for paper_id in dirs:
-        with options.temp_cd(basedir):
-            build_paper(paper_id, start=start)
+    if args.preload_format:
+        with buildprofile.stage('preload_format'):
+            preload_format(fmt_dir)
 
-        stats = paper_stats(paper_id, start, doi_prefix)
-        start = stats.get('page',{}).get('stop', start) + 1
-        toc_entries.append(stats)
+    if args.jobs > 1:
+        toc_entries = build_parallel(conf.get_dirs(), doi_prefix, args.jobs)
+    else:
+        toc_entries = build_serial(conf.get_dirs(), doi_prefix)
 
-        src_pdf = os.path.join(output_dir, paper_id, 'paper.pdf')
-        dest_pdf = os.path.join(pdf_dir, paper_id+'.pdf')
-        shutil.copy(src_pdf, dest_pdf)
+    with buildprofile.stage('copy_pdfs') as record:
+        for paper_id in conf.get_dirs():
+            src_pdf = os.path.join(output_dir, paper_id, 'paper.pdf')
+            dest_pdf = os.path.join(pdf_dir, paper_id+'.pdf')
+            synctools.record(record, *synctools.sync_file(src_pdf, dest_pdf))
 
-    for track_dir, folder_ids in other_dirs.items():
+    for track_dir, folder_ids in conf.get_other_dirs().items():
         track = os.path.split(track_dir)[-1]
         other_entries[track] = []
         for folder in folder_ids:
@@ -110,7 +209,24 @@ if __name__ == "__main__":
     options.dict2cfg(other_entries, other_conf)
     options.dict2cfg(scipy_entry, proc_conf)
 
-    # make crossref submission file
-    xref = XrefMeta(scipy_entry, toc_entries, other_entries)
-    xref.make_metadata()
-    xref.write_metadata(xref_conf)
+    # make crossref submission file (xreftools loads lxml, only needed here)
+    import xreftools
+    xref = xreftools.XrefMeta(scipy_entry, toc_entries, other_entries)
+    xref.stream_metadata(xref_conf)
+
+    # check the batches that will be submitted; drafts have no DOIs
+    valid = True
+    if is_final:
+        if os.path.exists(conf.xref_schema):
+            with buildprofile.stage('validate_xref'):
+                valid = xreftools.validate_metadata(xref_conf)
+        else:
+            print("*** Warning: %s not found, the DOI batches were not "
+                  "validated (run ./xreftools.py --fetch-schemas)."
+                  % conf.xref_schema)
+
+    buildprofile.write_report(profile_conf, 'build_papers')
+    buildprofile.print_summary(args.slowest)
+    if not valid:
+        print("*** ERROR: the DOI batches do not match the CrossRef schema.")
+        sys.exit(1)
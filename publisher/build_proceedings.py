@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+"""
+Assemble ``proceedings.pdf`` from the front matter and the paper PDFs.
+
+Only what changed since the previous run is redone.  A manifest in the
+build directory records the digest of every front matter ``.tex`` file
+and of the static files it uses (``status.sty``, the logo), and of the
+inputs of the last assembly; front matter PDFs are only rebuilt when
+one of these changed, and the proceedings only assembled again when a
+paper PDF, the TOC or the front matter changed.
+
+Two backends assemble the proceedings:
+
+``latex``
+    Renders ``proceedings.tex`` and runs pdflatex over it, like the
+    ``proceedings`` target of the Makefile.
+
+``pypdf``
+    Merges the PDFs directly with pypdf, without pdflatex, adding a
+    bookmark for every paper and page labels that match the printed page
+    numbers.  The table of contents is typeset once from ``toc.tex``.
+
+Run ``build_papers.py`` first, to build the papers and the TOC.
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import hashlib
+import io
+import os
+import re
+import subprocess
+import sys
+
+import buildprofile
+import options
+import synctools
+from build_template import copy_static_files, render_template
+from conf import build_dir, pdf_dir, profile_conf
+
+tex_dir = os.path.join(build_dir, 'tex')
+manifest_file = os.path.join(build_dir, 'proceedings_manifest.json')
+
+# Front matter of the proceedings, in order: name of the template, pages
+# included and whether it must start on a right-hand (odd) page.
+front_matter = [('title', '1', False),
+                ('copyright', '-', True),
+                ('organization', '-', True),
+                ('slides', '-', False),
+                ('students', '-', False)]
+
+tracks = ('slides', 'posters', 'lightning', 'tools')
+
+# Static files used by the front matter: ``\usepackage{static/status}``,
+# or ``../../_static/logo.png``.  Both are looked up in the copy of the
+# static directory in the TeX build directory.
+_static_ref = re.compile(r'(?:\.\./\.\./_static|static)/([\w.-]+)')
+
+
+def _digest(path):
+    if not os.path.exists(path):
+        return None
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def included_front_matter(config):
+    """Return the front matter parts included with `config`."""
+    return [part for part in front_matter
+            if part[0] != 'slides' or any(config.get(t) for t in tracks)]
+
+
+def static_inputs(tex):
+    """Return the digests of the static files the LaTeX `tex` uses."""
+    digests = {}
+    for name in _static_ref.findall(tex):
+        if not os.path.splitext(name)[1]:
+            # \usepackage
+            name += '.sty'
+        digests['static/' + name] = _digest(os.path.join(tex_dir, 'static',
+                                                         name))
+    return digests
+
+
+def write_tex(name, config):
+    """Render ``<name>.tex`` into the TeX build directory.
+
+    The file is only written when its content changed.  Returns the
+    digests of the content and of the static files it uses.
+    """
+    tex = render_template(name + '.tex', config, name + '.tex')
+    digest = hashlib.sha1(tex.encode('utf-8')).hexdigest()
+    path = os.path.join(tex_dir, name + '.tex')
+    if _digest(path) != digest:
+        with io.open(path, mode='w', encoding='utf-8') as f:
+            f.write(tex)
+    inputs = static_inputs(tex)
+    inputs['tex'] = digest
+    return inputs
+
+
+def pdflatex(name, passes=1):
+    """Run pdflatex `passes` times over ``<name>.tex`` in the TeX build
+    directory.  Returns whether it produced ``<name>.pdf``.
+    """
+    with buildprofile.stage('pdflatex'), open(os.devnull, 'w') as devnull:
+        for i in range(passes):
+            returncode = subprocess.call(
+                ['pdflatex', '-interaction=batchmode', name + '.tex'],
+                cwd=tex_dir, stdout=devnull)
+    pdf = os.path.join(tex_dir, name + '.pdf')
+    if returncode or not os.path.exists(pdf):
+        print("*** ERROR: pdflatex failed on %s.tex, see %s.log"
+              % (name, os.path.join(tex_dir, name)))
+        return False
+    return True
+
+
+def build_tex_pdf(name, config, manifest, passes=1):
+    """Build ``<name>.pdf`` from its template, unless neither its ``.tex``
+    nor the static files it uses changed since `manifest` was written,
+    and its PDF is there.
+    """
+    inputs = write_tex(name, config)
+    pdf = os.path.join(tex_dir, name + '.pdf')
+    built = manifest.setdefault('tex', {})
+    if built.get(name) == inputs and os.path.exists(pdf):
+        return True
+    print("Building:", name + '.pdf')
+    built.pop(name, None)
+    if not pdflatex(name, passes):
+        return False
+    built[name] = inputs
+    return True
+
+
+def paper_pdf(entry):
+    return os.path.join(pdf_dir, entry['paper_id'] + '.pdf')
+
+
+def assembly_inputs(backend, config):
+    """Return the digests of everything an assembly reads."""
+    names = [part[0] for part in included_front_matter(config)]
+    if backend == 'pypdf':
+        names.append('toc')
+    inputs = {'backend': backend}
+    for name in names:
+        inputs[name] = _digest(os.path.join(tex_dir, name + '.pdf'))
+    if backend == 'latex':
+        inputs['proceedings.tex'] = _digest(os.path.join(tex_dir,
+                                                         'proceedings.tex'))
+    for entry in config['toc']:
+        inputs[entry['paper_id']] = _digest(paper_pdf(entry))
+    return inputs
+
+
+def assemble_latex(config):
+    """Typeset ``proceedings.tex``, which includes all the PDFs."""
+    if not pdflatex('proceedings', passes=2):
+        return False
+    synctools.sync_file(os.path.join(tex_dir, 'proceedings.pdf'),
+                        os.path.join(pdf_dir, 'proceedings.pdf'))
+    return True
+
+
+def _add_pdf(writer, path, pages='-', openright=False):
+    import pypdf
+
+    reader = pypdf.PdfReader(path)
+    if openright and len(writer.pages) % 2:
+        last = writer.pages[-1]
+        writer.add_blank_page(width=last.mediabox.width,
+                              height=last.mediabox.height)
+    first = len(writer.pages)
+    selected = reader.pages[:1] if pages == '1' else reader.pages
+    for page in selected:
+        writer.add_page(page)
+    return first
+
+
+def assemble_pypdf(config):
+    """Merge the front matter, TOC and paper PDFs with pypdf."""
+    # Imported here, pypdf is slow to load and only this backend needs it
+    import pypdf
+
+    writer = pypdf.PdfWriter()
+    for name, pages, openright in included_front_matter(config):
+        _add_pdf(writer, os.path.join(tex_dir, name + '.pdf'), pages,
+                 openright)
+    contents = _add_pdf(writer, os.path.join(tex_dir, 'toc.pdf'))
+    writer.add_outline_item('Contents', contents)
+
+    papers_start = len(writer.pages)
+    if papers_start:
+        # Front matter numbered i, ii, ...
+        writer.set_page_label(0, papers_start - 1, style='/r')
+
+    for entry in config['toc']:
+        first = _add_pdf(writer, paper_pdf(entry))
+        writer.add_outline_item(entry['title'], first)
+        writer.set_page_label(first, len(writer.pages) - 1, style='/D',
+                              start=int(entry['page']['start']))
+
+    with buildprofile.stage('write_pdf'):
+        out = os.path.join(pdf_dir, 'proceedings.pdf')
+        scratch = out + '.%d' % os.getpid()
+        with open(scratch, 'wb') as f:
+            writer.write(f)
+        os.rename(scratch, out)
+    return True
+
+
+backends = {'latex': assemble_latex, 'pypdf': assemble_pypdf}
+
+
+def build_proceedings(config, backend='latex', force=False):
+    """Bring ``proceedings.pdf`` up to date.  Returns whether it is."""
+    options.mkdir_p(tex_dir)
+    options.mkdir_p(pdf_dir)
+    manifest = {} if force else options.cfg2dict(manifest_file)
+    if force and os.path.exists(manifest_file):
+        os.remove(manifest_file)
+
+    try:
+        with buildprofile.stage('front_matter'):
+            # static/status.sty and the logo, used by the front matter
+            copy_static_files('proceedings.tex')
+            for name, pages, openright in included_front_matter(config):
+                if not build_tex_pdf(name, config, manifest):
+                    return False
+            if backend == 'pypdf':
+                # The TOC typeset on its own, to be merged
+                if not build_tex_pdf('toc', config, manifest, passes=2):
+                    return False
+            else:
+                write_tex('proceedings', config)
+
+        inputs = assembly_inputs(backend, config)
+        out = os.path.join(pdf_dir, 'proceedings.pdf')
+        if manifest.get('assembly') == inputs and os.path.exists(out):
+            print("Proceedings are up to date.")
+            return True
+
+        missing = [entry['paper_id'] for entry in config['toc']
+                   if inputs[entry['paper_id']] is None]
+        if missing:
+            print("*** ERROR: no PDF for %s, run build_papers.py first."
+                  % ', '.join(missing))
+            return False
+
+        print("Assembling proceedings.pdf with %s" % backend)
+        manifest.pop('assembly', None)
+        with buildprofile.stage('assemble'):
+            if not backends[backend](config):
+                return False
+        manifest['assembly'] = inputs
+        return True
+    finally:
+        options.dict2cfg(manifest, manifest_file)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Assemble the proceedings "
+                                                 "from the built papers.")
+    parser.add_argument('--backend', choices=sorted(backends),
+                        default='latex',
+                        help="typeset proceedings.tex with pdflatex, or merge "
+                             "the PDFs with pypdf (default: %(default)s)")
+    parser.add_argument('--force', action='store_true',
+                        help="rebuild everything, ignoring the manifest")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.backend == 'pypdf':
+        try:
+            import pypdf
+        except ImportError:
+            print("The pypdf backend needs pypdf: pip install pypdf")
+            sys.exit(1)
+
+    config = options.get_config()
+    success = build_proceedings(config, args.backend, args.force)
+    buildprofile.write_report(profile_conf, 'build_proceedings')
+    if not success:
+        sys.exit(1)
@@ -3,58 +3,149 @@
 
 import os
 import sys
-import shlex
-import subprocess
 import io
-import shutil
+import hashlib
 
+from collections import OrderedDict
 
-from distutils import dir_util
 
 import tempita
+import conf
+import synctools
+from latextools import unicode_to_latex
 from conf import (bib_dir, build_dir, template_dir, html_dir,
-                  static_dir, status_file)
-from options import get_config
+                  static_dir, status_file, template_cache_dir)
+from options import get_config, mkdir_p
+
+# Number of parsed templates kept in memory
+template_cache_size = 32
 
 class TeXTemplate(tempita.Template):
     def _repr(self, value, pos):
         if sys.version_info[0] < 3 and isinstance(value, unicode):
-            value = value.replace('&', '\&')
+            value = unicode_to_latex(value.replace('&', '\\&'))
         elif sys.version_info[0] >= 3 and isinstance(value, str):
-            value = value.replace('&', '\&')
+            value = unicode_to_latex(value.replace('&', '\\&'))
         elif sys.version_info[0] < 3 :
             value = unicode(value)
         else: 
             value = str(value)
         return value
 
-def _from_template(tmpl_basename, config, use_html=True):
+# Files rendered with TeXTemplate rather than HTMLTemplate
+tex_extensions = ('tex', 'bib')
+
+# Parsed templates by (path, class), least recently used first
+_templates = OrderedDict()
+
+# Bumped whenever the parse tree of tempita changes, to invalidate the
+# parse trees pickled by earlier versions.
+template_pickle_version = 1
+
+def _pickle_path(path, template_class):
+    key = '%s:%s' % (path, template_class.__name__)
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(template_cache_dir, digest + '.pickle')
+
+def _load_parsed(path, template_class, stamp):
+    import pickle
+
+    pickle_path = _pickle_path(path, template_class)
+    try:
+        with io.open(pickle_path, mode='rb') as f:
+            cached = pickle.load(f)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError):
+        return None
+    if cached.get('stamp') != stamp:
+        return None
+    return cached['parsed']
+
+def _dump_parsed(path, template_class, stamp, parsed):
+    import pickle
+
+    mkdir_p(template_cache_dir)
+    pickle_path = _pickle_path(path, template_class)
+    scratch = pickle_path + '.%d' % os.getpid()
+    with io.open(scratch, mode='wb') as f:
+        pickle.dump({'stamp': stamp, 'parsed': parsed}, f,
+                    pickle.HIGHEST_PROTOCOL)
+    os.rename(scratch, pickle_path)
+
+def get_template(path, template_class):
+    """Return the template in `path`, parsing it only when it was not
+    seen before or changed on disk since.
+
+    Parsed templates are kept in memory, up to `template_cache_size` of
+    them, and, when `conf.pickle_templates` is set, pickled to
+    `template_cache_dir` for other processes to reuse.
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    stamp = (st.st_mtime, st.st_size, template_pickle_version,
+             sys.version_info[:2])
+
+    key = (path, template_class)
+    cached = _templates.pop(key, None)
+    if cached is not None and cached[0] == stamp:
+        _templates[key] = cached
+        return cached[1]
+
+    with io.open(path, mode='r', encoding='utf-8') as f:
+        content = f.read()
+
+    parsed = None
+    if conf.pickle_templates:
+        parsed = _load_parsed(path, template_class, stamp)
+    template = template_class(content, parsed=parsed)
+    if conf.pickle_templates and parsed is None:
+        _dump_parsed(path, template_class, stamp, template._parsed)
+
+    _templates[key] = (stamp, template)
+    while len(_templates) > template_cache_size:
+        _templates.popitem(last=False)
+    return template
+
+def _get_template(tmpl_basename, use_html=True):
     tmpl = os.path.join(template_dir, tmpl_basename + '.tmpl')
     if use_html:
-        with io.open(tmpl, mode='r', encoding='utf-8') as f:
-            template = tempita.HTMLTemplate(f.read())
+        return get_template(tmpl, tempita.HTMLTemplate)
     else:
-        with io.open(tmpl, mode='r', encoding='utf-8') as f:
-            template = TeXTemplate(f.read())
-    return template.substitute(config)
+        return get_template(tmpl, TeXTemplate)
+
+def _from_template(tmpl_basename, config, use_html=True):
+    return _get_template(tmpl_basename, use_html).substitute(config)
+
+def _stream_template(tmpl_basename, config, fileobj, use_html=True):
+    """Render a template straight into `fileobj`, without holding the
+    whole output in memory.
+    """
+    _get_template(tmpl_basename, use_html).stream(config, fileobj)
+
+def render_template(tmpl_basename, config, dest_fn):
+    """Render a template for `dest_fn`, escaping values for TeX or HTML
+    depending on its extension.
+    """
+    extension = os.path.splitext(dest_fn)[1][1:]
+
+    use_html = extension not in tex_extensions
+    return _from_template(tmpl_basename, config, use_html=use_html)
 
 def from_template(tmpl_basename, config, dest_fn):
     extension = os.path.splitext(dest_fn)[1][1:]
 
-    use_html = False if 'tex' in extension else True
-    outfile = _from_template(tmpl_basename, config, use_html=use_html)
+    use_html = extension not in tex_extensions
     outname = os.path.join(build_dir, extension, dest_fn)
 
     with io.open(outname, mode='w', encoding='utf-8') as f:
-        f.write(outfile)
+        _stream_template(tmpl_basename, config, f, use_html=use_html)
+
+def bib_path(target):
+    return os.path.join(bib_dir, target + '.bib')
 
 def bib_from_tmpl(bib_type, config, target):
     tmpl_basename = bib_type + '.bib'
-    dest_path = os.path.join(bib_dir, target + '.bib')
+    dest_path = bib_path(target)
     from_template(tmpl_basename, config, dest_path)
-    command_line = 'recode -d u8..ltex ' + dest_path
-    run = subprocess.Popen(command_line, shell=True, stdout=subprocess.PIPE)
-    out, err = run.communicate()
 
 def get_html_header(config):
     return _from_template('header.html', config)
@@ -62,24 +153,29 @@ def get_html_header(config):
 def get_html_content(tmpl, config):
     return _from_template(tmpl, config)
 
-def html_from_tmpl(src, config, target):
+def html_path(target):
+    dest_fn = os.path.join(html_dir, target + '.html')
+    extension = os.path.splitext(dest_fn)[1][1:]
+    return os.path.join(build_dir, extension, dest_fn)
 
+def render_html(src, config):
     header = get_html_header(config)
     content =  _from_template(src, config)
+    return header+content
 
-    outfile = header+content
-    dest_fn = os.path.join(html_dir, target + '.html')
-    extension = os.path.splitext(dest_fn)[1][1:]
-    outname = os.path.join(build_dir, extension, dest_fn)
+def html_from_tmpl(src, config, target):
+
+    outname = html_path(target)
     with io.open(outname, mode='w', encoding='utf-8') as f:
-        f.write(outfile)
+        _stream_template('header.html', config, f)
+        _stream_template(src, config, f)
 
 def copy_static_files(dest_fn):
     extension = os.path.splitext(dest_fn)[1][1:]
     outdir = os.path.join(build_dir, extension, "static")
-    dir_util.copy_tree(static_dir, outdir)
+    synctools.sync_tree(static_dir, outdir)
     style_fn = os.path.join(outdir, 'status.sty')
-    shutil.copy(status_file, style_fn)
+    synctools.sync_file(status_file, style_fn)
 
 if __name__ == "__main__":
 
@@ -0,0 +1,122 @@
+"""
+Content-hash cache of built papers.
+
+A paper is identified by a key hashing everything that goes into its
+build: the files in ``papers/<paper_id>``, the writer sources, the LaTeX
+styles, ``scipy_proc.json`` (the writer puts the year, copyright and
+short title of the proceedings in every paper) and the page the paper
+starts on.  When a key has been built
+before, the resulting ``paper.tex``, ``paper.pdf`` and
+``paper_stats.json`` (plus the auxiliary files needed to rerun pdflatex)
+are copied back instead of running docutils and pdflatex again.
+"""
+from __future__ import print_function, unicode_literals
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+from conf import cache_dir, status_file, static_dir, work_dir
+
+import conf
+import options
+
+paper_cache_dir = os.path.join(cache_dir, 'papers')
+writer_dir = os.path.join(work_dir, 'writer')
+
+# Files kept for every cached build.  Only paper.tex, paper.pdf and
+# paper_stats.json are required; the others let a cached paper be
+# renumbered with a single pdflatex pass, figures.json telling which
+# figures to downsample again.
+artifacts = ['paper.tex', 'paper.pdf', 'paper_stats.json',
+             'paper.aux', 'paper.bbl', 'paper.out', 'figures.json']
+required_artifacts = artifacts[:3]
+
+# Number of cached builds kept per paper.  Papers built in parallel are
+# stored once for the placeholder start page and once for their real one.
+keep = 4
+
+
+def _hash_file(h, path):
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            h.update(block)
+
+
+def _hash_tree(h, path, extensions=None):
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if d != '__pycache__')
+        for fn in sorted(files):
+            if extensions and os.path.splitext(fn)[1] not in extensions:
+                continue
+            full = os.path.join(root, fn)
+            h.update(os.path.relpath(full, path).encode('utf-8'))
+            _hash_file(h, full)
+
+
+def paper_key(in_path, start):
+    """Return the cache key of the paper in `in_path` starting on `start`.
+    """
+    h = hashlib.sha1()
+    _hash_tree(h, in_path)
+    _hash_tree(h, writer_dir, extensions=('.py',))
+    for path in (os.path.join(work_dir, 'build_paper.py'),
+                 os.path.join(work_dir, 'figures.py'),
+                 os.path.join(static_dir, 'scipy.sty'),
+                 status_file, conf.proc_conf):
+        h.update(os.path.basename(path).encode('utf-8'))
+        if os.path.exists(path):
+            _hash_file(h, path)
+    h.update(('start=%s' % start).encode('utf-8'))
+    if conf.downsample_figures:
+        h.update(('figure_dpi=%s' % conf.figure_dpi).encode('utf-8'))
+    return h.hexdigest()
+
+
+def restore(paper_id, key, out_path):
+    """Copy the cached build `key` of `paper_id` into `out_path`.
+
+    Returns whether the cache had an entry for `key`.
+    """
+    entry = os.path.join(paper_cache_dir, paper_id, key)
+    if not os.path.isdir(entry):
+        return False
+
+    options.mkdir_p(out_path)
+    for fn in artifacts:
+        cached = os.path.join(entry, fn)
+        if os.path.exists(cached):
+            shutil.copy(cached, os.path.join(out_path, fn))
+    # Mark the entry as recently used so that `store` keeps it around.
+    os.utime(entry, None)
+    return True
+
+
+def store(paper_id, key, out_path):
+    """Add the build of `paper_id` found in `out_path` to the cache.
+    """
+    if not all(os.path.exists(os.path.join(out_path, fn))
+               for fn in required_artifacts):
+        return
+
+    paper_dir = os.path.join(paper_cache_dir, paper_id)
+    options.mkdir_p(paper_dir)
+
+    # Fill a scratch directory and rename it into place, so that a
+    # concurrent build never sees a half-written entry.
+    scratch = tempfile.mkdtemp(dir=paper_dir)
+    for fn in artifacts:
+        built = os.path.join(out_path, fn)
+        if os.path.exists(built):
+            shutil.copy(built, os.path.join(scratch, fn))
+    try:
+        os.rename(scratch, os.path.join(paper_dir, key))
+    except OSError:
+        # Another worker stored the same key first
+        shutil.rmtree(scratch)
+
+    entries = sorted((os.path.join(paper_dir, e) for e in os.listdir(paper_dir)),
+                     key=os.path.getmtime, reverse=True)
+    for stale in entries[keep:]:
+        shutil.rmtree(stale, ignore_errors=True)
@@ -0,0 +1,211 @@
+"""
+Timing and memory instrumentation of the proceedings build.
+
+Stages of the build are wrapped in ``with stage('name'):`` blocks; each
+one records its wall time, and how much it raised the peak resident set
+size of the process and of its children (pdflatex, bibtex).  The system
+only keeps the peak over the whole life of a process, and over all its
+terminated children: a stage that uses less memory than an earlier one
+raises it by nothing, but the stages, and papers, that raise it are the
+ones that set the memory a build needs.  Records carry the id of the
+paper being built, set with ``with paper(paper_id):``.
+
+At the end of a build, `write_report` stores the records, per-stage and
+per-paper totals in a JSON file and `print_summary` lists the papers
+that took longest.
+"""
+from __future__ import print_function, unicode_literals
+
+import os
+import sys
+import time
+
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+import options
+
+try:
+    _clock = time.perf_counter
+except AttributeError:
+    _clock = time.time
+
+records = []
+current_paper = None
+
+# Stages that span all the work done on a paper
+paper_stages = ('build_paper', 'stamp_page_numbers', 'render_article')
+
+
+def peak_rss():
+    """Return the peak resident set size, in kB, of this process and of
+    its terminated children, since the process started.
+    """
+    if resource is None:
+        return None, None
+    # ru_maxrss is in bytes on macOS, in kB elsewhere
+    unit = 1024 if sys.platform == 'darwin' else 1
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // unit,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // unit)
+
+
+@contextmanager
+def paper(paper_id):
+    """Attribute the stages run inside this block to `paper_id`.
+    """
+    global current_paper
+    previous, current_paper = current_paper, paper_id
+    try:
+        yield
+    finally:
+        current_paper = previous
+
+
+def _growth(before, after):
+    if before is None or after is None:
+        return None
+    return after - before
+
+
+@contextmanager
+def stage(name):
+    """Record the wall time and memory use of a build stage.
+
+    ``peak_rss_growth_kb`` and ``children_peak_rss_growth_kb`` are how
+    much the stage raised the peak memory use of the process and of its
+    children, ``process_peak_rss_kb`` and ``children_process_peak_rss_kb``
+    the peaks so far when it ended.
+
+    The record is yielded, so that the stage can add its own counts,
+    e.g. the ``bytes_copied`` and ``bytes_skipped`` of `synctools`.
+    """
+    record = {'stage': name, 'paper_id': current_paper}
+    rss_before, children_rss_before = peak_rss()
+    start = _clock()
+    try:
+        yield record
+    finally:
+        rss, children_rss = peak_rss()
+        record.update({
+            'seconds': _clock() - start,
+            'peak_rss_growth_kb': _growth(rss_before, rss),
+            'children_peak_rss_growth_kb': _growth(children_rss_before,
+                                                   children_rss),
+            'process_peak_rss_kb': rss,
+            'children_process_peak_rss_kb': children_rss})
+        records.append(record)
+
+
+def drain():
+    """Return the records gathered so far and forget them.
+
+    Used to send the records of a worker process back to its parent.
+    """
+    drained = records[:]
+    del records[:]
+    return drained
+
+
+# Counts added to stage records that are summed over all calls
+counters = ('bytes_copied', 'bytes_skipped')
+
+# Memory counts of stage records, summed over all calls
+memory_counters = ('peak_rss_growth_kb', 'children_peak_rss_growth_kb')
+
+
+def stage_totals(recs):
+    """Return the number of calls, total time, `counters` and
+    `memory_counters` of every stage."""
+    totals = {}
+    for r in recs:
+        t = totals.setdefault(r['stage'], {'calls': 0, 'seconds': 0.0})
+        t['calls'] += 1
+        t['seconds'] += r['seconds']
+        for key in counters + memory_counters:
+            if r.get(key) is not None:
+                t[key] = t.get(key, 0) + r[key]
+    return totals
+
+
+def _megabytes(n):
+    return n / float(1 << 20)
+
+
+def paper_totals(recs):
+    """Return, for every paper, the time it spent in each stage and how
+    much it raised the peak memory use.  ``seconds`` and the
+    `memory_counters` are summed over `paper_stages`.
+    """
+    papers = {}
+    for r in recs:
+        if r['paper_id'] is None:
+            continue
+        p = papers.setdefault(r['paper_id'], {'seconds': 0.0,
+                                              'stages': {},
+                                              'peak_rss_growth_kb': 0,
+                                              'children_peak_rss_growth_kb': 0})
+        p['stages'][r['stage']] = p['stages'].get(r['stage'], 0.0) + r['seconds']
+        if r['stage'] in paper_stages:
+            p['seconds'] += r['seconds']
+            for key in memory_counters:
+                p[key] += r.get(key) or 0
+    return papers
+
+
+def write_report(filename, tool, recs=None):
+    """Store the profile of `tool` in the JSON file `filename`.
+
+    Profiles of other tools already in the file are kept, so that e.g.
+    ``build_papers.py`` and ``build_html.py`` share one report.
+    """
+    if recs is None:
+        recs = records
+
+    with options.locked(filename):
+        report = options.cfg2dict(filename) if os.path.exists(filename) else {}
+        report[tool] = {'stages': stage_totals(recs),
+                        'papers': paper_totals(recs),
+                        'records': recs}
+        # Replaced atomically: an interrupted build leaves the old report
+        options.dict2cfg(report, filename)
+
+
+def print_summary(n=10, recs=None):
+    """Print the stage totals and the `n` slowest papers."""
+    if recs is None:
+        recs = records
+
+    print("Time per stage:")
+    totals = stage_totals(recs)
+    for name in sorted(totals, key=lambda k: -totals[k]['seconds']):
+        t = totals[name]
+        line = "  %-20s %8.2fs in %d call(s)" % (name, t['seconds'], t['calls'])
+        if 'bytes_copied' in t:
+            line += ", copied %.1f MB, skipped %.1f MB unchanged" % (
+                _megabytes(t['bytes_copied']), _megabytes(t['bytes_skipped']))
+        if t.get('peak_rss_growth_kb'):
+            line += ", raised peak memory by %.1f MB" % (
+                t['peak_rss_growth_kb'] / 1024.)
+        print(line)
+
+    papers = paper_totals(recs)
+    slowest = sorted(papers, key=lambda k: -papers[k]['seconds'])[:n]
+    if not slowest:
+        return
+    print("Slowest papers:")
+    for paper_id in slowest:
+        p = papers[paper_id]
+        stages = ', '.join('%s %.2fs' % (name, seconds)
+                           for name, seconds in sorted(p['stages'].items(),
+                                                       key=lambda s: -s[1])
+                           if name not in paper_stages)
+        line = "  %-30s %8.2fs  (%s)" % (paper_id, p['seconds'], stages)
+        if p['peak_rss_growth_kb']:
+            line += ", raised peak memory by %.1f MB" % (
+                p['peak_rss_growth_kb'] / 1024.)
+        print(line)
@@ -6,6 +6,18 @@ excludes = ['example', 'vanderwalt', 'bibderwalt']
 # status_file_root possible values: draft, conference, ready
 status_file_base = 'draft'
 status_file_name = ''.join([status_file_base, '.sty'])
+# reuse builds of papers whose sources have not changed (see buildcache.py),
+# and highlighted code blocks (see writer/highlight.py)
+use_build_cache = True
+# hardlink unchanged sources and static files into the build directories
+# instead of copying them (see synctools.py)
+sync_hardlinks = False
+# resample PNG and JPEG figures larger than needed to print them at
+# figure_dpi (needs Pillow, see figures.py)
+downsample_figures = False
+figure_dpi = 300
+# keep the parse trees of templates on disk, shared between processes
+pickle_templates = False
 
 work_dir      = os.path.dirname(__file__)
 papers_dir    = os.path.join(work_dir, '../papers')
@@ -20,25 +32,63 @@ static_dir    = os.path.join(work_dir, '_static')
 css_file      = os.path.join(static_dir, 'scipy-proc.css')
 toc_list      = os.path.join(static_dir, 'toc.txt')
 build_dir     = os.path.join(work_dir, '_build')
+cache_dir     = os.path.join(work_dir, '_cache')
+template_cache_dir = os.path.join(cache_dir, 'templates')
+highlight_cache_dir = os.path.join(cache_dir, 'highlight')
+figure_cache_dir = os.path.join(cache_dir, 'figures')
 pdf_dir       = os.path.join(build_dir, 'pdfs')
+fmt_dir       = os.path.join(build_dir, 'fmt')
 html_dir      = os.path.join(build_dir, 'html')
 bib_dir       = os.path.join(html_dir, 'bib')
 toc_conf      = os.path.join(build_dir, 'toc.json')
 proc_conf     = os.path.join(work_dir, '../scipy_proc.json')
 xref_conf     = os.path.join(build_dir, 'doi_batch')
 other_conf    = os.path.join(build_dir, 'other.json')
+profile_conf  = os.path.join(build_dir, 'build_profile.json')
+name_overrides_conf = os.path.join(work_dir, 'metadata', 'name_overrides.json')
+schema_dir    = os.path.join(work_dir, 'schemas')
+xref_schema   = os.path.join(schema_dir, 'crossref4.4.2.xsd')
 status_file   = os.path.join(static_dir, status_file_name)
 
-if os.path.isfile(toc_list):
-    with io.open(toc_list, 'r', encoding='utf-8') as f:
-        dirs = f.read().splitlines()
-else:
-    dirs = sorted([os.path.basename(d)
-                   for d in glob.glob('%s/*' % papers_dir)
+# The papers and presentations to build are only listed when first asked
+# for, with get_dirs() and get_other_dirs(): most tools, and the workers
+# building papers in parallel, never need them.  ``conf.dirs`` and
+# ``conf.other_dirs`` still work, computed on first access.
+_dirs = None
+_other_dirs = None
+
+
+def _subdirs(path):
+    return sorted([os.path.basename(d)
+                   for d in glob.glob('%s/*' % path)
                    if os.path.isdir(d) and not any(e in d for e in excludes)])
 
-other_dirs = {dir: sorted([os.path.basename(subdir)
-                     for subdir in glob.glob('%s/*' % dir)
-                     if os.path.isdir(subdir) and not any(e in subdir for e in excludes)])
-                     for dir in (slides_dir, posters_dir, lightning_dir, tools_dir)}
 
+def get_dirs():
+    """Return the ids of the papers, in the order of the proceedings."""
+    global _dirs
+    if _dirs is None:
+        if os.path.isfile(toc_list):
+            with io.open(toc_list, 'r', encoding='utf-8') as f:
+                _dirs = f.read().splitlines()
+        else:
+            _dirs = _subdirs(papers_dir)
+    return _dirs
+
+
+def get_other_dirs():
+    """Return the ids of the presentations, by track directory."""
+    global _other_dirs
+    if _other_dirs is None:
+        _other_dirs = {dir: _subdirs(dir)
+                       for dir in (slides_dir, posters_dir, lightning_dir,
+                                   tools_dir)}
+    return _other_dirs
+
+
+def __getattr__(name):
+    if name == 'dirs':
+        return get_dirs()
+    if name == 'other_dirs':
+        return get_other_dirs()
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
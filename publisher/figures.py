@@ -0,0 +1,205 @@
+"""
+Downsample raster figures to the resolution they are printed at.
+
+The writer records every image of a paper with the width it is printed
+at: the column (or text) width, or the natural size of the image times
+its ``scale``.  `prepare` works out the printed size in inches, and
+replaces PNG and JPEG files that have many more pixels than
+``conf.figure_dpi`` calls for by a resampled copy in the build directory.
+The resolution stored in the copy is adjusted so that its natural size,
+and hence the layout of the paper, does not change.
+
+Resampled images are cached in ``conf.figure_cache_dir`` by the hash of
+the original and the target size.  This stage is optional: it is off
+unless ``conf.downsample_figures`` is set, and needs Pillow.
+"""
+from __future__ import print_function, unicode_literals
+
+import hashlib
+import math
+import os
+import tempfile
+import warnings
+
+import conf
+import options
+import synctools
+
+# PIL.Image, imported by `_import_pillow` on first use: most builds do
+# not downsample figures.
+Image = None
+
+# Widths, in inches, of a column and of the text of an IEEEtran paper
+printed_widths = {'columnwidth': 3.5, 'textwidth': 7.16}
+
+raster_extensions = ('.png', '.jpg', '.jpeg')
+
+# Images are only resampled when that saves at least this fraction of
+# their width; re-encoding a slightly oversized image gains nothing.
+min_reduction = 0.8
+
+# pdflatex assumes this resolution for images that do not store one
+default_dpi = 72.
+
+
+def _import_pillow():
+    """Import Pillow, returning whether it is available."""
+    global Image
+    if Image is None:
+        try:
+            from PIL import Image
+        except ImportError:
+            return False
+    return True
+
+
+def figures_file(out_path):
+    return os.path.join(out_path, 'figures.json')
+
+
+def write_figures(figures, out_path):
+    """Store the images listed by the writer for `prepare` to use later.
+    """
+    options.dict2cfg({'figures': figures}, figures_file(out_path))
+
+
+def _raster_figures(out_path):
+    """Return the uses of the raster images listed in ``figures.json``,
+    by file name relative to the paper directory.
+    """
+    figures = {}
+    for figure in options.cfg2dict(figures_file(out_path))['figures']:
+        uri = os.path.normpath(figure['uri'])
+        if os.path.splitext(uri)[1].lower() in raster_extensions:
+            figures.setdefault(uri, []).append(figure)
+    return figures
+
+
+def prepared_figures(out_path):
+    """Return the file names of the images `prepare` puts in `out_path`.
+
+    The copy of the paper sources leaves them out: the original and its
+    downsampled copy have the same name, so copying the original would
+    replace the downsampled copy.
+    """
+    if not conf.downsample_figures or not os.path.exists(figures_file(out_path)):
+        return set()
+    if not _import_pillow():
+        return set()
+    return set(_raster_figures(out_path))
+
+
+def target_size(size, dpi, figure):
+    """Return the pixel width and height, and the resolution, an image of
+    `size` pixels stored at `dpi` should be resampled to, or None if it
+    is small enough already.
+    """
+    width, height = size
+    natural_width = width / float(dpi)
+    if figure.get('width') in printed_widths:
+        printed = printed_widths[figure['width']]
+    else:
+        printed = natural_width * figure.get('scale', 1.0)
+
+    new_width = int(math.ceil(round(printed * conf.figure_dpi, 6)))
+    if new_width >= width * min_reduction:
+        return None
+    new_height = max(1, int(round(height * new_width / float(width))))
+    # Keep the natural size, which \includegraphics[scale=...] is based on
+    return (new_width, new_height), new_width / natural_width
+
+
+def _cache_path(src, size, dpi):
+    h = hashlib.sha1()
+    with open(src, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            h.update(block)
+    h.update(('%s %s %.4f' % (size, os.path.splitext(src)[1].lower(),
+                              dpi)).encode('utf-8'))
+    return os.path.join(conf.figure_cache_dir,
+                        h.hexdigest() + os.path.splitext(src)[1].lower())
+
+
+def _resample(src, dest, size, dpi):
+    with Image.open(src) as original:
+        image_format = original.format
+        image = original
+        if image.mode in ('1', 'P'):
+            image = image.convert('RGBA' if 'transparency' in image.info
+                                  else 'RGB')
+        image = image.resize(size, Image.LANCZOS)
+
+    save_options = {'dpi': (dpi, dpi)}
+    if image_format == 'JPEG':
+        save_options['quality'] = 95
+    else:
+        save_options['optimize'] = True
+
+    options.mkdir_p(os.path.dirname(dest))
+    fd, scratch = tempfile.mkstemp(dir=os.path.dirname(dest),
+                                   suffix=os.path.splitext(dest)[1])
+    os.close(fd)
+    image.save(scratch, format=image_format, **save_options)
+    os.rename(scratch, dest)
+
+
+def downsample(src, dest, figures):
+    """Put a copy of the image `src` at `dest`, resampled if it is larger
+    than all the `figures` it is printed in need.
+
+    Returns whether the image was resampled.
+    """
+    _import_pillow()
+    with Image.open(src) as image:
+        size = image.size
+        dpi = image.info.get('dpi', (default_dpi,))[0] or default_dpi
+
+    targets = [target_size(size, dpi, figure) for figure in figures]
+    if None in targets:
+        # Printed large enough somewhere to need every pixel
+        synctools.sync_file(src, dest)
+        return False
+    new_size, new_dpi = max(targets)
+
+    cached = _cache_path(src, new_size, new_dpi)
+    if not os.path.exists(cached):
+        _resample(src, cached, new_size, new_dpi)
+
+    # dest may be hardlinked to src (conf.sync_hardlinks): replace the
+    # file instead of writing into it.
+    if os.path.lexists(dest):
+        os.remove(dest)
+    synctools.sync_file(cached, dest, link=False)
+    print("Downsampled %s from %dx%d to %dx%d pixels"
+          % (os.path.basename(src), size[0], size[1], new_size[0], new_size[1]))
+    return True
+
+
+def prepare(in_path, out_path, only=None):
+    """Downsample the oversized figures of the paper in `in_path` into its
+    build directory `out_path`.
+
+    `only` restricts the figures looked at to these file names (relative
+    to `in_path`).
+    """
+    if not conf.downsample_figures or not os.path.exists(figures_file(out_path)):
+        return
+    if not _import_pillow():
+        warnings.warn(RuntimeWarning('Could not import Pillow. '
+                                     'Figures will not be downsampled.'))
+        return
+
+    figures = _raster_figures(out_path)
+    for uri, uses in sorted(figures.items()):
+        if only is not None and uri not in only:
+            continue
+        src = os.path.join(in_path, uri)
+        if not os.path.exists(src):
+            continue
+        dest = os.path.join(out_path, uri)
+        try:
+            downsample(src, dest, uses)
+        except (IOError, OSError) as e:
+            # Use the original instead; pdflatex reports broken images
+            print("Could not downsample %s: %s" % (uri, e))
+            synctools.sync_file(src, dest)
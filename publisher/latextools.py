@@ -0,0 +1,118 @@
+"""
+Replace non-ASCII characters by the LaTeX commands that typeset them.
+
+Templates for TeX and BibTeX files pass every substituted value through
+`unicode_to_latex`, so that author names and titles come out right even
+where a UTF-8 input encoding is not available (BibTeX in particular
+cannot sort or abbreviate raw UTF-8 names).
+
+The table is built once, at import, from the Unicode decomposition of
+accented Latin letters, plus a few letters and punctuation marks that do
+not decompose.  Conversion is a single ``str.translate`` call.
+"""
+from __future__ import unicode_literals
+
+import sys
+import unicodedata
+
+if sys.version_info[0] < 3:
+    chr = unichr
+
+# Combining marks and the LaTeX accent commands that produce them
+accents = {
+    '\u0300': '`',   # grave
+    '\u0301': "'",   # acute
+    '\u0302': '^',   # circumflex
+    '\u0303': '~',   # tilde
+    '\u0304': '=',   # macron
+    '\u0306': 'u',   # breve
+    '\u0307': '.',   # dot above
+    '\u0308': '"',   # diaeresis
+    '\u030a': 'r',   # ring above
+    '\u030b': 'H',   # double acute
+    '\u030c': 'v',   # caron
+    '\u0323': 'd',   # dot below
+    '\u0327': 'c',   # cedilla
+    '\u0328': 'k',   # ogonek
+    '\u0331': 'b',   # macron below
+}
+
+# Accents placed under the letter, which keep the dot of i and j
+accents_below = '\u0323\u0327\u0328\u0331'
+
+# Characters without a decomposition into a letter and an accent
+specials = {
+    '\u00a0': '~',  # no-break space
+    '\u00a1': '{!`}',  # inverted exclamation mark
+    '\u00a3': '{\\pounds}',  # pound sign
+    '\u00a7': '{\\S}',  # section sign
+    '\u00a9': '{\\copyright}',  # copyright sign
+    '\u00b6': '{\\P}',  # pilcrow sign
+    '\u00bf': '{?`}',  # inverted question mark
+    '\u00c6': '{\\AE}',  # latin capital letter ae
+    '\u00d8': '{\\O}',  # latin capital letter o with stroke
+    '\u00df': '{\\ss}',  # latin small letter sharp s
+    '\u00e6': '{\\ae}',  # latin small letter ae
+    '\u00f8': '{\\o}',  # latin small letter o with stroke
+    '\u0131': '{\\i}',  # latin small letter dotless i
+    '\u0141': '{\\L}',  # latin capital letter l with stroke
+    '\u0142': '{\\l}',  # latin small letter l with stroke
+    '\u0152': '{\\OE}',  # latin capital ligature oe
+    '\u0153': '{\\oe}',  # latin small ligature oe
+    '\u0237': '{\\j}',  # latin small letter dotless j
+    '\u2013': '--',  # en dash
+    '\u2014': '---',  # em dash
+    '\u2018': '`',  # left single quotation mark
+    '\u2019': "'",  # right single quotation mark
+    '\u201c': '``',  # left double quotation mark
+    '\u201d': "''",  # right double quotation mark
+    '\u2020': '{\\dag}',  # dagger
+    '\u2021': '{\\ddag}',  # double dagger
+    '\u2026': '{\\ldots}',  # horizontal ellipsis
+}
+
+# Blocks of accented Latin letters: Latin-1 Supplement, Latin
+# Extended-A and -B, Latin Extended Additional
+latin_ranges = [(0x00c0, 0x0250), (0x1e00, 0x1f00)]
+
+
+def _accented(char):
+    """Return the LaTeX for a letter with (possibly stacked) accents, or
+    None if it is not one.
+    """
+    decomposition = unicodedata.decomposition(char).split()
+    if len(decomposition) != 2 or decomposition[0].startswith('<'):
+        return None
+    base, mark = [chr(int(code, 16)) for code in decomposition]
+    if mark not in accents:
+        return None
+
+    if base in 'ij' and mark not in accents_below:
+        # Accents above i and j go on the dotless letters
+        base = '\\' + base
+    elif ord(base) >= 0x80:
+        base = _accented(base)
+        if base is None:
+            return None
+    return '{\\%s{%s}}' % (accents[mark], base)
+
+
+def _make_table():
+    table = {}
+    for start, stop in latin_ranges:
+        for code in range(start, stop):
+            latex = _accented(chr(code))
+            if latex is not None:
+                table[code] = latex
+    for char, latex in specials.items():
+        table[ord(char)] = latex
+    return table
+
+latex_table = _make_table()
+
+
+def unicode_to_latex(text):
+    """Replace the non-ASCII characters of `text` that LaTeX has commands
+    for.  Other characters are left untouched.
+    """
+    return text.translate(latex_table)
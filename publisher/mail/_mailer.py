@@ -1,19 +1,30 @@
 import argparse
-import smtplib
 import os
 import getpass
-from email.mime.text import MIMEText
+import queue
+import re
+import threading
+import time
+from email.utils import getaddresses
 
 import sys
 sys.path.insert(0, '..')
 from conf import work_dir
 from options import cfg2dict
 from build_template import _from_template
+import _outbox
 
 
 args = None
 password = None
 
+# Outboxes the messages rendered by send_template are spooled to, until
+# send_queued sends them, by path (see _outbox.py).  Unless --outbox is
+# given, every run gets its own, removed once all its messages are sent.
+outboxes = {}
+outbox_dir = os.path.join(work_dir, 'mail', 'outbox')
+run_started = time.strftime('%Y%m%d-%H%M%S')
+
 def author_greeting(names):
     if len(names) == 1:
         return names[0]
@@ -24,6 +35,20 @@ def parse_args():
     parser = argparse.ArgumentParser(description="Invite reviewers.")
     parser.add_argument('--send', action='store_true')
     parser.add_argument('--template', default=None)
+    parser.add_argument('--jobs', '-j', type=int, default=2,
+                        help="SMTP connections sending at once "
+                             "(default: %(default)s)")
+    parser.add_argument('--rate', type=float, default=None,
+                        help="at most this many messages per second")
+    parser.add_argument('--retries', type=int, default=3,
+                        help="attempts after a temporary failure, backing "
+                             "off exponentially (default: %(default)s)")
+    parser.add_argument('--outbox', default=None,
+                        help="file recording the messages and whether they "
+                             "were sent, so that a rerun with the same "
+                             "outbox only sends the others (default: a new "
+                             "outbox/<template>-<time>.jsonl, removed once "
+                             "every message is sent)")
 
     global args
     args = parser.parse_args()
@@ -49,13 +74,159 @@ def email_addr_from(name_email):
     return '"%s" <%s>' % (name_email['name'], name_email['email'])
 
 
+class SMTPPool(object):
+    """Up to `size` SMTP connections to one server, opened as needed and
+    reused for every message sent through the pool.
+
+    At most `rate` messages a second are sent, across all connections.
+    A message failing because of the connection or a temporary (4xx)
+    error is retried `retries` times, on a new connection, after waiting
+    `backoff`, then twice as long, and so on; permanent (5xx) errors and
+    refused recipients are not retried.
+
+    `smtp_class` replaces ``smtplib.SMTP``, e.g. for testing.
+    """
+    def __init__(self, host, port, login=None, password=None, size=2,
+                 rate=None, retries=3, backoff=1.0, starttls=True,
+                 smtp_class=None):
+        self.host = host
+        self.port = port
+        self.login = login
+        self.password = password
+        self.size = size
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+        self.starttls = starttls
+        self.smtp_class = smtp_class
+        self.connections = 0
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._next_send = 0.
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _connect(self):
+        import smtplib
+
+        session = (self.smtp_class or smtplib.SMTP)(self.host, self.port)
+        try:
+            session.ehlo()
+            if self.starttls:
+                session.starttls()
+                session.ehlo()
+            if self.login:
+                session.login(self.login, self.password)
+        except Exception:
+            self._discard(session)
+            raise
+        with self._lock:
+            self.connections += 1
+        return session
+
+    def _discard(self, session):
+        if session is None:
+            return
+        try:
+            session.close()
+        except Exception:
+            pass
+
+    def _wait_turn(self):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.time()
+            turn = max(now, self._next_send)
+            self._next_send = turn + 1. / self.rate
+        if turn > now:
+            time.sleep(turn - now)
+
+    def send(self, sender, recipients, message):
+        """Send `message` (bytes) from `sender` to the list of addresses
+        `recipients`, raising the last error if it cannot be sent.
+        """
+        import smtplib
+
+        for attempt in range(self.retries + 1):
+            self._wait_turn()
+            try:
+                session = self._idle.get_nowait()
+            except queue.Empty:
+                session = None
+            try:
+                if session is None:
+                    session = self._connect()
+                session.sendmail(sender, recipients, message)
+            except smtplib.SMTPRecipientsRefused:
+                self._idle.put(session)
+                raise
+            except smtplib.SMTPResponseException as e:
+                # The server answered: the connection can be reused,
+                # unless it failed to open (or log in)
+                if session is not None:
+                    self._idle.put(session)
+                if e.smtp_code >= 500:
+                    raise
+                error = e
+            except (OSError, smtplib.SMTPException) as e:
+                # Includes SMTPServerDisconnected and socket errors
+                self._discard(session)
+                error = e
+            else:
+                self._idle.put(session)
+                return
+
+            if attempt == self.retries:
+                raise error
+            time.sleep(self.backoff * 2 ** attempt)
+
+    def close(self):
+        """Close the idle connections."""
+        while True:
+            try:
+                session = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                session.quit()
+            except Exception:
+                self._discard(session)
+
+
+def encode_message(message):
+    """Return the rendered `message` as bytes, with CRLF line endings."""
+    return re.sub(r'\r\n|\r|\n', '\r\n', message).encode('utf-8')
+
+
+def split_recipients(recipient):
+    """Return the addresses in a comma-separated list of recipients."""
+    return [addr for name, addr in getaddresses([recipient]) if addr]
+
+
+def get_outbox(template):
+    path = args.outbox or os.path.join(
+        outbox_dir, '%s-%s.jsonl' % (template, run_started))
+    if path not in outboxes:
+        outboxes[path] = _outbox.Outbox(path)
+    return outboxes[path]
+
+
 def send_template(sender, recipient, template, template_data,
-                  smtp_server='smtp.gmail.com', smtp_port=587):
+                  smtp_server='smtp.gmail.com', smtp_port=587, key=None):
+    """Render `template` for `recipient`, and spool it to the outbox for
+    `send_queued`, or print it in a dry run.
+
+    `key` identifies the message in the outbox, by default its
+    recipients.
+    """
     if args.dry_run:
         print('Dry run -> not sending mail to %s' % recipient)
-    else:
-        get_password(sender['login'])
-        print('-> %s' % recipient)
 
     template_data['email'] = recipient
     message = _from_template('../mail/templates/' + template, template_data)
@@ -67,12 +238,57 @@ def send_template(sender, recipient, template, template_data,
 
         return
 
-    session = smtplib.SMTP(smtp_server, smtp_port)
+    recipients = split_recipients(recipient)
+    get_outbox(template).add(key or ', '.join(recipients),
+                             (smtp_server, smtp_port),
+                             {'name': sender['name'], 'login': sender['login']},
+                             recipients, message)
+
+
+def send_queued(smtp_class=None):
+    """Send the messages spooled by `send_template` that were not sent
+    yet, over one pool of connections per server and sender (see
+    `SMTPPool`).
+
+    Returns the number of messages that could not be sent.
+    """
+    def done(message, error):
+        recipients = ', '.join(message['recipients'])
+        if error is None:
+            print('-> %s' % recipients)
+        else:
+            print('*** Failed to send to %s: %s' % (recipients, error))
 
-    session.ehlo()
-    session.starttls()
-    session.ehlo
-    session.login(sender['login'], password)
+    failed = 0
+    for path, outbox in sorted(outboxes.items()):
+        if outbox.skipped:
+            print("%d messages in %s were sent before, skipping them"
+                  % (outbox.skipped, path))
+        batches = {}
+        for message in outbox.pending():
+            server = tuple(message['server'])
+            batches.setdefault((server, message['sender']['login']),
+                               []).append(message)
 
-    session.sendmail(sender['name'], recipient, message)
-    session.quit()
+        for (server, login), messages in sorted(batches.items()):
+            get_password(login)
+            start = time.time()
+            with SMTPPool(server[0], server[1], login, password,
+                          size=args.jobs, rate=args.rate,
+                          retries=args.retries,
+                          smtp_class=smtp_class) as pool:
+                _outbox.deliver(outbox, messages, pool, args.jobs,
+                                encode_message, done)
+            errors = sum(1 for message in messages
+                         if not outbox.sent(message['key']))
+            failed += errors
+            elapsed = time.time() - start
+            print("Sent %d messages over %d connections in %.1fs (%.1f/s)"
+                  % (len(messages) - errors, pool.connections, elapsed,
+                     len(messages) / max(elapsed, 1e-6)))
+        if outbox.pending():
+            print("*** Some messages could not be sent; run again with "
+                  "--outbox %s to retry them." % path)
+        elif not args.outbox and os.path.exists(path):
+            os.remove(path)
+    return failed
@@ -0,0 +1,137 @@
+"""
+Spool rendered messages to disk, and deliver them so that a rerun only
+sends what was not sent yet.
+
+An outbox is a JSONL file, only ever appended to.  Every message gets a
+``message`` line when it is spooled, and a ``delivery`` line when it is
+sent, or fails to be; the last line about a message gives its state.  A
+crash, or a bad address, therefore loses nothing: the messages without a
+successful delivery are still pending when the mail tool runs again
+with the same outbox (only a message being sent at the moment the tool
+is killed may go out twice).
+
+Messages are identified by a key, the recipients unless the tool gives
+another one (e.g. the paper a DOI notification is about).  A message
+already sent is not sent again, even if its content changed since, and
+only the messages spooled again by the current run are sent: messages
+left pending by an earlier run that the tool no longer renders are not.
+
+`deliver` sends the pending messages on a pool of threads, several at
+once, over an ``_mailer.SMTPPool``.
+"""
+from __future__ import print_function, unicode_literals
+
+import hashlib
+import io
+import json
+import os
+import time
+
+from collections import OrderedDict
+
+
+class Outbox(object):
+    """The messages spooled to the JSONL file `path`, and their delivery
+    state.
+    """
+    def __init__(self, path):
+        self.path = path
+        # Spooled messages, and the last delivery of each, by key
+        self.messages = OrderedDict()
+        self.deliveries = {}
+        # Keys added by this run, and how many of them were sent before
+        self.added = set()
+        self.skipped = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with io.open(self.path, mode='r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Cut short by a crash while appending
+                    continue
+                if record['type'] == 'message':
+                    self.messages[record['key']] = record
+                else:
+                    self.deliveries[record['key']] = record
+
+    def _append(self, record):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with io.open(self.path, mode='a', encoding='utf-8') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def sent(self, key):
+        delivery = self.deliveries.get(key)
+        return delivery is not None and delivery['error'] is None
+
+    def add(self, key, server, sender, recipients, message):
+        """Spool `message`, unless it was sent already.
+
+        `sender` is the dictionary with the ``name`` and ``login`` of the
+        sender, `server` the host and port of the SMTP server.  Returns
+        whether the message is pending.
+        """
+        digest = hashlib.sha1(message.encode('utf-8')).hexdigest()
+        self.added.add(key)
+        if self.sent(key):
+            self.skipped += 1
+            if self.messages[key]['digest'] != digest:
+                print('*** Warning: the message to %s changed since it '
+                      'was sent; not sending it again.' % key)
+            return False
+        spooled = self.messages.get(key)
+        if spooled is None or spooled['digest'] != digest:
+            record = {'type': 'message', 'key': key, 'digest': digest,
+                      'server': list(server), 'sender': sender,
+                      'recipients': recipients, 'message': message}
+            self._append(record)
+            self.messages[key] = record
+        return True
+
+    def record(self, key, error=None):
+        """Record the delivery of the message `key`, which failed with
+        `error` unless it is None.
+        """
+        record = {'type': 'delivery', 'key': key, 'time': time.time(),
+                  'error': None if error is None else str(error)}
+        self._append(record)
+        self.deliveries[key] = record
+
+    def pending(self):
+        """Return the messages added by this run that were not sent yet,
+        in the order spooled.
+        """
+        return [message for key, message in self.messages.items()
+                if key in self.added and not self.sent(key)]
+
+
+def deliver(outbox, messages, pool, jobs, encode, done=None):
+    """Send the spooled `messages` of `outbox` over `pool`, `jobs` at a
+    time, recording the delivery of each as soon as it is known.
+
+    `encode` turns a message into the bytes sent, and `done` is called
+    with each message and the error it failed with, or None.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        sending = {executor.submit(pool.send, message['sender']['name'],
+                                   message['recipients'],
+                                   encode(message['message'])): message
+                   for message in messages}
+        # Recorded from this thread only, one line at a time
+        for future in as_completed(sending):
+            message = sending[future]
+            error = future.exception()
+            outbox.record(message['key'], error)
+            if done is not None:
+                done(message, error)
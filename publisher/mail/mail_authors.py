@@ -9,4 +9,6 @@ for author in config['authors']:
     to = mailer.email_addr_from(author)
     mailer.send_template(config['sender'], to, args.template, config)
 
+mailer.send_queued()
+
 print("Mail for %d authors." % len(config['authors']))
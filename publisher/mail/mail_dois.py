@@ -23,4 +23,7 @@ for paper in toc['toc']:
     template_data['author_email'] = ', '.join(template_data['author_email'])
     template_data['committee'] = '\n  '.join(template_data['proceedings']['editor'])
 
-    mailer.send_template(sender, recipients, template, template_data)
+    mailer.send_template(sender, recipients, template, template_data,
+                         key=paper['paper_id'])
+
+mailer.send_queued()
@@ -23,6 +23,7 @@ for reviewer_info in config['reviewers']:
     mailer.send_template(config['sender'], to + ', ' + config['cced'],
                          'reviewer-invite.txt', reviewer_config)
 
+mailer.send_queued()
 
 # Generate a summary of emails sent
 
@@ -3,14 +3,23 @@ Configuration utilities.
 """
 from __future__ import print_function, unicode_literals
 
-__all__ = ['options']
+__all__ = ['options', 'get_options']
 
+import os
 import os.path
 import json
 import io
 import codecs
+import copy
+import threading
 
-from contextlib import contextmanager
+from contextlib import ExitStack, contextmanager, nullcontext
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: writes stay atomic, but updates are not serialised
+    fcntl = None
 
 import conf
 toc_conf   = conf.toc_conf
@@ -23,13 +32,46 @@ def get_config():
     config.update(cfg2dict(other_conf))
     return config
 
+# Parsed config files, by absolute path: the stat signature of the file
+# when it was read, and its content.  Saves reading and parsing the same
+# file again and again, e.g. paper_stats.json during a paper build.
+_cache = {}
+
+# Per thread, the files whose writes are deferred by `batched_writes`,
+# and the locks it holds until they are written
+_local = threading.local()
+
+
+def _signature(filename):
+    # The change time catches files rewritten in place with the same size
+    # and a restored modification time (shutil.copy2).
+    st = os.stat(filename)
+    return (st.st_ino, st.st_size, st.st_mtime, st.st_ctime)
+
+
+def _pending():
+    return getattr(_local, 'pending', None)
+
+
 def cfg2dict(filename):
     """Return the content of a JSON config file as a dictionary.
 
+    The parsed content is cached until the file changes on disk, and a
+    copy of it returned, which the caller is free to modify.
     """
-    if not os.path.exists(filename):
+    key = os.path.abspath(filename)
+    pending = _pending()
+    if pending is not None and key in pending:
+        return copy.deepcopy(pending[key])
+
+    try:
+        signature = _signature(filename)
+    except OSError:
         print('*** Warning: %s does not exist.' % filename)
         return {}
+    cached = _cache.get(key)
+    if cached is not None and cached[0] == signature:
+        return copy.deepcopy(cached[1])
 
     _backup_filename = filename+'.bak'
     if os.path.exists(_backup_filename):
@@ -38,20 +80,147 @@ def cfg2dict(filename):
 
     try:
         with io.open(filename,  mode='r', encoding='utf-8') as f:
-            return json.loads(f.read())
+            d = json.loads(f.read())
     except ValueError as err:
+        _cache.pop(key, None)
         os.rename(filename,filename+'.bak')
         print('{} is not a valid json file, moving to {} for debugging.'
               'Running again will remove backup file.'
               .format(filename, _backup_filename))
         return {}
+    _cache[key] = (signature, d)
+    return copy.deepcopy(d)
+
+
+def _write_cfg(d, filename):
+    # Written next to the file, then renamed over it: readers see either
+    # the old or the new content, never a partial file.
+    scratch = '%s.%d-%d.tmp' % (filename, os.getpid(),
+                                threading.current_thread().ident)
+    try:
+        with io.open(scratch, mode='wb') as f:
+            json.dump(d, codecs.getwriter('utf-8')(f), ensure_ascii=False,
+                      indent=2)
+        os.rename(scratch, filename)
+    except BaseException:
+        if os.path.exists(scratch):
+            os.remove(scratch)
+        raise
+    _cache[os.path.abspath(filename)] = (_signature(filename),
+                                         copy.deepcopy(d))
+
 
 def dict2cfg(d, filename):
     """Write dictionary out to config file.
 
+    The file is replaced atomically.  Inside `batched_writes`, it is only
+    written when the block ends.
+    """
+    pending = _pending()
+    if pending is not None:
+        pending[os.path.abspath(filename)] = copy.deepcopy(d)
+        return
+    _write_cfg(d, filename)
+
+
+@contextmanager
+def locked(filename):
+    """Context manager holding an exclusive lock on a config file, across
+    threads and processes.
+
+    The lock is taken on a ``.lock`` file alongside, since writing
+    replaces the config file itself, and the ``.lock`` file removed
+    before the lock is released.
+    """
+    if fcntl is None:
+        yield
+        return
+    lock_file = filename + '.lock'
+    while True:
+        f = open(lock_file, 'a')
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            if os.path.samestat(os.fstat(f.fileno()), os.stat(lock_file)):
+                break
+        except OSError:
+            pass
+        # Removed by the holder of the lock we waited for: lock the
+        # file that replaced it instead.
+        f.close()
+    try:
+        yield
+    finally:
+        try:
+            os.remove(lock_file)
+        finally:
+            f.close()
+
+
+def _hold_lock(filename):
+    # Lock `filename` until the current `batched_writes` block ends
+    key = os.path.abspath(filename)
+    if key not in _local.locked:
+        _local.locks.enter_context(locked(filename))
+        _local.locked.add(key)
+
+
+@contextmanager
+def update_cfg(filename):
+    """Context manager to update a config file in place::
+
+        with update_cfg('paper_stats.json') as d:
+            d['pages'] = 8
+
+    The file is locked from the time it is read until it is written, so
+    that concurrent updates from several build workers are not lost;
+    inside `batched_writes`, until the block ends.  It is only written
+    if its content changed.
+    """
+    if _pending() is not None:
+        _hold_lock(filename)
+        lock = nullcontext()
+    else:
+        lock = locked(filename)
+    with lock:
+        d = cfg2dict(filename)
+        original = copy.deepcopy(d)
+        yield d
+        if d != original:
+            dict2cfg(d, filename)
+
+
+@contextmanager
+def batched_writes():
+    """Context manager deferring `dict2cfg` until the end of the block.
+
+    Each file is then written once, with its last content, instead of
+    after every update; `cfg2dict` returns the pending content in the
+    meantime.  Only the current thread is affected, and other processes
+    see the files as they were until the block ends.  Files updated with
+    `update_cfg` stay locked until they are written, so other threads
+    and processes wait for the block to end to update them.
     """
-    with io.open(filename, mode='wb') as f:
-        json.dump(d, codecs.getwriter('utf-8')(f), ensure_ascii=False, indent=2)
+    if _pending() is not None:
+        # Nested: the outermost block writes
+        yield
+        return
+    _local.pending = {}
+    _local.locked = set()
+    _local.locks = ExitStack()
+    try:
+        with _local.locks:
+            try:
+                yield
+            finally:
+                pending, _local.pending = _local.pending, None
+                for filename, d in sorted(pending.items()):
+                    lock = (nullcontext() if filename in _local.locked
+                            else locked(filename))
+                    with lock:
+                        _write_cfg(d, filename)
+    finally:
+        _local.pending = _local.locked = _local.locks = None
+
 
 def mkdir_p(dir):
     """Create directory recursively if it does not exist (like mkdir-p).
@@ -74,4 +243,23 @@ def temp_cd(path):
     os.chdir(currdir)
 
 
-options = cfg2dict(proc_conf)
+# scipy_proc.json, only read when first asked for: see get_options()
+_options = None
+
+
+def get_options():
+    """Return the proceedings configuration in ``scipy_proc.json``.
+
+    It is read once per process, on the first call.  ``options.options``
+    is the same dictionary.
+    """
+    global _options
+    if _options is None:
+        _options = cfg2dict(proc_conf)
+    return _options
+
+
+def __getattr__(name):
+    if name == 'options':
+        return get_options()
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -0,0 +1,124 @@
+"""
+Copy files only when their content changed.
+
+Builds copy the paper sources, the static files and the PDFs to the
+output directories again and again, although most of them have not
+changed since the previous build.  `sync_file` and `sync_tree` skip a
+file whose copy has the same size and modification time, or failing
+that the same content, and otherwise copy it, or hardlink it when
+``conf.sync_hardlinks`` is set.
+
+They return the number of bytes copied and the number of bytes skipped
+(hardlinked files count as skipped), to be stored in the profile of the
+build stage with `record`.
+"""
+from __future__ import print_function, unicode_literals
+
+import errno
+import hashlib
+import os
+import shutil
+
+import conf
+
+
+def _digest(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            h.update(block)
+    return h.digest()
+
+
+def up_to_date(src, dest):
+    """Whether `dest` is an unchanged copy of `src`.
+    """
+    try:
+        dest_st = os.stat(dest)
+    except OSError:
+        return False
+    src_st = os.stat(src)
+    if src_st.st_size != dest_st.st_size:
+        return False
+    if src_st.st_mtime == dest_st.st_mtime:
+        return True
+    if (src_st.st_dev, src_st.st_ino) == (dest_st.st_dev, dest_st.st_ino):
+        return True
+    if _digest(src) != _digest(dest):
+        return False
+    # Same content, e.g. after a checkout touched the file: record the
+    # time so that the next comparison does not need to read it.
+    os.utime(dest, (src_st.st_atime, src_st.st_mtime))
+    return True
+
+
+def sync_file(src, dest, link=None):
+    """Copy `src` to the path `dest`, unless `dest` is already a copy.
+
+    Returns the number of bytes copied and the number of bytes skipped.
+    """
+    if link is None:
+        link = conf.sync_hardlinks
+    size = os.path.getsize(src)
+    if up_to_date(src, dest):
+        return 0, size
+
+    if os.path.lexists(dest):
+        os.remove(dest)
+    if link:
+        try:
+            os.link(src, dest)
+            return 0, size
+        except OSError as e:
+            # e.g. across file systems; fall back to copying
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+    # copy2 keeps the modification time that `up_to_date` compares
+    shutil.copy2(src, dest)
+    return size, 0
+
+
+def sync_tree(src_dir, dest_dir, link=None, exclude=()):
+    """Copy the files of `src_dir` that changed into `dest_dir`, like
+    ``distutils.dir_util.copy_tree``.  Files are never deleted from
+    `dest_dir`, and the files in `exclude` (paths relative to `src_dir`)
+    are not copied.
+
+    Returns the number of bytes copied and the number of bytes skipped.
+    """
+    copied = skipped = 0
+    for root, dirs, files in os.walk(src_dir):
+        dest_root = os.path.join(dest_dir, os.path.relpath(root, src_dir))
+        if not os.path.isdir(dest_root):
+            os.makedirs(dest_root)
+        for fn in files:
+            if os.path.normpath(os.path.relpath(os.path.join(root, fn),
+                                                src_dir)) in exclude:
+                continue
+            c, s = sync_file(os.path.join(root, fn),
+                             os.path.join(dest_root, fn), link=link)
+            copied += c
+            skipped += s
+    return copied, skipped
+
+
+def sync_files(paths, dest_dir, link=None):
+    """Sync each file of `paths` into `dest_dir`.
+
+    Returns the number of bytes copied and the number of bytes skipped.
+    """
+    copied = skipped = 0
+    for path in paths:
+        c, s = sync_file(path, os.path.join(dest_dir, os.path.basename(path)),
+                         link=link)
+        copied += c
+        skipped += s
+    return copied, skipped
+
+
+def record(stage_record, copied, skipped):
+    """Add bytes copied and skipped to a ``buildprofile.stage`` record.
+    """
+    stage_record['bytes_copied'] = stage_record.get('bytes_copied', 0) + copied
+    stage_record['bytes_skipped'] = (stage_record.get('bytes_skipped', 0)
+                                     + skipped)
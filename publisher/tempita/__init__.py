@@ -32,7 +32,7 @@ from __future__ import unicode_literals
 
 import re
 import sys
-import cgi
+import bisect
 import traceback
 import os
 import tokenize
@@ -44,6 +44,7 @@ except ImportError:
     from urllib.parse import quote as url_quote
     from io import StringIO
 
+
 from tempita._looper import looper
 from tempita.compat3 import bytes, basestring_, next, is_unicode, coerce_text
 
@@ -102,7 +103,7 @@ class Template(object):
 
     def __init__(self, content, name=None, namespace=None, stacklevel=None,
                  get_template=None, default_inherit=None, line_offset=0,
-                 delimeters=None):
+                 delimeters=None, parsed=None):
         self.content = content
 
         # set delimeters
@@ -136,7 +137,12 @@ class Template(object):
                 if lineno:
                     name += ':%s' % lineno
         self.name = name
-        self._parsed = parse(content, name=name, line_offset=line_offset, delimeters=self.delimeters)
+        if parsed is None:
+            parsed = parse(content, name=name, line_offset=line_offset, delimeters=self.delimeters)
+        self._parsed = parsed
+        # Code objects of the expressions and py: blocks, compiled the
+        # first time they are run
+        self._code = {}
         if namespace is None:
             namespace = {}
         self.namespace = namespace
@@ -184,6 +190,22 @@ class Template(object):
             result = self._interpret_inherit(result, defs, inherit, ns)
         return result
 
+    def stream(self, ns, fileobj):
+        """Like substitute(ns), but write the output to fileobj as it is
+        produced instead of returning it as one string.
+
+        Templates that inherit from another need their whole body before
+        the parent is rendered, so they are substituted and then written.
+        """
+        if self.default_inherit or _uses_inherit(self._parsed):
+            fileobj.write(self.substitute(ns))
+            return
+        ns['__template_name__'] = self.name
+        if self.namespace:
+            ns.update(self.namespace)
+        self._interpret_codes(self._parsed, ns, out=_StreamOut(fileobj),
+                              defs={})
+
     def _interpret(self, ns):
         __traceback_hide__ = True
         parts = []
@@ -203,7 +225,7 @@ class Template(object):
                 position=None, name=self.name)
         templ = self.get_template(inherit_template, self)
         self_ = TemplateObject(self.name)
-        for name, value in defs.iteritems():
+        for name, value in defs.items():
             setattr(self_, name, value)
         self_.body = body
         ns = ns.copy()
@@ -235,7 +257,7 @@ class Template(object):
             parts = code[2:]
             self._interpret_if(parts, ns, out, defs)
         elif name == 'expr':
-            parts = code[2].split('|')
+            parts = self._filters(code[2])
             base = self._eval(parts[0], ns, pos)
             for part in parts[1:]:
                 func = self._eval(part, ns, pos)
@@ -294,11 +316,33 @@ class Template(object):
                 self._interpret_codes(part[3], ns, out, defs)
                 break
 
+    def _compile(self, code, mode):
+        key = (code, mode)
+        try:
+            return self._code[key]
+        except KeyError:
+            source = code
+            if mode == 'eval':
+                # Like eval(), ignore the spaces around {{ expr }}
+                source = code.lstrip(' \t')
+            compiled = self._code[key] = compile(source, '<string>', mode)
+            return compiled
+
+    def _filters(self, expr):
+        """Split ``{{value | filter}}`` into the value and its filters."""
+        key = (expr, '|')
+        try:
+            return self._code[key]
+        except KeyError:
+            parts = self._code[key] = expr.split('|')
+            return parts
+
     def _eval(self, code, ns, pos):
         __traceback_hide__ = True
         try:
             try:
-                value = eval(code, self.default_namespace, ns)
+                value = eval(self._compile(code, 'eval'),
+                             self.default_namespace, ns)
             except SyntaxError as e:
                 raise SyntaxError(
                     'invalid syntax in expression: %s' % code)
@@ -321,7 +365,7 @@ class Template(object):
     def _exec(self, code, ns, pos):
         __traceback_hide__ = True
         try:
-            exec(code, self.default_namespace, ns)
+            exec(self._compile(code, 'exec'), self.default_namespace, ns)
         except:
             exc_info = sys.exc_info()
             e = exc_info[1]
@@ -408,7 +452,7 @@ def paste_script_template_renderer(content, vars, filename=None):
 class bunch(dict):
 
     def __init__(self, **kw):
-        for name, value in kw.iteritems():
+        for name, value in kw.items():
             setattr(self, name, value)
 
     def __setattr__(self, name, value):
@@ -431,7 +475,7 @@ class bunch(dict):
 
     def __repr__(self):
         items = [
-            (k, v) for k, v in self.iteritems()]
+            (k, v) for k, v in self.items()]
         items.sort()
         return '<%s %s>' % (
             self.__class__.__name__,
@@ -458,6 +502,14 @@ class html(object):
             self.__class__.__name__, self.value)
 
 
+def html_escape(s, quote=False):
+    """Same as cgi.escape, which was removed in Python 3.8"""
+    s = s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    if quote:
+        s = s.replace('"', "&quot;")
+    return s
+
+
 def html_quote(value, force=True):
     if not force and hasattr(value, '__html__'):
         return value.__html__()
@@ -466,10 +518,10 @@ def html_quote(value, force=True):
     if not isinstance(value, basestring_):
         value = coerce_text(value)
     if sys.version >= "3" and isinstance(value, bytes):
-        value = cgi.escape(value.decode('latin1'), 1)
+        value = html_escape(value.decode('latin1'), 1)
         value = value.encode('latin1')
     else:
-        value = cgi.escape(value, 1)
+        value = html_escape(value, 1)
     if sys.version < "3":
         if is_unicode(value):
             value = value.encode('ascii', 'xmlcharrefreplace')
@@ -484,7 +536,7 @@ def url(v):
 
 
 def attr(**kw):
-    kw = list(kw.iteritems())
+    kw = list(kw.items())
     kw.sort()
     parts = []
     for name, value in kw:
@@ -525,6 +577,29 @@ def sub_html(content, **kw):
     return tmpl.substitute(kw)
 
 
+class _StreamOut(object):
+    """Stands in for the list of output parts, writing each part to a
+    file as it is appended."""
+
+    __slots__ = ('append',)
+
+    def __init__(self, fileobj):
+        self.append = fileobj.write
+
+
+def _uses_inherit(codes):
+    for item in codes:
+        if isinstance(item, tuple):
+            if item[0] == 'inherit':
+                return True
+            if any(isinstance(part, (list, tuple)) and _uses_inherit([part])
+                   for part in item[2:]):
+                return True
+        elif isinstance(item, list) and _uses_inherit(item):
+            return True
+    return False
+
+
 class TemplateDef(object):
     def __init__(self, template, func_name, func_signature,
                  body, ns, pos, bound_self=None):
@@ -566,7 +641,7 @@ class TemplateDef(object):
         values = {}
         sig_args, var_args, var_kw, defaults = self._func_signature
         extra_kw = {}
-        for name, value in kw.iteritems():
+        for name, value in kw.items():
             if not var_kw and name not in sig_args:
                 raise TypeError(
                     'Unexpected argument %s' % name)
@@ -589,7 +664,7 @@ class TemplateDef(object):
                 raise TypeError(
                     'Extra position arguments: %s'
                     % ', '.join(repr(v) for v in args))
-        for name, value_expr in defaults.iteritems():
+        for name, value_expr in defaults.items():
             if name not in values:
                 values[name] = self._template._eval(
                     value_expr, self._ns, self._pos)
@@ -685,9 +760,10 @@ def lex(s, name=None, trim_whitespace=True, line_offset=0, delimeters=None):
     last_pos = (1, 1)
     token_re = re.compile(r'%s|%s' % (re.escape(delimeters[0]),
                                       re.escape(delimeters[1])))
+    line_starts = find_line_starts(s)
     for match in token_re.finditer(s):
         expr = match.group(0)
-        pos = find_position(s, match.end(), line_offset)
+        pos = find_position(s, match.end(), line_offset, line_starts)
         if expr == delimeters[0] and in_expr:
             raise TemplateError('%s inside expression' % delimeters[0],
                                 position=pos,
@@ -781,10 +857,30 @@ def trim_lex(tokens):
     return tokens
 
 
-def find_position(string, index, line_offset):
-    """Given a string and index, return (line, column)"""
-    leading = string[:index].splitlines()
-    return (len(leading) + line_offset, len(leading[-1]) + 1)
+# Everything str.splitlines treats as the end of a line
+line_break_re = re.compile('\\r\\n|[\\n\\r\\v\\f\\x1c\\x1d\\x1e\x85\u2028\u2029]')
+
+
+def find_line_starts(string):
+    """Return the offsets at which the lines of string start.
+
+        >>> find_line_starts('a\\nbc\\r\\nd')
+        [0, 2, 6]
+    """
+    return [0] + [match.end() for match in line_break_re.finditer(string)]
+
+
+def find_position(string, index, line_offset, line_starts=None):
+    """Given a string and index, return (line, column)
+
+    Pass the result of ``find_line_starts(string)`` as line_starts to
+    find many positions in the same string: each lookup is then a
+    binary search rather than a scan of everything before index.
+    """
+    if line_starts is None:
+        line_starts = find_line_starts(string)
+    line = bisect.bisect_right(line_starts, index - 1) - 1
+    return (line + 1 + line_offset, index - line_starts[line] + 1)
 
 
 def parse(s, name=None, line_offset=0, delimeters=None):
@@ -840,7 +936,8 @@ def parse(s, name=None, line_offset=0, delimeters=None):
     if delimeters is None:
         delimeters = ( Template.default_namespace['start_braces'],
                        Template.default_namespace['end_braces'] )
-    tokens = lex(s, name=name, line_offset=line_offset, delimeters=delimeters)
+    tokens = TokenList(lex(s, name=name, line_offset=line_offset,
+                           delimeters=delimeters))
     result = []
     while tokens:
         next_chunk, tokens = parse_expr(tokens, name)
@@ -848,6 +945,38 @@ def parse(s, name=None, line_offset=0, delimeters=None):
     return result
 
 
+class TokenList(object):
+    """A view of a list of tokens from a given index on.
+
+    The parse functions consume tokens with ``tokens[1:]``; slicing a
+    TokenList only moves the start index instead of copying what is
+    left of the list, which keeps parsing linear in the template size.
+    """
+
+    __slots__ = ('tokens', 'start')
+
+    def __init__(self, tokens, start=0):
+        self.tokens = tokens
+        self.start = start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.stop is not None or index.step is not None:
+                raise IndexError('TokenList only supports [n:] slices')
+            return TokenList(self.tokens, self.start + (index.start or 0))
+        if index < 0:
+            index += len(self)
+        return self.tokens[self.start + index]
+
+    def __len__(self):
+        return max(len(self.tokens) - self.start, 0)
+
+    def __bool__(self):
+        return self.start < len(self.tokens)
+
+    __nonzero__ = __bool__
+
+
 def parse_expr(tokens, name, context=()):
     if isinstance(tokens[0], basestring_):
         return tokens[0], tokens[1:]
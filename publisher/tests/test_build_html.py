@@ -0,0 +1,69 @@
+from __future__ import unicode_literals, print_function
+
+import io
+import multiprocessing
+import os
+
+import pytest
+
+import build_html
+import build_template
+import buildprofile
+import conf
+import options
+
+from testpath import tempdir
+
+
+def _article(i):
+    authors = ['Ann Person', 'Bob Roe']
+    return {'paper_id': 'paper_%02d' % i, 'title': 'Paper number %d' % i,
+            'authors': ', '.join(authors), 'author': authors,
+            'author_email': ['ann@example.org', 'bob@example.org'],
+            'author_institution': ['Somewhere'],
+            'author_institution_map': {name: ['Somewhere']
+                                       for name in authors},
+            'abstract': ['The abstract of paper %d.' % i],
+            'keywords': 'parallel, rendering',
+            'copyright_holder': 'Ann Person et al.', 'video': '',
+            'bibliography': '', 'pages': 3,
+            'page': {'start': 1 + 3 * i, 'stop': 3 + 3 * i}, 'doi': ''}
+
+
+def _render(monkeypatch, out_dir, jobs):
+    monkeypatch.setattr(build_template, 'html_dir', out_dir)
+    monkeypatch.setattr(build_template, 'bib_dir',
+                        os.path.join(out_dir, 'bib'))
+    os.makedirs(os.path.join(out_dir, 'bib'))
+
+    build_html.render_articles(build_html.config['toc'], jobs)
+
+    pages = {}
+    for root, dirs, files in os.walk(out_dir):
+        for fn in files:
+            path = os.path.join(root, fn)
+            with io.open(path, encoding='utf-8') as f:
+                pages[os.path.relpath(path, out_dir)] = f.read()
+    return pages
+
+
+def test_render_articles_parallel(monkeypatch):
+    try:
+        fork = multiprocessing.get_context('fork')
+    except ValueError:
+        pytest.skip("the test patches modules before forking workers")
+    monkeypatch.setattr(multiprocessing, 'Pool', fork.Pool)
+    monkeypatch.setattr(buildprofile, 'records', [])
+
+    config = options.cfg2dict(conf.proc_conf)
+    # More articles than a worker takes at once
+    config['toc'] = [_article(i) for i in range(20)]
+    monkeypatch.setattr(build_html, 'config', config)
+
+    with tempdir.TemporaryDirectory() as td:
+        serial = _render(monkeypatch, os.path.join(td, 'serial'), 1)
+        parallel = _render(monkeypatch, os.path.join(td, 'parallel'), 2)
+
+    assert len(serial) == 40
+    assert 'Paper number 19' in serial['paper_19.html']
+    assert parallel == serial
@@ -0,0 +1,242 @@
+from __future__ import unicode_literals, print_function
+
+import io
+import os
+
+import build_paper
+import options
+
+from testpath import tempdir
+
+def test_citation_state():
+    with tempdir.TemporaryDirectory() as td:
+        aux = os.path.join(td, 'paper.aux')
+        bib = os.path.join(td, 'mybib.bib')
+        with io.open(aux, mode='wb') as f:
+            f.write(b'\\relax\n\\citation{a}\n\\bibstyle{alphaurl}\n'
+                    b'\\bibdata{mybib}\n\\newlabel{x}{{1}{1}}\n')
+        with io.open(bib, mode='wb') as f:
+            f.write(b'@misc{a}')
+        state = build_paper.citation_state(td, bib)
+
+        # Labels do not concern bibtex
+        with io.open(aux, mode='ab') as f:
+            f.write(b'\\newlabel{y}{{2}{1}}\n')
+        assert build_paper.citation_state(td, bib) == state
+
+        with io.open(aux, mode='ab') as f:
+            f.write(b'\\citation{b}\n')
+        assert build_paper.citation_state(td, bib) != state
+
+
+def test_publish_tex_threads():
+    import threading
+    from writer import publish_tex
+
+    def paper(title):
+        return (build_paper.header +
+                ':author: Ann Person\n:email: a@example.org\n'
+                ':institution: Somewhere\n\n'
+                '%s\n%s\n\n.. class:: abstract\n\n   Abstract.\n\n'
+                'Some text.\n' % (title, '=' * len(title)))
+
+    titles = ['Paper number %d' % i for i in range(4)]
+    results = {}
+
+    def convert(title):
+        results[title] = publish_tex(paper(title),
+                                     build_paper.latex_settings())
+
+    threads = [threading.Thread(target=convert, args=(t,)) for t in titles]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    for title in titles:
+        tex, stats = results[title]
+        assert stats['title'] == title
+        assert stats['author'] == ['Ann Person']
+        assert title in tex.decode('utf-8')
+
+
+
+def test_settings_per_paper():
+    import writer
+
+    settings = build_paper.latex_settings()
+    first = writer._get_settings(settings)
+    # What docutils does for a file the paper includes
+    first.record_dependencies.add('included.rst')
+
+    second = writer._get_settings(settings)
+    assert second.record_dependencies.list == []
+    assert second.stylesheet_dirs is not first.stylesheet_dirs
+
+
+def test_watch_paper(monkeypatch):
+    import time
+
+    with tempdir.TemporaryDirectory() as td:
+        in_path = os.path.join(td, 'papers', 'paper')
+        output_dir = os.path.join(td, 'output')
+        out_path = os.path.join(output_dir, 'paper')
+        os.makedirs(in_path)
+        for fn, content in (('paper.rst', 'Title\n=====\n'),
+                            ('mybib.bib', '@misc{a}'),
+                            ('notes.txt', 'notes')):
+            with io.open(os.path.join(in_path, fn), mode='w',
+                         encoding='utf-8') as f:
+                f.write(content)
+
+        calls = []
+
+        def rebuild_paper(in_path, out_path):
+            calls.append('rebuild_paper')
+            build_paper.copy_sources(in_path, out_path)
+
+        monkeypatch.setattr(build_paper, 'output_dir', output_dir)
+        monkeypatch.setattr(build_paper, 'rebuild_paper', rebuild_paper)
+        monkeypatch.setattr(build_paper, 'write_tex',
+                            lambda *args: calls.append('write_tex'))
+        monkeypatch.setattr(build_paper, 'tex2pdf',
+                            lambda out_path: calls.append('tex2pdf'))
+
+        def edit(seconds):
+            # Called between polls: edit the .bib once, then stop
+            if calls == ['rebuild_paper']:
+                with io.open(os.path.join(in_path, 'mybib.bib'), mode='w',
+                             encoding='utf-8') as f:
+                    f.write('@misc{a}\n@misc{b}')
+                os.remove(os.path.join(out_path, 'notes.txt'))
+                calls.append('edit')
+            elif len(calls) > 2:
+                raise KeyboardInterrupt
+
+        monkeypatch.setattr(time, 'sleep', edit)
+        build_paper.watch_paper(in_path)
+
+        # Neither the .rst converted again nor the other files copied
+        assert calls == ['rebuild_paper', 'edit', 'tex2pdf']
+        with io.open(os.path.join(out_path, 'mybib.bib'),
+                     encoding='utf-8') as f:
+            assert f.read() == '@misc{a}\n@misc{b}'
+        assert not os.path.exists(os.path.join(out_path, 'notes.txt'))
+
+
+class FakePopen(object):
+    """Stands in for subprocess.Popen, recording the commands run."""
+    calls = []
+
+    def __init__(self, args, cwd=None, env=None, **kwargs):
+        self.calls.append((args, cwd, env))
+        self.returncode = 0
+        if '-ini' in args:
+            # Dump the format pdflatex -ini would write
+            name = [a for a in args if a.startswith('-jobname=')][0][9:]
+            with open(os.path.join(cwd, name + '.fmt'), 'wb') as f:
+                f.write(b'format')
+
+    def communicate(self):
+        return b'Output written on paper.pdf (1 page, 10 bytes).', b''
+
+
+def test_preload_format(monkeypatch):
+    import subprocess
+
+    FakePopen.calls = []
+    monkeypatch.setattr(subprocess, 'Popen', FakePopen)
+    monkeypatch.setattr(build_paper, 'tex_format', None)
+    with tempdir.TemporaryDirectory() as td:
+        fmt = build_paper.preload_format(td)
+        assert fmt == build_paper.tex_format == \
+            os.path.join(os.path.abspath(td), 'scipy-preamble.fmt')
+
+        (args, cwd, env), = FakePopen.calls
+        assert args[:2] == ['pdflatex', '-ini']
+        assert '&pdflatex' in args and cwd == td
+
+        with io.open(os.path.join(td, 'scipy-preamble.tex'),
+                     encoding='utf-8') as f:
+            preamble = f.read()
+        assert preamble.startswith('\\documentclass')
+        assert '\\usepackage{scipy}' in preamble
+        # Cut before what differs between papers, then dumped
+        assert '%%% User specified packages' not in preamble
+        assert preamble.endswith(build_paper._format_trailer)
+        assert '\\def\\documentclass' in build_paper._format_trailer
+        assert build_paper._format_trailer.rstrip().endswith('\\dump')
+
+
+def test_pdflatex_format(monkeypatch):
+    import subprocess
+
+    FakePopen.calls = []
+    monkeypatch.setattr(subprocess, 'Popen', FakePopen)
+    monkeypatch.setenv('TEXFORMATS', '/usr/share/formats')
+    with tempdir.TemporaryDirectory() as td:
+        monkeypatch.setattr(build_paper, 'tex_format', None)
+        out, success = build_paper.pdflatex(td)
+        assert success
+
+        monkeypatch.setattr(build_paper, 'tex_format',
+                            '/tmp/fmt/scipy-preamble.fmt')
+        build_paper.pdflatex(td)
+
+    (plain, cwd, plain_env), (preloaded, cwd, env) = FakePopen.calls
+    assert plain == ['pdflatex', '-halt-on-error', 'paper.tex']
+    assert plain_env is None
+    assert preloaded == ['pdflatex', '-halt-on-error',
+                         '-fmt=scipy-preamble', 'paper.tex']
+    assert env['TEXFORMATS'] == '/tmp/fmt' + os.pathsep + '/usr/share/formats'
+
+
+def _run_tex2pdf(monkeypatch, out_path, aux_passes):
+    """Run tex2pdf with pdflatex writing the .aux files `aux_passes` in
+    turn (the last one over and over), and count the runs.
+    """
+    runs = {'pdflatex': 0, 'bibtex': 0}
+
+    def pdflatex(out_path):
+        aux = aux_passes[min(runs['pdflatex'], len(aux_passes) - 1)]
+        runs['pdflatex'] += 1
+        with io.open(os.path.join(out_path, 'paper.aux'), mode='wb') as f:
+            f.write(aux % {b'pass': runs['pdflatex']})
+        return b'Output written on paper.pdf (1 page, 10 bytes).', True
+
+    def bibtex(out_path):
+        runs['bibtex'] += 1
+        with io.open(os.path.join(out_path, 'paper.bbl'), mode='wb') as f:
+            f.write(b'\\bibitem{a}')
+        return b'', True
+
+    monkeypatch.setattr(build_paper, 'pdflatex', pdflatex)
+    monkeypatch.setattr(build_paper, 'bibtex', bibtex)
+    monkeypatch.setattr(build_paper, '_bibtex_inputs', {})
+    build_paper.tex2pdf(out_path)
+    stats = options.cfg2dict(os.path.join(out_path, 'paper_stats.json'))
+    return runs, stats['latex_passes']
+
+
+def test_tex2pdf(monkeypatch):
+    cites = b'\\citation{a}\n\\bibstyle{alphaurl}\n\\bibdata{mybib}\n'
+    with tempdir.TemporaryDirectory() as td:
+        options.dict2cfg({'bibliography': 'mybib'},
+                         os.path.join(td, 'paper_stats.json'))
+        with io.open(os.path.join(td, 'mybib.bib'), mode='wb') as f:
+            f.write(b'@misc{a}')
+
+        # The labels settle on the second pass, the third confirms it;
+        # the citations never change after the first
+        runs, passes = _run_tex2pdf(
+            monkeypatch, td, [cites, cites + b'\\newlabel{x}{{1}{1}}\n'])
+        assert runs == {'pdflatex': 3, 'bibtex': 1}
+        assert passes == 3
+
+        # Never converges
+        os.remove(os.path.join(td, 'paper.aux'))
+        runs, passes = _run_tex2pdf(
+            monkeypatch, td, [cites + b'\\newlabel{x}{{%(pass)d}{1}}\n'])
+        assert runs == {'pdflatex': build_paper.max_latex_passes,
+                        'bibtex': 1}
+        assert passes == build_paper.max_latex_passes
@@ -0,0 +1,95 @@
+from __future__ import unicode_literals, print_function
+
+import io
+import multiprocessing
+import os
+
+import pytest
+
+import build_paper
+import build_papers
+import conf
+
+from testpath import tempdir
+
+
+def _fake_pdflatex(out_path):
+    # Three pages per paper, written straight away
+    with open(os.path.join(out_path, 'paper.pdf'), 'wb') as f:
+        f.write(b'%PDF')
+    return b'Output written on paper.pdf (3 pages, 100 bytes).', True
+
+
+def _worker_settings(paper_id):
+    return conf.use_build_cache, build_paper.tex_format
+
+
+def test_build_parallel(monkeypatch):
+    try:
+        fork = multiprocessing.get_context('fork')
+    except ValueError:
+        pytest.skip("the test patches modules before forking workers")
+
+    with tempdir.TemporaryDirectory() as td:
+        papers_dir = os.path.join(td, 'papers')
+        output_dir = os.path.join(td, 'output')
+        monkeypatch.setattr(build_papers, 'multiprocessing', fork)
+        monkeypatch.setattr(build_papers, 'basedir', td)
+        monkeypatch.setattr(build_papers, 'output_dir', output_dir)
+        monkeypatch.setattr(build_paper, 'papers_dir', papers_dir)
+        monkeypatch.setattr(build_paper, 'output_dir', output_dir)
+        monkeypatch.setattr(build_paper, 'pdflatex', _fake_pdflatex)
+        monkeypatch.setattr(conf, 'use_build_cache', False)
+
+        paper_ids = ['paper_%d' % i for i in range(3)]
+        for i, paper_id in enumerate(paper_ids):
+            os.makedirs(os.path.join(papers_dir, paper_id))
+            title = 'Paper number %d' % i
+            with io.open(os.path.join(papers_dir, paper_id, 'paper.rst'),
+                         mode='w', encoding='utf-8') as f:
+                f.write(':author: Ann Person\n:email: a@example.org\n'
+                        ':institution: Somewhere\n\n%s\n%s\n\n'
+                        'Some text.\n' % (title, '=' * len(title)))
+
+        toc = build_papers.build_parallel(paper_ids, '10.0000', 2)
+
+        assert [entry['page'] for entry in toc] == [
+            {'start': 1, 'stop': 3}, {'start': 4, 'stop': 6},
+            {'start': 7, 'stop': 9}]
+        for i, (paper_id, entry) in enumerate(zip(paper_ids, toc)):
+            assert entry['title'] == 'Paper number %d' % i
+            with io.open(os.path.join(output_dir, paper_id,
+                                      'page_numbers.tex')) as f:
+                assert f.read() == '\\setcounter{page}{%d}' % \
+                    entry['page']['start']
+
+
+def test_workers_inherit_options(monkeypatch):
+    # Spawned workers import the modules afresh, as on macOS
+    monkeypatch.setattr(build_papers, 'multiprocessing',
+                        multiprocessing.get_context('spawn'))
+    monkeypatch.setattr(conf, 'use_build_cache', False)
+    monkeypatch.setattr(build_paper, 'tex_format', '/tmp/scipy-preamble.fmt')
+
+    pool = build_papers.multiprocessing.Pool(
+        1, initializer=build_papers._init_worker,
+        initargs=(conf.use_build_cache, build_paper.tex_format))
+    try:
+        settings = pool.map(_worker_settings, ['paper'])
+    finally:
+        pool.close()
+        pool.join()
+    assert settings == [(False, '/tmp/scipy-preamble.fmt')]
+
+
+def test_stamp_failure(monkeypatch):
+    with tempdir.TemporaryDirectory() as td:
+        monkeypatch.setattr(build_paper, 'papers_dir', td)
+        monkeypatch.setattr(build_paper, 'output_dir', td)
+        monkeypatch.setattr(build_paper, 'pdflatex',
+                            lambda out_path: (b'! Emergency stop.', False))
+        monkeypatch.setattr(conf, 'use_build_cache', False)
+        os.makedirs(os.path.join(td, 'paper'))
+
+        with pytest.raises(RuntimeError, match='renumber paper from p. 5'):
+            build_paper.stamp_page_numbers('paper', 5)
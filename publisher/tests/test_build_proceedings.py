@@ -0,0 +1,129 @@
+from __future__ import unicode_literals
+
+import io
+import itertools
+import os
+
+import pytest
+
+import build_proceedings
+
+from testpath import tempdir
+
+
+def _write_pdf(path, pages):
+    import pypdf
+
+    writer = pypdf.PdfWriter()
+    for i in range(pages):
+        writer.add_blank_page(612, 792)
+    with open(path, 'wb') as f:
+        writer.write(f)
+
+
+def test_assemble_pypdf(monkeypatch):
+    pypdf = pytest.importorskip('pypdf')
+    with tempdir.TemporaryDirectory() as td:
+        monkeypatch.setattr(build_proceedings, 'tex_dir', td)
+        monkeypatch.setattr(build_proceedings, 'pdf_dir', td)
+
+        for name in ('title', 'copyright', 'organization', 'students'):
+            _write_pdf(os.path.join(td, name + '.pdf'), 2)
+        _write_pdf(os.path.join(td, 'toc.pdf'), 1)
+        _write_pdf(os.path.join(td, 'a.pdf'), 3)
+        _write_pdf(os.path.join(td, 'b.pdf'), 2)
+        config = {'toc': [{'paper_id': 'a', 'title': 'Paper A',
+                           'page': {'start': 1, 'stop': 3}},
+                          {'paper_id': 'b', 'title': 'Paper B',
+                           'page': {'start': 4, 'stop': 5}}]}
+
+        assert build_proceedings.assemble_pypdf(config)
+
+        reader = pypdf.PdfReader(os.path.join(td, 'proceedings.pdf'))
+        # title (1 page), blank, copyright (2), organization (2),
+        # students (2), toc (1), then the papers
+        assert len(reader.pages) == 14
+        assert reader.page_labels[9:] == ['1', '2', '3', '4', '5']
+        assert reader.page_labels[:2] == ['i', 'ii']
+        assert [o.title for o in reader.outline] == ['Contents', 'Paper A',
+                                                      'Paper B']
+
+
+templates = {
+    'title': '\\usepackage{static/status}\n'
+             '\\includegraphics{../../_static/logo.png}\n',
+    'copyright': '\\usepackage{static/status}\nCopyright\n',
+    'organization': '\\usepackage{static/status}\nOrganization\n',
+    'students': '\\usepackage{static/status}\nStudents\n',
+    'toc': 'Contents\n',
+}
+
+
+def test_build_proceedings_manifest(monkeypatch):
+    with tempdir.TemporaryDirectory() as td:
+        tex_dir = os.path.join(td, 'tex')
+        static = {'status.sty': 'draft', 'logo.png': 'logo'}
+        built, assembled = [], []
+        runs = itertools.count()
+
+        def copy_static_files(dest_fn):
+            os.makedirs(os.path.join(tex_dir, 'static'), exist_ok=True)
+            for fn, content in static.items():
+                with io.open(os.path.join(tex_dir, 'static', fn), 'w') as f:
+                    f.write(content)
+
+        def pdflatex(name, passes=1):
+            built.append(name)
+            # A different PDF every time
+            with open(os.path.join(tex_dir, name + '.pdf'), 'w') as f:
+                f.write('%s %d' % (name, next(runs)))
+            return True
+
+        monkeypatch.setattr(build_proceedings, 'tex_dir', tex_dir)
+        monkeypatch.setattr(build_proceedings, 'pdf_dir', td)
+        monkeypatch.setattr(build_proceedings, 'manifest_file',
+                            os.path.join(td, 'manifest.json'))
+        monkeypatch.setattr(build_proceedings, 'copy_static_files',
+                            copy_static_files)
+        monkeypatch.setattr(build_proceedings, 'render_template',
+                            lambda name, config, dest: templates[name[:-4]])
+        monkeypatch.setattr(build_proceedings, 'pdflatex', pdflatex)
+
+        def assemble(config):
+            assembled.append(True)
+            with open(os.path.join(td, 'proceedings.pdf'), 'w') as f:
+                f.write('proceedings')
+            return True
+
+        monkeypatch.setitem(build_proceedings.backends, 'pypdf', assemble)
+
+        with open(os.path.join(td, 'a.pdf'), 'w') as f:
+            f.write('a')
+        config = {'toc': [{'paper_id': 'a', 'title': 'Paper A',
+                           'page': {'start': 1, 'stop': 3}}]}
+
+        def build():
+            del built[:], assembled[:]
+            assert build_proceedings.build_proceedings(config, 'pypdf')
+            return sorted(built), len(assembled)
+
+        assert build() == (['copyright', 'organization', 'students',
+                            'title', 'toc'], 1)
+        # Nothing changed
+        assert build() == ([], 0)
+
+        # A new logo only concerns the title page
+        static['logo.png'] = 'new logo'
+        assert build() == (['title'], 1)
+
+        # Switching from draft to ready changes all the front matter
+        static['status.sty'] = 'ready'
+        assert build() == (['copyright', 'organization', 'students',
+                            'title'], 1)
+
+        # A missing PDF is built again; a new paper PDF is assembled
+        os.remove(os.path.join(tex_dir, 'students.pdf'))
+        assert build() == (['students'], 1)
+        with open(os.path.join(td, 'a.pdf'), 'w') as f:
+            f.write('a, revised')
+        assert build() == ([], 1)
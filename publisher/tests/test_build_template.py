@@ -0,0 +1,48 @@
+from __future__ import unicode_literals, print_function
+
+import io
+import os
+
+import conf
+import tempita
+import build_template
+
+from testpath import tempdir
+
+def _write(path, content, mtime):
+    with io.open(path, mode='w', encoding='utf-8') as f:
+        f.write(content)
+    os.utime(path, (mtime, mtime))
+
+
+def test_get_template_cache():
+    with tempdir.TemporaryDirectory() as td:
+        path = os.path.join(td, 'page.html.tmpl')
+        _write(path, 'Hello {{name}}', 1000)
+
+        template = build_template.get_template(path, tempita.HTMLTemplate)
+        assert build_template.get_template(path, tempita.HTMLTemplate) is template
+        assert template.substitute({'name': 'A & B'}) == 'Hello A &amp; B'
+
+        _write(path, 'Bye {{name}}', 2000)
+        template = build_template.get_template(path, tempita.HTMLTemplate)
+        assert template.substitute({'name': 'you'}) == 'Bye you'
+
+
+def test_get_template_pickle(monkeypatch):
+    with tempdir.TemporaryDirectory() as td:
+        monkeypatch.setattr(conf, 'pickle_templates', True)
+        monkeypatch.setattr(build_template, 'template_cache_dir',
+                            os.path.join(td, 'cache'))
+        path = os.path.join(td, 'paper.tex.tmpl')
+        _write(path, '{{for x in xs}}{{x}} {{endfor}}', 1000)
+
+        first = build_template.get_template(path, build_template.TeXTemplate)
+        assert os.listdir(os.path.join(td, 'cache'))
+
+        # A new process only finds the pickled parse tree
+        build_template._templates.clear()
+        second = build_template.get_template(path, build_template.TeXTemplate)
+        assert second is not first
+        assert second._parsed == first._parsed
+        assert second.substitute({'xs': ['a', 'b&c']}) == 'a b\\&c '
@@ -0,0 +1,53 @@
+from __future__ import unicode_literals, print_function
+
+import io
+import os
+
+import buildcache
+
+from testpath import tempdir
+
+def _write(path, content):
+    with io.open(path, mode='w', encoding='utf-8') as f:
+        f.write(content)
+
+
+def test_paper_key():
+    with tempdir.TemporaryDirectory() as td:
+        _write(os.path.join(td, 'paper.rst'), 'Title\n=====\n')
+        key = buildcache.paper_key(td, 1)
+        assert key == buildcache.paper_key(td, 1)
+        assert key != buildcache.paper_key(td, 5)
+
+        _write(os.path.join(td, 'paper.rst'), 'Other title\n===========\n')
+        assert key != buildcache.paper_key(td, 1)
+
+
+def test_store_restore(monkeypatch):
+    with tempdir.TemporaryDirectory() as td:
+        monkeypatch.setattr(buildcache, 'paper_cache_dir',
+                            os.path.join(td, 'cache'))
+        built = os.path.join(td, 'built')
+        os.mkdir(built)
+        for fn in buildcache.required_artifacts:
+            _write(os.path.join(built, fn), fn)
+
+        out = os.path.join(td, 'out')
+        assert not buildcache.restore('paper', 'abc', out)
+        buildcache.store('paper', 'abc', built)
+        assert buildcache.restore('paper', 'abc', out)
+        assert sorted(os.listdir(out)) == sorted(buildcache.required_artifacts)
+
+
+def test_paper_key_proceedings(monkeypatch):
+    with tempdir.TemporaryDirectory() as td:
+        proc_conf = os.path.join(td, 'scipy_proc.json')
+        monkeypatch.setattr(buildcache.conf, 'proc_conf', proc_conf)
+        paper = os.path.join(td, 'paper')
+        os.mkdir(paper)
+        _write(os.path.join(paper, 'paper.rst'), 'Title\n=====\n')
+
+        _write(proc_conf, '{"proceedings": {"year": "2023"}}')
+        key = buildcache.paper_key(paper, 1)
+        _write(proc_conf, '{"proceedings": {"year": "2024"}}')
+        assert key != buildcache.paper_key(paper, 1)
@@ -0,0 +1,114 @@
+from __future__ import unicode_literals, print_function
+
+import json
+import os
+
+import pytest
+
+import buildprofile
+import options
+
+from testpath import tempdir
+
+
+@pytest.fixture
+def records(monkeypatch):
+    recs = []
+    monkeypatch.setattr(buildprofile, 'records', recs)
+    return recs
+
+
+def test_stage(records):
+    with buildprofile.paper('paper'):
+        with buildprofile.stage('copy_tree') as record:
+            record['bytes_copied'] = 10
+    with buildprofile.stage('write_articles'):
+        pass
+
+    assert [(r['stage'], r['paper_id']) for r in records] == [
+        ('copy_tree', 'paper'), ('write_articles', None)]
+    assert records[0]['bytes_copied'] == 10
+    assert all(r['seconds'] >= 0 for r in records)
+    drained = buildprofile.drain()
+    assert [r['stage'] for r in drained] == ['copy_tree', 'write_articles']
+    assert records == []
+
+
+def test_stage_memory(records):
+    if buildprofile.resource is None:
+        pytest.skip("resource usage is not available")
+    before, children_before = buildprofile.peak_rss()
+
+    # Allocate past the peak so far, so that the stage raises it
+    with buildprofile.stage('allocate'):
+        block = b'x' * ((before + 32 * 1024) * 1024)
+    with buildprofile.stage('idle'):
+        pass
+    del block
+
+    allocate, idle = records
+    assert allocate['peak_rss_growth_kb'] >= 32 * 1024
+    assert idle['peak_rss_growth_kb'] == 0
+    assert idle['process_peak_rss_kb'] == allocate['process_peak_rss_kb']
+    assert allocate['children_peak_rss_growth_kb'] == 0
+
+
+def _record(stage, paper_id, seconds, growth):
+    return {'stage': stage, 'paper_id': paper_id, 'seconds': seconds,
+            'peak_rss_growth_kb': growth,
+            'children_peak_rss_growth_kb': 0}
+
+
+def test_totals():
+    recs = [_record('docutils', 'a', 1.0, 100),
+            _record('build_paper', 'a', 2.0, 100),
+            _record('docutils', 'b', 0.5, 0),
+            _record('build_paper', 'b', 1.0, 0),
+            _record('stamp_page_numbers', 'b', 0.5, 50),
+            _record('write_articles', None, 3.0, 10)]
+
+    stages = buildprofile.stage_totals(recs)
+    assert stages['docutils'] == {'calls': 2, 'seconds': 1.5,
+                                  'peak_rss_growth_kb': 100,
+                                  'children_peak_rss_growth_kb': 0}
+
+    papers = buildprofile.paper_totals(recs)
+    assert sorted(papers) == ['a', 'b']
+    assert papers['a']['seconds'] == 2.0
+    assert papers['a']['peak_rss_growth_kb'] == 100
+    assert papers['b']['seconds'] == 1.5
+    assert papers['b']['peak_rss_growth_kb'] == 50
+    assert papers['b']['stages'] == {'docutils': 0.5, 'build_paper': 1.0,
+                                     'stamp_page_numbers': 0.5}
+
+
+def test_write_report():
+    with tempdir.TemporaryDirectory() as td:
+        filename = os.path.join(td, 'build_profile.json')
+        buildprofile.write_report(filename, 'build_papers',
+                                  [_record('docutils', 'a', 1.0, 100)])
+        buildprofile.write_report(filename, 'build_html',
+                                  [_record('render_article', 'a', 0.1, 0)])
+        with open(filename) as f:
+            report = json.load(f)
+        assert sorted(report) == ['build_html', 'build_papers']
+        assert report['build_papers']['papers']['a']['stages'] == \
+            {'docutils': 1.0}
+
+
+def test_write_report_atomic(monkeypatch):
+    def interrupted(d, f, *args, **kwargs):
+        f.write('{"build_html"')
+        raise KeyboardInterrupt
+
+    with tempdir.TemporaryDirectory() as td:
+        filename = os.path.join(td, 'build_profile.json')
+        buildprofile.write_report(filename, 'build_papers',
+                                  [_record('docutils', 'a', 1.0, 100)])
+        monkeypatch.setattr(options.json, 'dump', interrupted)
+        with pytest.raises(KeyboardInterrupt):
+            buildprofile.write_report(filename, 'build_html', [])
+
+        with open(filename) as f:
+            assert sorted(json.load(f)) == ['build_papers']
+        assert os.listdir(td) == ['build_profile.json']
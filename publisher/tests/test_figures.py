@@ -0,0 +1,89 @@
+from __future__ import unicode_literals
+
+import os
+
+import pytest
+
+import conf
+import figures
+
+from testpath import tempdir
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def test_target_size(monkeypatch):
+    monkeypatch.setattr(conf, 'figure_dpi', 300)
+    column = {'width': 'columnwidth', 'scale': 1.0}
+    assert figures.target_size((8000, 4000), 72, column) == ((1050, 525),
+                                                              1050 / (8000 / 72.))
+    assert figures.target_size((1000, 500), 72, column) is None
+
+    scaled = {'width': None, 'scale': 0.1}
+    size, dpi = figures.target_size((8000, 4000), 300, scaled)
+    assert size == (800, 400)
+    # The natural size, 8000 / 300 inches, is kept
+    assert abs(size[0] / dpi - 8000 / 300.) < 1e-9
+
+
+def test_prepare(monkeypatch):
+    with tempdir.TemporaryDirectory() as in_path, \
+            tempdir.TemporaryDirectory() as out_path, \
+            tempdir.TemporaryDirectory() as cache:
+        monkeypatch.setattr(conf, 'downsample_figures', True)
+        monkeypatch.setattr(conf, 'figure_cache_dir', cache)
+
+        for path in (in_path, out_path):
+            Image.new('RGB', (4000, 2000)).save(os.path.join(path, 'big.png'),
+                                                dpi=(72, 72))
+            Image.new('RGB', (400, 200)).save(os.path.join(path, 'small.png'))
+        figures.write_figures([{'uri': 'big.png', 'width': 'columnwidth',
+                                'scale': 1.0},
+                               {'uri': 'small.png', 'width': 'columnwidth',
+                                'scale': 1.0},
+                               {'uri': 'plot.pdf', 'width': None,
+                                'scale': 0.5}], out_path)
+        figures.prepare(in_path, out_path)
+
+        with Image.open(os.path.join(out_path, 'big.png')) as image:
+            assert image.size == (1050, 525)
+            assert abs(image.info['dpi'][0] - 1050 / (4000 / 72.)) < 0.01
+        with Image.open(os.path.join(out_path, 'small.png')) as image:
+            assert image.size == (400, 200)
+        assert len(os.listdir(cache)) == 1
+
+
+def test_stamp_keeps_downsampled(monkeypatch):
+    import build_paper
+    import buildcache
+
+    with tempdir.TemporaryDirectory() as td:
+        monkeypatch.setattr(conf, 'downsample_figures', True)
+        monkeypatch.setattr(conf, 'use_build_cache', True)
+        monkeypatch.setattr(conf, 'figure_cache_dir',
+                            os.path.join(td, 'figures'))
+        monkeypatch.setattr(buildcache, 'paper_cache_dir',
+                            os.path.join(td, 'papers_cache'))
+        monkeypatch.setattr(build_paper, 'papers_dir',
+                            os.path.join(td, 'papers'))
+        monkeypatch.setattr(build_paper, 'output_dir',
+                            os.path.join(td, 'output'))
+        monkeypatch.setattr(build_paper, 'pdflatex',
+                            lambda out_path: (b'', True))
+
+        in_path = os.path.join(td, 'papers', 'paper')
+        out_path = os.path.join(td, 'output', 'paper')
+        os.makedirs(in_path)
+        os.makedirs(out_path)
+        Image.new('RGB', (4000, 2000)).save(os.path.join(in_path, 'big.png'),
+                                            dpi=(72, 72))
+        figures.write_figures([{'uri': 'big.png', 'width': 'columnwidth',
+                                'scale': 1.0}], out_path)
+
+        # First build, then renumbering
+        build_paper.copy_sources(in_path, out_path)
+        figures.prepare(in_path, out_path)
+        build_paper.stamp_page_numbers('paper', 5)
+
+        with Image.open(os.path.join(out_path, 'big.png')) as image:
+            assert image.size == (1050, 525)
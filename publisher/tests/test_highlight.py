@@ -0,0 +1,49 @@
+from __future__ import unicode_literals
+
+import os
+
+import conf
+from writer import highlight
+
+from testpath import tempdir
+
+
+def test_highlight_cache(monkeypatch):
+    with tempdir.TemporaryDirectory() as td:
+        monkeypatch.setattr(conf, 'highlight_cache_dir', td)
+        monkeypatch.setattr(conf, 'use_build_cache', True)
+
+        code = 'def f(x):\n    return x + 1\n'
+        tex = highlight.highlight_latex(code, 'python')
+        assert '\\begin{Verbatim}' in tex
+        assert len(os.listdir(td)) == 1
+
+        # A cached block is read back without running Pygments
+        monkeypatch.setattr(highlight.pygments, 'highlight', None)
+        assert highlight.highlight_latex(code, 'python') == tex
+        assert highlight.get_lexer('python') is highlight.get_lexer('python')
+
+
+def test_highlight_cache_pruned(monkeypatch):
+    with tempdir.TemporaryDirectory() as td:
+        monkeypatch.setattr(conf, 'highlight_cache_dir', td)
+        monkeypatch.setattr(conf, 'use_build_cache', True)
+        monkeypatch.setattr(highlight, 'keep', 3)
+
+        def block(i):
+            return 'x = %d\n' % i
+
+        for i in range(3):
+            highlight.highlight_latex(block(i), 'python')
+            path = highlight._cache_path(block(i), 'python', False, 1, '')
+            os.utime(path, (1000 + i, 1000 + i))
+        # Used again: now the most recent
+        highlight.highlight_latex(block(0), 'python')
+
+        highlight.highlight_latex(block(3), 'python')
+        cached = sorted(os.listdir(td))
+        assert len(cached) == 3
+        assert cached == sorted(
+            os.path.basename(highlight._cache_path(block(i), 'python',
+                                                   False, 1, ''))
+            for i in (0, 2, 3))
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+
+from latextools import unicode_to_latex
+
+def test_unicode_to_latex():
+    assert unicode_to_latex('Stéfan') == "St{\\'{e}}fan"
+    assert unicode_to_latex('Jiří') == "Ji{\\v{r}}{\\'{\\i}}"
+    assert unicode_to_latex('Łukasz Ødegård') == \
+        "{\\L}ukasz {\\O}deg{\\r{a}}rd"
+    assert unicode_to_latex('1–2 — “x”') == "1--2 --- ``x''"
+
+
+def test_unicode_to_latex_passthrough():
+    # ASCII, and characters LaTeX has no command for, are left alone
+    assert unicode_to_latex('plain \\LaTeX{}') == 'plain \\LaTeX{}'
+    assert unicode_to_latex('数值') == '数值'
@@ -0,0 +1,163 @@
+from __future__ import unicode_literals
+
+import argparse
+import os
+import smtplib
+import sys
+
+import pytest
+from testpath import tempdir
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'mail'))
+import _mailer
+
+
+class FakeSMTP(object):
+    """Stands in for smtplib.SMTP, recording what it sends."""
+    sent = []
+    opened = 0
+    # Failures to raise for a recipient, in turn
+    failures = {}
+
+    def __init__(self, host, port):
+        FakeSMTP.opened += 1
+
+    def ehlo(self):
+        pass
+
+    def starttls(self):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def sendmail(self, sender, recipients, message):
+        failures = self.failures.get(recipients[0])
+        if failures:
+            raise failures.pop(0)
+        self.sent.append((sender, recipients, message))
+
+    def quit(self):
+        pass
+
+    close = quit
+
+
+@pytest.fixture
+def fake_smtp():
+    FakeSMTP.sent = []
+    FakeSMTP.opened = 0
+    FakeSMTP.failures = {}
+    return FakeSMTP
+
+
+def test_deliver_reuses_connections(fake_smtp):
+    import _outbox
+
+    with tempdir.TemporaryDirectory() as td:
+        outbox = _outbox.Outbox(os.path.join(td, 'outbox.jsonl'))
+        for i in range(50):
+            outbox.add('a%d@example.org' % i, ('localhost', 25),
+                       {'name': 'me@example.org', 'login': 'me'},
+                       ['a%d@example.org' % i], 'Hello')
+        with _mailer.SMTPPool('localhost', 25, size=3,
+                              smtp_class=fake_smtp) as pool:
+            _outbox.deliver(outbox, outbox.pending(), pool, 3,
+                            _mailer.encode_message)
+        assert outbox.pending() == []
+    assert sorted(fake_smtp.sent) == sorted(
+        ('me@example.org', ['a%d@example.org' % i], b'Hello')
+        for i in range(50))
+    assert fake_smtp.opened <= 3
+
+
+def test_pool_retries(fake_smtp):
+    fake_smtp.failures = {
+        'a@example.org': [smtplib.SMTPServerDisconnected('gone'),
+                          smtplib.SMTPDataError(451, b'try again')],
+        'b@example.org': [smtplib.SMTPDataError(550, b'no such user')],
+    }
+    with _mailer.SMTPPool('localhost', 25, size=1, retries=2, backoff=0,
+                          smtp_class=fake_smtp) as pool:
+        pool.send('me@example.org', ['a@example.org'], b'Hello')
+        with pytest.raises(smtplib.SMTPDataError):
+            pool.send('me@example.org', ['b@example.org'], b'Hello')
+    assert fake_smtp.sent == [('me@example.org', ['a@example.org'],
+                               b'Hello')]
+    # A new connection after the disconnection only
+    assert fake_smtp.opened == 2
+
+
+def test_encode_message():
+    assert _mailer.split_recipients('"A" <a@example.org>, b@example.org') \
+        == ['a@example.org', 'b@example.org']
+    assert _mailer.encode_message('To: a\nSubject: “x”\n\nb\r\n') \
+        == b'To: a\r\nSubject: \xe2\x80\x9cx\xe2\x80\x9d\r\n\r\nb\r\n'
+
+
+def test_outbox_resumes(fake_smtp, monkeypatch):
+    monkeypatch.setattr(_mailer, '_from_template',
+                        lambda template, data: 'To: %s\n\nHello' % data['email'])
+    monkeypatch.setattr(_mailer, 'password', 'secret')
+    sender = {'name': 'me@example.org', 'login': 'me', 'password': 'secret'}
+
+    def run(outbox):
+        monkeypatch.setattr(_mailer, 'args', argparse.Namespace(
+            dry_run=False, outbox=outbox, jobs=2, rate=None, retries=0))
+        monkeypatch.setattr(_mailer, 'outboxes', {})
+        for name in 'abc':
+            _mailer.send_template(sender, name + '@example.org', 'test.txt',
+                                  {})
+        return _mailer.send_queued(smtp_class=fake_smtp)
+
+    with tempdir.TemporaryDirectory() as td:
+        outbox = os.path.join(td, 'test.jsonl')
+        fake_smtp.failures = {
+            'b@example.org': [smtplib.SMTPDataError(550, b'no such user')]}
+        assert run(outbox) == 1
+        assert sorted(sent[1][0] for sent in fake_smtp.sent) == \
+            ['a@example.org', 'c@example.org']
+        with open(outbox) as f:
+            assert 'secret' not in f.read()
+
+        # Only the message that failed is sent again
+        fake_smtp.sent = []
+        assert run(outbox) == 0
+        assert fake_smtp.sent == [('me@example.org', ['b@example.org'],
+                                   b'To: b@example.org\r\n\r\nHello')]
+        fake_smtp.sent = []
+        assert run(outbox) == 0
+        assert fake_smtp.sent == []
+
+
+def test_outbox_per_run(fake_smtp, monkeypatch, capsys):
+    monkeypatch.setattr(_mailer, '_from_template',
+                        lambda template, data: 'To: %s\n\nHello' % data['email'])
+    monkeypatch.setattr(_mailer, 'password', 'secret')
+    monkeypatch.setattr(_mailer, 'args', argparse.Namespace(
+        dry_run=False, outbox=None, jobs=2, rate=None, retries=0))
+    sender = {'name': 'me@example.org', 'login': 'me', 'password': 'secret'}
+
+    def run(started):
+        monkeypatch.setattr(_mailer, 'run_started', started)
+        monkeypatch.setattr(_mailer, 'outboxes', {})
+        for name in 'ab':
+            _mailer.send_template(sender, name + '@example.org', 'test.txt',
+                                  {})
+        return _mailer.send_queued(smtp_class=fake_smtp)
+
+    with tempdir.TemporaryDirectory() as td:
+        monkeypatch.setattr(_mailer, 'outbox_dir', td)
+        fake_smtp.failures = {
+            'b@example.org': [smtplib.SMTPDataError(550, b'no such user')]}
+        assert run('1') == 1
+        # Kept, to retry the message that failed
+        assert os.listdir(td) == ['test.txt-1.jsonl']
+        assert '--outbox %s' % os.path.join(td, 'test.txt-1.jsonl') in \
+            capsys.readouterr().out
+
+        # A later round sends everything again, and leaves no outbox
+        fake_smtp.sent = []
+        assert run('2') == 0
+        assert len(fake_smtp.sent) == 2
+        assert os.listdir(td) == ['test.txt-1.jsonl']
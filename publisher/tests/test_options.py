@@ -20,3 +20,86 @@ def test_cfg2dict():
         options.dict2cfg(d, loc_path)
         test_d = options.cfg2dict(loc_path)
         assert test_d == d
+
+
+def test_cfg2dict_cache():
+    with tempdir.TemporaryDirectory() as td:
+        loc_path = os.path.join(td, 'paper_stats.json')
+        options.dict2cfg({'pages': 1}, loc_path)
+        d = options.cfg2dict(loc_path)
+        d['pages'] = 2
+        # Callers get a copy, not the cached content
+        assert options.cfg2dict(loc_path) == {'pages': 1}
+
+        # Changed behind the cache's back
+        with open(loc_path, 'w') as f:
+            f.write('{"pages": 3}')
+        assert options.cfg2dict(loc_path) == {'pages': 3}
+        assert sorted(os.listdir(td)) == ['paper_stats.json']
+
+
+def test_batched_writes():
+    with tempdir.TemporaryDirectory() as td:
+        loc_path = os.path.join(td, 'paper_stats.json')
+        with options.batched_writes():
+            with options.update_cfg(loc_path) as d:
+                d['title'] = 'temp_title'
+            with options.update_cfg(loc_path) as d:
+                d['pages'] = 8
+            assert not os.path.exists(loc_path)
+            assert options.cfg2dict(loc_path) == {'title': 'temp_title',
+                                                  'pages': 8}
+        assert options.cfg2dict(loc_path) == {'title': 'temp_title',
+                                              'pages': 8}
+
+
+def test_update_cfg_threads():
+    import threading
+
+    with tempdir.TemporaryDirectory() as td:
+        loc_path = os.path.join(td, 'paper_stats.json')
+
+        def update(i):
+            for j in range(20):
+                with options.update_cfg(loc_path) as d:
+                    d['%d-%d' % (i, j)] = j
+
+        threads = [threading.Thread(target=update, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(options.cfg2dict(loc_path)) == 80
+
+
+def test_lazy_options():
+    import conf
+
+    assert options.options is options.get_options()
+    assert conf.dirs is conf.get_dirs()
+    assert conf.other_dirs is conf.get_other_dirs()
+
+
+def test_batched_update_threads():
+    import threading
+    import time
+
+    with tempdir.TemporaryDirectory() as td:
+        loc_path = os.path.join(td, 'paper_stats.json')
+        options.dict2cfg({'updates': 0}, loc_path)
+
+        def update():
+            with options.batched_writes():
+                with options.update_cfg(loc_path) as d:
+                    d['updates'] += 1
+                # Written when the batch ends, not now
+                time.sleep(0.05)
+
+        threads = [threading.Thread(target=update) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert options.cfg2dict(loc_path) == {'updates': 4}
+        # No lock files left behind
+        assert os.listdir(td) == ['paper_stats.json']
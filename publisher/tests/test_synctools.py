@@ -0,0 +1,41 @@
+from __future__ import unicode_literals
+
+import io
+import os
+
+import synctools
+
+from testpath import tempdir
+
+def _write(path, content):
+    with io.open(path, mode='wb') as f:
+        f.write(content)
+
+
+def test_sync_tree():
+    with tempdir.TemporaryDirectory() as src, \
+            tempdir.TemporaryDirectory() as dest:
+        os.mkdir(os.path.join(src, 'figures'))
+        _write(os.path.join(src, 'paper.rst'), b'Title\n')
+        _write(os.path.join(src, 'figures', 'fig.png'), b'x' * 100)
+
+        assert synctools.sync_tree(src, dest) == (106, 0)
+        assert synctools.sync_tree(src, dest) == (0, 106)
+
+        # Same content with a new modification time is not copied again
+        os.utime(os.path.join(src, 'paper.rst'), (1000, 1000))
+        assert synctools.sync_tree(src, dest) == (0, 106)
+
+        _write(os.path.join(src, 'figures', 'fig.png'), b'y' * 100)
+        assert synctools.sync_tree(src, dest) == (100, 6)
+        with io.open(os.path.join(dest, 'figures', 'fig.png'), 'rb') as f:
+            assert f.read() == b'y' * 100
+
+
+def test_sync_file_link():
+    with tempdir.TemporaryDirectory() as td:
+        src = os.path.join(td, 'a.pdf')
+        dest = os.path.join(td, 'b.pdf')
+        _write(src, b'%PDF')
+        assert synctools.sync_file(src, dest, link=True) == (0, 4)
+        assert os.path.samefile(src, dest)
@@ -0,0 +1,67 @@
+from __future__ import unicode_literals
+
+import io
+
+import tempita
+
+
+def _naive_position(string, index, line_offset):
+    leading = string[:index].splitlines()
+    return (len(leading) + line_offset, len(leading[-1]) + 1)
+
+
+def test_find_position():
+    s = 'ab\ncd\r\nef\rgh\n\nij\x0ckl mn'
+    line_starts = tempita.find_line_starts(s)
+    for index, char in enumerate(s):
+        if char.isalpha():
+            assert (tempita.find_position(s, index + 1, 2, line_starts)
+                    == _naive_position(s, index + 1, 2))
+
+
+def test_lex_positions():
+    s = ('first {{a}}\r\n'
+         '{{for x in y}}\n'
+         '  {{x}} and {{b}}\n'
+         '{{endfor}}')
+    positions = [token[1] for token in tempita.lex(s, trim_whitespace=False)
+                 if isinstance(token, tuple)]
+    assert positions == [(1, 9), (2, 3), (3, 5), (3, 15), (4, 3)]
+
+
+def test_parse_large():
+    s = ''.join('line {{x}}\n{{if x}}yes{{else}}no{{endif}}\n'
+                for i in range(2000))
+    template = tempita.Template(s)
+    assert template.substitute(x=1) == 'line 1\nyes\n' * 2000
+
+
+def test_compiled_code_cache():
+    template = tempita.Template('{{py:n = 0}}{{for x in xs}}{{ x * 2 | str}}'
+                                '{{py:n += 1}}{{endfor}} {{n}}')
+    assert template.substitute(xs=[1, 2, 3]) == '246 3'
+    assert ((' x * 2 ', 'eval') in template._code)
+    assert template.substitute(xs=[4]) == '8 1'
+
+    template = tempita.Template('a\n{{1 +}}')
+    try:
+        template.substitute()
+    except SyntaxError as e:
+        assert 'invalid syntax in expression: 1 +' in str(e)
+    else:
+        assert False, 'no SyntaxError'
+
+
+def test_stream():
+    template = tempita.HTMLTemplate('<ul>{{for x in xs}}<li>{{x}}</li>'
+                                    '{{endfor}}</ul>')
+    out = io.StringIO()
+    template.stream({'xs': ['a', 'b & c']}, out)
+    assert out.getvalue() == template.substitute(xs=['a', 'b & c'])
+
+    parent = tempita.Template('[{{self.body}}]')
+    child = tempita.Template('{{inherit "parent"}}body',
+                             get_template=lambda name, from_template: parent)
+    out = io.StringIO()
+    child.stream({}, out)
+    assert out.getvalue() == '[body]'
@@ -0,0 +1,175 @@
+from __future__ import unicode_literals
+
+import io
+import os
+import re
+
+import lxml.etree as xml
+import pytest
+from testpath import tempdir
+
+import xreftools
+
+scipy_entry = {
+    'proceedings': {
+        'title': {'conference': 'Python in Science Conference',
+                  'acronym': 'SciPy', 'ordinal': '1st',
+                  'full': 'Proceedings of the 1st Python in Science Conference'},
+        'location': 'Austin, Texas', 'dates': 'July 1-2', 'year': '2026',
+        'doi': '10.25080/proc',
+        'xref': {'depositor_name': 'Ann Person',
+                 'depositor_email': 'ann@example.org',
+                 'registrant': 'Crossref',
+                 'resource_url': 'https://example.org/proceedings'}},
+    'series': {'title': {'full': 'Proceedings of the Python in Science '
+                                 'Conference'},
+               'xref': {'issn': '2575-9752',
+                        'resource_url': 'https://example.org/proceedings'},
+               'doi': '10.25080/series'},
+}
+
+toc = [{'paper_id': 'paper_%d' % i, 'title': 'Paper \u00e9 %d' % i,
+        'author': ['Ann Person', 'Bob Roe'], 'doi': '10.25080/paper-%d' % i,
+        'page': {'start': 1 + 8 * i, 'stop': 8 + 8 * i}}
+       for i in range(3)]
+
+slides = {'posters': [{'authors': ['Bob Roe'], 'title': 'A poster',
+                       'doi': '10.25080/poster'}]}
+
+
+def test_split_name(monkeypatch):
+    monkeypatch.setattr(xreftools, '_name_overrides',
+                        {'Prince': ('Prince', 'Nelson')})
+    xreftools.parse_name.cache_clear()
+
+    assert xreftools.split_name('Stefan van der Walt') == ('Stefan',
+                                                           'van der Walt')
+    assert xreftools.split_name('Prince') == ('Prince', 'Nelson')
+    assert xreftools.split_name('Cher') == ('Cher', 'MISSING')
+
+    names = xreftools.split_names(['Ann Person', 'Bob Roe', 'Ann Person'])
+    assert names == {'Ann Person': ('Ann', 'Person'),
+                     'Bob Roe': ('Bob', 'Roe')}
+    assert xreftools.parse_name.cache_info().misses == 4
+
+
+def test_stream_metadata(monkeypatch):
+    monkeypatch.setattr(xreftools, 'make_batch_id', lambda: 'batch')
+    xref = xreftools.XrefMeta(scipy_entry, toc, slides)
+    xref.make_metadata()
+
+    for batch, stream in [(xref.papers_batch, xref.stream_papers_batch),
+                          (xref.slides_batch, xref.stream_slides_batch)]:
+        out = io.BytesIO()
+        xml.ElementTree(batch).write(out)
+        streamed = io.BytesIO()
+        stream(streamed)
+        # Only the timestamps may differ
+        assert (re.sub(b'<timestamp>\\d+', b'', streamed.getvalue())
+                == re.sub(b'<timestamp>\\d+', b'', out.getvalue()))
+
+
+# A stand-in for the CrossRef schema, which includes and imports others
+# like it does
+schemas = {
+    'crossref4.4.2.xsd': """\
+<xsd:schema xmlns:xsd="http://www.w3.org/2001/XMLSchema"
+  xmlns="http://www.crossref.org/schema/4.4.2"
+  targetNamespace="http://www.crossref.org/schema/4.4.2"
+  elementFormDefault="qualified">
+  <xsd:include schemaLocation="common4.4.2.xsd"/>
+  <xsd:import namespace="http://www.crossref.org/relations.xsd"
+    schemaLocation="http://www.crossref.org/schemas/relations.xsd"/>
+  <xsd:element name="doi_batch">
+    <xsd:complexType>
+      <xsd:sequence>
+        <xsd:element ref="head"/>
+        <xsd:element name="body">
+          <xsd:complexType>
+            <xsd:sequence>
+              <xsd:any processContents="skip" maxOccurs="unbounded"/>
+            </xsd:sequence>
+          </xsd:complexType>
+        </xsd:element>
+      </xsd:sequence>
+      <xsd:attribute name="version" type="xsd:string" use="required"/>
+    </xsd:complexType>
+  </xsd:element>
+</xsd:schema>
+""",
+    'common4.4.2.xsd': """\
+<xsd:schema xmlns:xsd="http://www.w3.org/2001/XMLSchema"
+  xmlns="http://www.crossref.org/schema/4.4.2"
+  targetNamespace="http://www.crossref.org/schema/4.4.2"
+  elementFormDefault="qualified">
+  <xsd:element name="head">
+    <xsd:complexType>
+      <xsd:sequence>
+        <xsd:element name="doi_batch_id" type="xsd:string"/>
+        <xsd:element name="timestamp" type="xsd:integer"/>
+        <xsd:any processContents="skip" maxOccurs="unbounded"/>
+      </xsd:sequence>
+    </xsd:complexType>
+  </xsd:element>
+</xsd:schema>
+""",
+    'relations.xsd': """\
+<xsd:schema xmlns:xsd="http://www.w3.org/2001/XMLSchema"
+  targetNamespace="http://www.crossref.org/relations.xsd"/>
+""",
+}
+
+
+def test_validate_batch(monkeypatch):
+    with tempdir.TemporaryDirectory() as td:
+        monkeypatch.setattr(xreftools, 'schema_dir', td)
+        schema_path = os.path.join(td, 'crossref4.4.2.xsd')
+        with pytest.raises(IOError):
+            xreftools.load_schema(schema_path)
+
+        for name, content in schemas.items():
+            with io.open(os.path.join(td, name), 'w') as f:
+                f.write(content)
+        xref = xreftools.XrefMeta(scipy_entry, toc, slides)
+        batch = os.path.join(td, 'doi_batch')
+        xref.stream_metadata(batch)
+        errors, elapsed = xreftools.validate_batch(batch + '_papers.xml',
+                                                   schema_path)
+        assert errors == []
+        assert xreftools.load_schema(schema_path) is \
+            xreftools.load_schema(schema_path)
+
+        with io.open(batch + '_papers.xml', 'r', encoding='utf-8') as f:
+            content = f.read()
+        with io.open(batch + '_papers.xml', 'w', encoding='utf-8') as f:
+            f.write(re.sub('<timestamp>', '\n<timestamp>x', content))
+        errors, elapsed = xreftools.validate_batch(batch + '_papers.xml',
+                                                   schema_path)
+        assert len(errors) == 1
+        assert errors[0].startswith('2:0: ')
+        assert 'timestamp' in errors[0]
+
+
+def test_fetch_schemas(monkeypatch):
+    with tempdir.TemporaryDirectory() as td:
+        src = os.path.join(td, 'src')
+        os.makedirs(os.path.join(src, 'other'))
+        dest = os.path.join(td, 'dest')
+        os.mkdir(dest)
+        for name, content in schemas.items():
+            # One schema in another directory, referenced by absolute URL
+            path = os.path.join(src, 'other' if name == 'relations.xsd'
+                                else '', name)
+            content = content.replace(
+                'http://www.crossref.org/schemas/relations.xsd',
+                'file://%s/other/relations.xsd' % src)
+            with io.open(path, 'w') as f:
+                f.write(content)
+
+        names = xreftools.fetch_schemas(
+            'file://%s/crossref4.4.2.xsd' % src, dest)
+        assert names == sorted(schemas)
+        assert sorted(os.listdir(dest)) == sorted(schemas)
+        # Enough to validate offline
+        monkeypatch.setattr(xreftools, 'schema_dir', dest)
+        xreftools.load_schema(os.path.join(dest, 'crossref4.4.2.xsd'))
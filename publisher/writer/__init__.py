@@ -1,6 +1,9 @@
 from __future__ import unicode_literals
 
-__all__ = ['writer']
+__all__ = ['writer', 'get_writer', 'publish_tex']
+
+import copy
+import threading
 
 import docutils.core as dc
 import docutils.writers
@@ -12,7 +15,7 @@ from docutils.writers.latex2e import (Writer, LaTeXTranslator,
 from .rstmath import mathEnv
 from . import code_block
 
-from options import options
+from options import get_options
 
 try:
     from collections import OrderedDict
@@ -57,6 +60,8 @@ class Translator(LaTeXTranslator):
 
         self.figure_type = 'figure'
         self.figure_alignment = 'left'
+        # Images and the width they are printed at, see figures.py
+        self.figures = []
         self.table_type = 'table'
         self.settings.table_style = ['booktabs']
 
@@ -222,9 +227,9 @@ class Translator(LaTeXTranslator):
           Copyright\,\copyright\,%(year)s %(copyright_holder)s %(copyright)s%%
         ''' % \
         {'email': self.author_emails[0],
-         'year': options['proceedings']['year'],
+         'year': get_options()['proceedings']['year'],
          'copyright_holder': copyright_holder,
-         'copyright': options['proceedings']['copyright']['article']}
+         'copyright': get_options()['proceedings']['copyright']['article']}
 
         authors[-1] += r'\thanks{%s}' % author_notes
 
@@ -245,7 +250,7 @@ class Translator(LaTeXTranslator):
         marks = r'''
           \renewcommand{\leftmark}{%s}
           \renewcommand{\rightmark}{%s}
-        ''' % (options['proceedings']['title']['short'], title.upper())
+        ''' % (get_options()['proceedings']['title']['short'], title.upper())
         title_template += marks
 
         self.body_pre_docinfo = [title_template]
@@ -261,7 +266,8 @@ class Translator(LaTeXTranslator):
                                'keywords': self.keywords,
                                'copyright_holder': copyright_holder,
                                'video': self.video_url,
-                               'bibliography':self.bibliography}
+                               'bibliography':self.bibliography,
+                               'figures': self.figures}
 
         if hasattr(self, 'bibtex') and self.bibtex:
             self.document.stats.update({'bibliography': self.bibtex[1]})
@@ -355,6 +361,14 @@ class Translator(LaTeXTranslator):
         # Only add \columnwidth if scale or width have not been specified.
         if 'scale' not in node.attributes and 'width' not in node.attributes:
             figure_opts.append(r'width=\columnwidth')
+            # \columnwidth is the text width inside a figure*
+            printed_width = width[1:]
+        else:
+            printed_width = None
+
+        self.figures.append({'uri': filename,
+                             'width': printed_width,
+                             'scale': (scale or 100) / 100.})
 
         self.out.append(r'\noindent\makebox[%s][%s]' % (width, align[0]))
         self.out.append(r'{\includegraphics[%s]{%s}}' % (','.join(figure_opts),
@@ -417,9 +431,7 @@ class Translator(LaTeXTranslator):
 
         if 'language' in node.attributes:
             # do highlighting
-            from pygments import highlight
-            from pygments.lexers import PythonLexer, get_lexer_by_name
-            from pygments.formatters import LatexFormatter
+            from .highlight import highlight_latex
 
             extra_opts = 'fontsize=\\footnotesize'
 
@@ -428,11 +440,9 @@ class Translator(LaTeXTranslator):
             if linenos:
                 extra_opts += ',xleftmargin=2.25mm,numbersep=3pt'
 
-            lexer = get_lexer_by_name(node.attributes['language'])
-            tex = highlight(node.astext(), lexer,
-                            LatexFormatter(linenos=linenos,
-                                           linenostart=linenostart,
-                                           verboptions=extra_opts))
+            tex = highlight_latex(node.astext(), node.attributes['language'],
+                                  linenos=linenos, linenostart=linenostart,
+                                  verboptions=extra_opts)
 
             self.out.append('\\vspace{1mm}\n' + tex +
                             '\\vspace{1mm}\n')
@@ -476,3 +486,54 @@ class Translator(LaTeXTranslator):
 
 writer = Writer()
 writer.translator_class = Translator
+
+
+# Writers and docutils settings of each thread.  The directives and roles
+# (code_block, rstmath) are registered once, on import.
+_local = threading.local()
+
+
+def get_writer():
+    """Return the Writer of the current thread, creating it on first use.
+    """
+    if not hasattr(_local, 'writer'):
+        _local.writer = Writer()
+        _local.writer.translator_class = Translator
+        _local.settings = {}
+    return _local.writer
+
+
+def _get_settings(settings_overrides):
+    """Return the docutils settings for `settings_overrides`, reading the
+    docutils configuration files only the first time in each thread.
+    """
+    writer = get_writer()
+    key = tuple(sorted(settings_overrides.items()))
+    if key not in _local.settings:
+        pub = dc.Publisher(writer=writer)
+        pub.set_components('standalone', 'restructuredtext', None)
+        pub.process_programmatic_settings(None, settings_overrides, None)
+        _local.settings[key] = pub.settings
+    # docutils stores the source and destination in the settings, and
+    # adds the files a paper includes to its record_dependencies
+    return copy.deepcopy(_local.settings[key])
+
+
+def publish_tex(source, settings_overrides=None):
+    """Convert the reStructuredText `source` of a paper to LaTeX.
+
+    Returns the LaTeX and the paper stats gathered by the translator
+    (title, authors, ...), or None for the stats when the paper has no
+    title block.  Each thread converts with its own Writer, so papers can
+    be converted concurrently.
+    """
+    writer = get_writer()
+    settings = _get_settings(settings_overrides or {})
+    try:
+        tex = dc.publish_string(source=source, writer=writer,
+                                settings=settings)
+        stats = getattr(writer.document, 'stats', None)
+    finally:
+        # Do not hold on to the document tree until the next paper
+        writer.document = None
+    return tex, stats
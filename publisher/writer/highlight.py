@@ -0,0 +1,115 @@
+"""
+Syntax highlighting of code blocks with Pygments.
+
+Lexers and formatters are created once per process, and the LaTeX of
+every highlighted block is kept in ``conf.highlight_cache_dir`` under the
+hash of its code and options, so that rebuilding a paper only runs
+Pygments on the blocks that changed.  Only the `keep` most recently used
+blocks are kept.
+"""
+from __future__ import unicode_literals
+
+import hashlib
+import io
+import os
+import tempfile
+
+import pygments
+from pygments.lexers import get_lexer_by_name
+from pygments.formatters import LatexFormatter
+
+import conf
+import buildprofile
+from options import mkdir_p
+
+_lexers = {}
+_formatters = {}
+
+# Number of highlighted blocks kept in the cache
+keep = 2000
+
+
+def get_lexer(language):
+    try:
+        return _lexers[language]
+    except KeyError:
+        lexer = _lexers[language] = get_lexer_by_name(language)
+        return lexer
+
+
+def get_formatter(linenos, linenostart, verboptions):
+    key = (linenos, linenostart, verboptions)
+    try:
+        return _formatters[key]
+    except KeyError:
+        formatter = _formatters[key] = LatexFormatter(linenos=linenos,
+                                                      linenostart=linenostart,
+                                                      verboptions=verboptions)
+        return formatter
+
+
+def _cache_path(code, language, linenos, linenostart, verboptions):
+    h = hashlib.sha1()
+    for part in (pygments.__version__, language, linenos, linenostart,
+                 verboptions, code):
+        h.update(('%s\0' % part).encode('utf-8'))
+    return os.path.join(conf.highlight_cache_dir, h.hexdigest() + '.tex')
+
+
+def highlight_latex(code, language, linenos=False, linenostart=1,
+                    verboptions=''):
+    """Return the LaTeX of `code` highlighted as `language`.
+    """
+    path = None
+    if conf.use_build_cache:
+        path = _cache_path(code, language, linenos, linenostart, verboptions)
+        if os.path.exists(path):
+            with io.open(path, mode='r', encoding='utf-8') as f:
+                tex = f.read()
+            # Mark the entry as recently used, see `prune`
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+            return tex
+
+    with buildprofile.stage('pygments'):
+        tex = pygments.highlight(code, get_lexer(language),
+                                 get_formatter(linenos, linenostart,
+                                               verboptions))
+
+    if path is not None:
+        # Write to a scratch file and rename it into place, so that
+        # papers built in parallel never read a partial entry.
+        mkdir_p(conf.highlight_cache_dir)
+        fd, scratch = tempfile.mkstemp(dir=conf.highlight_cache_dir)
+        with io.open(fd, mode='w', encoding='utf-8') as f:
+            f.write(tex)
+        os.rename(scratch, path)
+        prune()
+    return tex
+
+
+def prune():
+    """Remove the least recently used blocks beyond the `keep` newest
+    from the cache.
+    """
+    try:
+        names = os.listdir(conf.highlight_cache_dir)
+    except OSError:
+        return
+    if len(names) <= keep:
+        return
+    entries = []
+    for name in names:
+        path = os.path.join(conf.highlight_cache_dir, name)
+        try:
+            entries.append((os.path.getmtime(path), path))
+        except OSError:
+            # Removed by another worker
+            continue
+    for mtime, path in sorted(entries, reverse=True)[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
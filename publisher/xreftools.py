@@ -15,12 +15,21 @@ at which point XrefMeta will need to be updated to implement to "proceedings
 series" schema.
 """
 
+import functools
 import lxml.etree as xml
+import os
+import sys
+from contextlib import contextmanager
 from nameparser import HumanName
 import time
 
+import options
+from conf import name_overrides_conf, schema_dir, xref_schema
 from doitools import make_batch_id
 
+# Number of parsed names kept in memory by split_name
+name_cache_size = 4096
+
 class XrefMeta:
 
     def __init__(self, scipy_conf, toc, slides):
@@ -35,26 +44,53 @@ class XrefMeta:
         Meant to be called before 'write_metadata'. Set echo=True
         to send doi_batch to STDOUT
         """
+        self.names = split_names(self.contributor_names())
         self.papers_batch = self.make_papers_batch()
         self.slides_batch = self.make_slides_batch()
         if echo:
             print(xml.dump(self.papers_batch))
             print(xml.dump(self.slides_batch))
 
+    def contributor_names(self):
+        """Return the names of all the authors, and of the depositor"""
+        names = [self.scipy_entry['proceedings']['xref']['depositor_name']]
+        for entry in self.toc_entries:
+            names.extend(entry.get('author', []))
+        for entries in self.slide_entries.values():
+            for entry in entries:
+                names.extend(entry.get('authors', []))
+        return names
+
+    def split_name(self, string):
+        """Split a name, looking it up in the names split by make_metadata"""
+        names = getattr(self, 'names', {})
+        if string in names:
+            return names[string]
+        return split_name(string)
+
     def make_batch(self):
         """Build the metametadata, including timestamp and depositor email
 
         The depositor email is super important, because that's who gets
         contacted if the submission fails
         """
+        batch = self.make_batch_element()
+        batch.append(self.make_head())
+        return batch
+
+    def make_batch_element(self):
+        """Build the empty doi_batch root element"""
         # lxml's implementation of xml location attributes is a little odd
         location = "{http://www.w3.org/2001/XMLSchema-instance}schemaLocation"
-        batch = xml.Element('doi_batch',
+        return xml.Element('doi_batch',
             version="4.4.2",
             xmlns="http://www.crossref.org/schema/4.4.2",
             attrib={location: "http://www.crossref.org/schema/4.4.2 http://www.crossref.org/schemas/crossref4.4.2.xsd"}
         )
-        head = xml.SubElement(batch, 'head')
+
+    def make_head(self):
+        """Build the head of a batch: timestamp and depositor"""
+        head = xml.Element('head')
         doi_batch_id = xml.SubElement(head, 'doi_batch_id')
         doi_batch_id.text = make_batch_id()
         timestamp = xml.SubElement(head, 'timestamp')
@@ -66,7 +102,7 @@ class XrefMeta:
         depositor_email_address.text = self.scipy_entry["proceedings"]["xref"]["depositor_email"]
         registrant = xml.SubElement(head, 'registrant')
         registrant.text = self.scipy_entry["proceedings"]["xref"]["registrant"]
-        return batch
+        return head
 
     def make_papers_batch(self):
         """Build the metadata for conference papers
@@ -87,7 +123,14 @@ class XrefMeta:
     def make_conference(self, body):
         """Build metadata for Scipy conference and individual papers"""
         conference = xml.SubElement(body, 'conference')
-        event_metadata = xml.SubElement(conference, 'event_metadata')
+        conference.append(self.make_event_metadata())
+        self.make_conference_proceedings(conference)
+        for entry in self.toc_entries:
+            self.make_conference_papers(conference, entry)
+
+    def make_event_metadata(self):
+        """Build metadata for the Scipy conference itself"""
+        event_metadata = xml.Element('event_metadata')
         conference_name = xml.SubElement(event_metadata, 'conference_name')
         conference_name.text = self.scipy_entry['proceedings']['title']['conference']
         conference_acronym = xml.SubElement(event_metadata, 'conference_acronym')
@@ -98,17 +141,18 @@ class XrefMeta:
         conference_location.text = self.scipy_entry['proceedings']['location']
         conference_date = xml.SubElement(event_metadata, 'conference_date')
         conference_date.text = ' '.join([self.scipy_entry['proceedings']['dates'], self.scipy_entry['proceedings']['year']])
-        self.make_conference_proceedings(conference)
-        for entry in self.toc_entries:
-            self.make_conference_papers(conference, entry)
-
+        return event_metadata
 
     def make_conference_proceedings(self, conference):
         """Build metadata for the conference proceedings object
 
         'no_isbn' must be 'simple_series' or CrossRef will refuse DOIs.
         """
-        proceedings_series_metadata = xml.SubElement(conference, 'proceedings_series_metadata')
+        conference.append(self.make_proceedings_series_metadata())
+
+    def make_proceedings_series_metadata(self):
+        """Build the proceedings_series_metadata of make_conference_proceedings"""
+        proceedings_series_metadata = xml.Element('proceedings_series_metadata')
         series_metadata = xml.SubElement(proceedings_series_metadata, 'series_metadata')
         titles = xml.SubElement(series_metadata, 'titles')
         title = xml.SubElement(titles, 'title')
@@ -142,15 +186,20 @@ class XrefMeta:
         proceedings_doi.text = self.scipy_entry["proceedings"]["doi"]
         proceedings_resource = xml.SubElement(proceedings_doi_data, 'resource')
         proceedings_resource.text = self.proceedings_url()
+        return proceedings_series_metadata
 
     def make_conference_papers(self, conference, entry):
         """Build metadata for all of the conference papers in a proceedings"""
-        paper = xml.SubElement(conference, "conference_paper")
+        conference.append(self.make_conference_paper(entry))
+
+    def make_conference_paper(self, entry):
+        """Build metadata for one conference paper"""
+        paper = xml.Element("conference_paper")
         paper_contributors = xml.SubElement(paper, 'contributors')
         for index, contributor in enumerate(entry.get('author', [])):
             # CrossRef has two kinds of authors: {'first', 'additional'}
             person_name = xml.SubElement(paper_contributors, 'person_name', contributor_role='author', sequence="additional" if index else "first") # first index value is 0
-            first_name, last_name = split_name(contributor)
+            first_name, last_name = self.split_name(contributor)
             given_name = xml.SubElement(person_name, 'given_name')
             given_name.text = first_name
             surname = xml.SubElement(person_name, 'surname')
@@ -171,16 +220,23 @@ class XrefMeta:
         paper_doi.text = entry['doi']
         paper_resource = xml.SubElement(paper_doi_data, 'resource')
         paper_resource.text = self.paper_url(entry['paper_id'])
+        return paper
 
     def make_database(self, body):
         """Build metadata for the location, or database, where we are putting
         presentations
         """
         database = xml.SubElement(body, 'database')
-        database_metadata = xml.SubElement(database, 'database_metadata', language='en')
+        database.append(self.make_database_metadata())
+        for entry in self.presentations():
+            self.make_dataset(database, entry)
+
+    def make_database_metadata(self):
+        """Build metadata for the database of presentations itself"""
+        database_metadata = xml.Element('database_metadata', language='en')
         contributors = xml.SubElement(database_metadata, 'contributors')
         person_name = xml.SubElement(contributors, 'person_name', contributor_role='editor', sequence='first')
-        first_name, last_name = split_name(self.scipy_entry['proceedings']['xref']['depositor_name'])
+        first_name, last_name = self.split_name(self.scipy_entry['proceedings']['xref']['depositor_name'])
         given_name = xml.SubElement(person_name, 'given_name')
         given_name.text = first_name
         surname = xml.SubElement(person_name, 'surname')
@@ -188,20 +244,28 @@ class XrefMeta:
         titles = xml.SubElement(database_metadata, 'titles')
         title = xml.SubElement(titles, 'title')
         title.text = self.scipy_entry['series']['title']['full']
+        return database_metadata
+
+    def presentations(self):
+        """Iterate over the presentations of all groups (slides, posters...)"""
         for group, entries in self.slide_entries.items():
             for entry in entries:
                 entry['group'] = group
-                self.make_dataset(database, entry)
+                yield entry
 
     def make_dataset(self, database, entry):
         """Build metadata for a single presentation
         """
-        dataset = xml.SubElement(database, "dataset", dataset_type='other')
+        database.append(self.make_presentation(entry))
+
+    def make_presentation(self, entry):
+        """Build the dataset element of a single presentation"""
+        dataset = xml.Element("dataset", dataset_type='other')
         dataset_contributors = xml.SubElement(dataset, 'contributors')
         for index, contributor in enumerate(entry.get('authors', [])):
             # CrossRef has two kinds of authors: {'first', 'additional'}
             person_name = xml.SubElement(dataset_contributors, 'person_name', contributor_role='author', sequence="additional" if index else "first") # first index value is 0
-            first_name, last_name = split_name(contributor)
+            first_name, last_name = self.split_name(contributor)
             given_name = xml.SubElement(person_name, 'given_name')
             given_name.text = first_name
             surname = xml.SubElement(person_name, 'surname')
@@ -224,12 +288,58 @@ class XrefMeta:
         doi.text = entry['doi']
         resource = xml.SubElement(doi_data, 'resource')
         resource.text = entry.get('zenodo_url', 'https://fake-url.place')
+        return dataset
 
     def write_metadata(self, filepath_root):
         """Dump doi metadata batches to filepath_root + suffix"""
         xml.ElementTree(self.papers_batch).write(filepath_root + '_papers.xml')
         xml.ElementTree(self.slides_batch).write(filepath_root + '_slides.xml')
 
+    def stream_metadata(self, filepath_root):
+        """Write doi metadata batches to filepath_root + suffix as they are
+        built, one paper or presentation at a time.
+
+        Does the same as 'make_metadata' followed by 'write_metadata', but
+        never holds more than one paper in memory, however long the TOC.
+        """
+        self.names = split_names(self.contributor_names())
+        with open(filepath_root + '_papers.xml', 'wb') as f:
+            self.stream_papers_batch(f)
+        with open(filepath_root + '_slides.xml', 'wb') as f:
+            self.stream_slides_batch(f)
+
+    @contextmanager
+    def _stream_batch(self, f):
+        """Open a batch and its body in the file `f`, for the caller to
+        write the body into
+        """
+        batch = self.make_batch_element()
+        with xml.xmlfile(f) as xf:
+            with xf.element(batch.tag, dict(batch.attrib), nsmap=batch.nsmap):
+                xf.write(self.make_head())
+                # The head goes out right away, the rest as it fills the
+                # buffer
+                xf.flush()
+                with xf.element('body'):
+                    yield xf
+
+    def stream_papers_batch(self, f):
+        """Write the metadata for conference papers to the file `f`"""
+        with self._stream_batch(f) as xf:
+            with xf.element('conference'):
+                xf.write(self.make_event_metadata())
+                xf.write(self.make_proceedings_series_metadata())
+                for entry in self.toc_entries:
+                    xf.write(self.make_conference_paper(entry))
+
+    def stream_slides_batch(self, f):
+        """Write the metadata for conference slides to the file `f`"""
+        with self._stream_batch(f) as xf:
+            with xf.element('database'):
+                xf.write(self.make_database_metadata())
+                for entry in self.presentations():
+                    xf.write(self.make_presentation(entry))
+
     def paper_url(self, paper_id):
         """Return the url where a particular paper will end up.
 
@@ -251,17 +361,191 @@ class XrefMeta:
         year = self.scipy_entry["proceedings"]['year']
         return  '/'.join([url_base, title+year])
 
+# Names nameparser gets wrong, or cannot split, by full name: see
+# load_name_overrides
+_name_overrides = None
+
+
+def load_name_overrides():
+    """Return the table of names split by hand, read once from
+    ``metadata/name_overrides.json``.
+
+    It maps a full name to its first and last name, e.g.
+    ``{"Guido van Rossum": ["Guido", "van Rossum"]}``, and takes precedence
+    over nameparser.  Add names that split_name reports as MISSING to it.
+    """
+    global _name_overrides
+    if _name_overrides is None:
+        _name_overrides = dict((name, tuple(split)) for name, split in
+                               options.cfg2dict(name_overrides_conf).items())
+    return _name_overrides
+
+
+@functools.lru_cache(maxsize=name_cache_size)
+def parse_name(string):
+    """Return the first and last name nameparser finds in `string`"""
+    name = HumanName(string)
+    return name.first, name.last
+
+
 def split_name(string, missing='MISSING'):
     """Splits human name into first and last components, as required by
     CrossRef schema rules.
 
     Names that cannot be parsed correctly will be replaced with 'MISSING' so
-    as to be easier for human eyes to spot.
+    as to be easier for human eyes to spot.  Names listed in
+    ``metadata/name_overrides.json`` are not parsed, see
+    load_name_overrides.
     """
-    name = HumanName(string)
-    first, last = name.first, name.last
+    overrides = load_name_overrides()
+    if string in overrides:
+        return overrides[string]
+    first, last = parse_name(string)
+    if not first or not last:
+        print('*** Warning: cannot split the name "%s", add it to %s'
+              % (string, name_overrides_conf))
     if not first:
         first = missing
     if not last:
         last = missing
     return first, last
+
+
+def split_names(names, missing='MISSING'):
+    """Split every name in `names` once, returning a dictionary of the
+    first and last name of each.
+    """
+    return dict((name, split_name(name, missing)) for name in set(names))
+
+
+# Where fetch_schemas downloads the CrossRef schema from
+xref_schema_url = 'https://www.crossref.org/schemas/crossref4.4.2.xsd'
+
+_xsd = '{http://www.w3.org/2001/XMLSchema}'
+
+
+def fetch_schemas(url=xref_schema_url, dest=schema_dir):
+    """Download the schema at `url`, and every schema it includes or
+    imports in turn, into `dest`, for load_schema to use offline.
+
+    Each schema is saved under the last part of its URL, the name
+    SchemaResolver looks for.  Returns the file names written.
+    """
+    from urllib.parse import urljoin
+    from urllib.request import urlopen
+
+    fetched = {}
+    todo = [url]
+    while todo:
+        url = todo.pop()
+        name = url.rstrip('/').split('/')[-1]
+        if name in fetched:
+            if fetched[name].split('://')[-1] != url.split('://')[-1]:
+                print("*** Warning: %s and %s are both saved as %s"
+                      % (fetched[name], url, name))
+            continue
+        fetched[name] = url
+        print("Fetching", url)
+        with urlopen(url) as response:
+            content = response.read()
+        with open(os.path.join(dest, name), 'wb') as f:
+            f.write(content)
+        schema = xml.fromstring(content, xml.XMLParser(no_network=True))
+        for ref in schema.iter(_xsd + 'include', _xsd + 'import',
+                               _xsd + 'redefine'):
+            if ref.get('schemaLocation'):
+                todo.append(urljoin(url, ref.get('schemaLocation')))
+    return sorted(fetched)
+
+
+class SchemaResolver(xml.Resolver):
+    """Resolve the schemas the CrossRef schema includes or imports, by URL
+    or relative path, to the copies of the same name in schema_dir.
+    """
+    def resolve(self, url, pubid, context):
+        path = os.path.join(schema_dir, url.rstrip('/').split('/')[-1])
+        if os.path.exists(path):
+            return self.resolve_filename(path, context)
+        # Left to fail, since the parser does not use the network
+        return None
+
+
+# The compiled CrossRef schema, see load_schema
+_schema = None
+
+
+def load_schema(path=xref_schema):
+    """Return the CrossRef schema in `path`, compiled on the first call.
+
+    The schema and everything it includes are read from schema_dir
+    (see schemas/README.md), never from the network.
+    """
+    global _schema
+    if _schema is not None and _schema[0] == path:
+        return _schema[1]
+    if not os.path.exists(path):
+        raise IOError("CrossRef schema not found: %s (see %s)"
+                      % (path, os.path.join(schema_dir, 'README.md')))
+    parser = xml.XMLParser(no_network=True)
+    parser.resolvers.add(SchemaResolver())
+    try:
+        schema = xml.XMLSchema(xml.parse(path, parser))
+    except xml.XMLSchemaParseError as e:
+        raise IOError("Cannot load the CrossRef schema %s: %s (every schema "
+                      "it includes or imports must be in %s)"
+                      % (path, e, schema_dir))
+    _schema = (path, schema)
+    return schema
+
+
+def validate_batch(filename, schema_path=xref_schema):
+    """Validate the DOI batch in `filename` against the CrossRef schema.
+
+    Returns the errors found, each as 'line:column: message (path)', and
+    the time taken, in seconds.
+    """
+    schema = load_schema(schema_path)
+    start = time.time()
+    parser = xml.XMLParser(no_network=True, resolve_entities=False)
+    doc = xml.parse(filename, parser)
+    valid = schema.validate(doc)
+    errors = [] if valid else ['%d:%d: %s (%s)' % (error.line, error.column,
+                                                   error.message, error.path)
+                               for error in schema.error_log]
+    return errors, time.time() - start
+
+
+def check_batch(filename):
+    """Validate the DOI batch in `filename`, printing the errors found and
+    the time taken.  Returns whether it is valid.
+    """
+    errors, elapsed = validate_batch(filename)
+    print("Validated %s in %.3fs: %s"
+          % (filename, elapsed,
+             '%d errors' % len(errors) if errors else 'valid'))
+    for error in errors:
+        print("  %s:%s" % (filename, error))
+    return not errors
+
+
+def validate_metadata(filepath_root):
+    """Validate the batches written by stream_metadata or write_metadata.
+    Returns whether both are valid.
+    """
+    results = [check_batch(filepath_root + suffix)
+               for suffix in ('_papers.xml', '_slides.xml')]
+    return all(results)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: xreftools.py doi_batch.xml ...")
+        print("       xreftools.py --fetch-schemas")
+        print("Validate DOI batches against the CrossRef schema in %s, "
+              "or download the schema there" % schema_dir)
+        sys.exit(-1)
+    if sys.argv[1:] == ['--fetch-schemas']:
+        fetch_schemas()
+        sys.exit(0)
+    results = [check_batch(filename) for filename in sys.argv[1:]]
+    sys.exit(0 if all(results) else 1)